@@ -0,0 +1,25 @@
+# Generated by Django 2.2.1 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('att_subscriptions', '0002_auto_20200701_0650'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attsubscription',
+            index=models.Index(fields=['user', 'id'], name='subs_att_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attsubscription',
+            index=models.Index(fields=['status', 'id'], name='subs_att_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attsubscription',
+            index=models.Index(fields=['phone_number', 'id'], name='subs_att_phone_idx'),
+        ),
+    ]
@@ -5,7 +5,7 @@ from django.db import models
 from model_utils import Choices
 
 from wt.plans.models import Plan
-from wt.subscriptions.models import Subscription
+from wt.subscriptions.models import SUBSCRIPTION_TYPES, Subscription
 
 
 class ATTSubscription(Subscription):
@@ -22,5 +22,13 @@ class ATTSubscription(Subscription):
     status = models.CharField(max_length=10, choices=STATUS, default=STATUS.new)
     network_type = models.CharField(max_length=5, blank=True, default='')
 
+    SUBSCRIPTION_TYPE = SUBSCRIPTION_TYPES.att
+
     class Meta:
         db_table = 'subscriptions_att'
+        indexes = [
+            # filtered list endpoint is paginated by id
+            models.Index(fields=['user', 'id'], name='subs_att_user_idx'),
+            models.Index(fields=['status', 'id'], name='subs_att_status_idx'),
+            models.Index(fields=['phone_number', 'id'], name='subs_att_phone_idx'),
+        ]
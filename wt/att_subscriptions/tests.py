@@ -1,3 +1,54 @@
-from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
 
-# Create your tests here.
+from wt.att_subscriptions.models import ATTSubscription
+from wt.att_subscriptions.serializers import ATTSubscriptionSerializer
+from wt.tests import BaseAPITestCase
+
+
+class ATTSubscriptionListTestCase(BaseAPITestCase):
+    url = reverse('api:attsubscription-list')
+
+    def test_pagination(self):
+        subs = [self.create_att() for _ in range(5)]
+
+        ids = []
+        url = f'{self.url}?page_size=2'
+        while url is not None:
+            # keyset pagination doesn't count rows: one query per page
+            with self.assertNumQueries(1):
+                response = self.client.get(url).json()
+            ids.extend(sub['id'] for sub in response['results'])
+            url = response['next']
+        self.assertEqual(ids, [sub.id for sub in subs])
+
+    def test_filters(self):
+        subs = [self.create_att() for _ in range(3)]
+        ATTSubscription.objects.filter(id=subs[1].id).update(status=ATTSubscription.STATUS.active, phone_number='1')
+
+        response = self.client.get(self.url, {'status': 'active'}).json()
+        self.assertEqual([sub['id'] for sub in response['results']], [subs[1].id])
+        response = self.client.get(self.url, {'phone_number': 'test', 'user': self.user.id}).json()
+        self.assertEqual([sub['id'] for sub in response['results']], [subs[0].id, subs[2].id])
+
+        response = self.client.get(self.url, {'user': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'user'})
+
+    def test_fast_serialization(self):
+        subs = [self.create_att() for _ in range(3)]
+        ATTSubscription.objects.filter(id=subs[1].id).update(network_type='\u2028', phone_number='тест"')
+
+        # JSON is rendered from `values_list()` rows and equals JSON of DRF serializer of model instances
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = ATTSubscriptionSerializer(ATTSubscription.objects.order_by('id'), many=True).data
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render({'next': None, 'previous': None, 'results': data})
+        )
+
+        # browsable API serializes model instances
+        response = self.client.get(self.url, {'format': 'api'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], data)
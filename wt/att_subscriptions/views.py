@@ -3,11 +3,13 @@ from rest_framework.response import Response
 
 from wt.att_subscriptions.models import ATTSubscription
 from wt.att_subscriptions.serializers import ATTSubscriptionSerializer
+from wt.serialization import FastListModelMixin
 
 
-class ATTSubscriptionViewSet(viewsets.ModelViewSet):
+class ATTSubscriptionViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     A viewset that provides `retrieve`, `create`, and `list` actions.
     """
     queryset = ATTSubscription.objects.all()
     serializer_class = ATTSubscriptionSerializer
+    filter_fields = {'user': 'user_id', 'status': 'status', 'phone_number': 'phone_number'}
@@ -0,0 +1,24 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class FieldFilterBackend(BaseFilterBackend):
+    """Filters list by exact values of query parameters listed in `filter_fields` of view (query parameter name to
+        lookup). Values are converted by model fields of lookups, invalid values are rejected with 400. Filtered fields
+        are expected to be indexed together with primary key used by pagination"""
+
+    def filter_queryset(self, request, queryset, view):
+        lookups = {}
+        errors = {}
+        for param, lookup in getattr(view, 'filter_fields', {}).items():
+            if param not in request.query_params:
+                continue
+            field = queryset.model._meta.get_field(lookup)
+            try:
+                lookups[lookup] = field.to_python(request.query_params[param])
+            except DjangoValidationError as exc:
+                errors[param] = exc.messages
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**lookups) if lookups else queryset
@@ -2,9 +2,10 @@ from rest_framework import viewsets
 
 from wt.plans.models import Plan
 from wt.plans.serializers import PlanSerializer
+from wt.serialization import FastListModelMixin
 
 
-class PlanViewSet(viewsets.ReadOnlyModelViewSet):
+class PlanViewSet(FastListModelMixin, viewsets.ReadOnlyModelViewSet):
     """
     A viewset that provides `retrieve`, `create`, and `list` actions.
     """
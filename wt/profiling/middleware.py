@@ -0,0 +1,28 @@
+import random
+
+from django.conf import settings
+
+from .recorder import HISTOGRAMS, profile_request
+
+
+class QueryProfilingMiddleware:
+    """Profiles sampled requests (`settings.PROFILING_SAMPLE_RATE`): adds `Server-Timing` header with SQL time and
+        count of queries, time of sections and total time, and folds the profile into histograms of the view. Requests
+        that aren't sampled cost one random number"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = settings.PROFILING_SAMPLE_RATE
+        if not sample_rate or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        with profile_request() as profile:
+            response = self.get_response(request)
+
+        # content of streaming responses is produced later and isn't profiled
+        response['Server-Timing'] = profile.get_server_timing()
+        match = request.resolver_match
+        HISTOGRAMS.add(match.view_name if match is not None else 'unresolved', profile)
+        return response
@@ -0,0 +1,171 @@
+"""Per-request profile of sampled requests: count and time of SQL queries (by `execute_wrapper` of every database
+connection), the slowest statements and time of named sections (e.g. serialization) excluding SQL executed within them.
+
+Profiles are folded into in-process histograms by view (`HISTOGRAMS`), so memory usage doesn't depend on count of
+requests. Every process (worker) keeps its own histograms.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+# upper bounds (milliseconds or queries) of histogram buckets, the last bucket is unbounded
+DURATION_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+SQL_MAX_LENGTH = 500
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """Profile of one request. Is the `execute_wrapper` of database connections while request is handled"""
+
+    def __init__(self, slowest_count: int):
+        self.started = time.monotonic()
+        self.total_ms = 0.0
+        self.query_count = 0
+        self.sql_ms = 0.0
+        self.sections: Dict[str, float] = {}
+        self.slowest_count = slowest_count
+        self.slowest: List[Tuple[float, str]] = []  # min-heap of (milliseconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.monotonic() - started) * 1000
+            self.query_count += 1
+            self.sql_ms += duration
+            if self.slowest_count:
+                item = (duration, sql[:SQL_MAX_LENGTH])
+                if len(self.slowest) < self.slowest_count:
+                    heapq.heappush(self.slowest, item)
+                elif duration > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, item)
+
+    def finish(self) -> None:
+        self.total_ms = (time.monotonic() - self.started) * 1000
+
+    def get_server_timing(self) -> str:
+        """Returns value of `Server-Timing` header"""
+        metrics = [f'db;dur={self.sql_ms:.2f};desc="{self.query_count} queries"']
+        metrics.extend(f'{name};dur={duration:.2f}' for name, duration in self.sections.items())
+        metrics.append(f'total;dur={self.total_ms:.2f}')
+        return ', '.join(metrics)
+
+
+def get_current_profile() -> Optional[RequestProfile]:
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def profile_request():
+    """Profiles queries of all database connections of the current thread within the block"""
+    profile = RequestProfile(settings.PROFILING_SLOWEST_QUERIES)
+    _local.profile = profile
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            yield profile
+    finally:
+        profile.finish()
+        _local.profile = None
+
+
+@contextmanager
+def section(name: str):
+    """Adds time of the block to named section of the current profile excluding SQL executed within it. Does nothing
+        for requests that aren't sampled"""
+    profile = get_current_profile()
+    if profile is None:
+        yield
+        return
+
+    started, sql_ms = time.monotonic(), profile.sql_ms
+    try:
+        yield
+    finally:
+        duration = (time.monotonic() - started) * 1000 - (profile.sql_ms - sql_ms)
+        profile.sections[name] = profile.sections.get(name, 0.0) + duration
+
+
+class Histogram:
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        labels = [f'le_{bound}' for bound in self.bounds] + ['inf']
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.sum, 2), 'max': round(self.max, 2)}
+
+
+class ViewHistograms:
+    """Histograms of profiles of one view"""
+
+    def __init__(self, slowest_count: int):
+        self.requests = 0
+        self.queries = Histogram(COUNT_BUCKETS)
+        self.sql_ms = Histogram(DURATION_BUCKETS)
+        self.total_ms = Histogram(DURATION_BUCKETS)
+        self.sections: Dict[str, Histogram] = {}
+        self.slowest_count = slowest_count
+        self.slowest: List[Tuple[float, str]] = []
+
+    def add(self, profile: RequestProfile) -> None:
+        self.requests += 1
+        self.queries.add(profile.query_count)
+        self.sql_ms.add(profile.sql_ms)
+        self.total_ms.add(profile.total_ms)
+        for name, duration in profile.sections.items():
+            self.sections.setdefault(name, Histogram(DURATION_BUCKETS)).add(duration)
+        self.slowest = heapq.nlargest(self.slowest_count, self.slowest + profile.slowest)
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'queries': self.queries.to_dict(),
+            'sql_ms': self.sql_ms.to_dict(),
+            'total_ms': self.total_ms.to_dict(),
+            'sections_ms': {name: histogram.to_dict() for name, histogram in self.sections.items()},
+            'slowest_queries': [{'ms': round(duration, 2), 'sql': sql} for duration, sql in self.slowest],
+        }
+
+
+class HistogramRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views: Dict[str, ViewHistograms] = {}
+
+    def add(self, view_name: str, profile: RequestProfile) -> None:
+        with self.lock:
+            histograms = self.views.get(view_name)
+            if histograms is None:
+                histograms = self.views[view_name] = ViewHistograms(settings.PROFILING_SLOWEST_QUERIES)
+            histograms.add(profile)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {view_name: histograms.to_dict() for view_name, histograms in sorted(self.views.items())}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.views.clear()
+
+
+HISTOGRAMS = HistogramRegistry()
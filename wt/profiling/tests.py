@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from rest_framework.reverse import reverse
+
+from wt.profiling.recorder import HISTOGRAMS
+from wt.tests import BaseAPITestCase
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class QueryProfilingTestCase(BaseAPITestCase):
+    url = reverse('profiling-histograms')
+
+    def setUp(self):
+        super().setUp()
+        HISTOGRAMS.clear()
+
+    def send(self):
+        return self.client.post(reverse('stats-usage-metrics'), data={
+            'usage_type': 'data', 'from_date': self.today_date, 'to_date': self.tomorrow_date
+        })
+
+    def test_server_timing(self):
+        self.create_basic_test_set()
+
+        with self.assertNumQueries(2) as context:
+            response = self.send()
+        self.assertEqual(response.status_code, 200)
+
+        metrics = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(list(metrics), ['db', 'serialize', 'total'])
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"', metrics['db'])
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        self.assertNotIn('Server-Timing', self.send())
+        self.assertEqual(HISTOGRAMS.to_dict(), {})
+
+    def test_histograms(self):
+        self.create_basic_test_set()
+        self.send()
+        # cached report is served without queries
+        self.send()
+
+        # histograms are available to admins only
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        admin = get_user_model().objects.create_superuser(username='admin', email='admin@example.com', password='123')
+        self.client.force_authenticate(admin)
+
+        histograms = self.client.get(self.url).json()
+        view = histograms['stats-usage-metrics']
+        self.assertEqual(view['requests'], 2)
+        self.assertEqual(view['queries']['sum'], 2)
+        self.assertEqual((view['queries']['buckets']['le_0'], view['queries']['buckets']['le_2']), (1, 1))
+        self.assertEqual(sum(view['sections_ms']['serialize']['buckets'].values()), 1)
+        self.assertEqual(len(view['slowest_queries']), 2)
+
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertNotIn('stats-usage-metrics', self.client.get(self.url).json())
@@ -0,0 +1,18 @@
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .recorder import HISTOGRAMS
+
+
+class ProfilingHistogramsView(APIView):
+    """Dumps histograms of profiled requests of this process by view (`DELETE` resets them)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(HISTOGRAMS.to_dict())
+
+    def delete(self, request):
+        HISTOGRAMS.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -28,3 +28,8 @@ class Purchase(models.Model):
 
     class Meta:
         db_table = 'purchases'
+        indexes = [
+            # filtered list endpoint is paginated by id
+            models.Index(fields=['user', 'id'], name='purchases_user_idx'),
+            models.Index(fields=['status', 'id'], name='purchases_status_idx'),
+        ]
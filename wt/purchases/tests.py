@@ -1,3 +1,30 @@
-from django.test import TestCase
+from rest_framework.reverse import reverse
 
-# Create your tests here.
+from wt.purchases.models import Purchase
+from wt.tests import BaseAPITestCase
+
+
+class PurchaseListTestCase(BaseAPITestCase):
+    url = reverse('api:purchase-list')
+
+    def test_filters(self):
+        sub_att, sub_sprint = self.create_att(), self.create_sprint()
+        purchases = [
+            Purchase.objects.create(user=self.user, att_sub=sub_att, amount='1.00'),
+            Purchase.objects.create(user=self.user, sprint_sub=sub_sprint, amount='2.00'),
+            Purchase.objects.create(
+                user=self.user, att_sub=sub_att, amount='3.00', status=Purchase.STATUS.complete
+            ),
+        ]
+
+        response = self.client.get(self.url, {'att_sub': sub_att.id}).json()
+        self.assertEqual([purchase['id'] for purchase in response['results']], [purchases[0].id, purchases[2].id])
+        response = self.client.get(self.url, {'sprint_sub': sub_sprint.id, 'user': self.user.id}).json()
+        self.assertEqual([purchase['id'] for purchase in response['results']], [purchases[1].id])
+        response = self.client.get(self.url, {'status': 'complete'}).json()
+        self.assertEqual([purchase['id'] for purchase in response['results']], [purchases[2].id])
+
+    def test_incorrect_filters(self):
+        response = self.client.get(self.url, {'att_sub': '', 'sprint_sub': 'abc', 'status': 'pending'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'att_sub', 'sprint_sub'})
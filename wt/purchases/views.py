@@ -2,11 +2,15 @@ from rest_framework import viewsets
 
 from wt.purchases.models import Purchase
 from wt.purchases.serializers import PurchaseSerializer
+from wt.serialization import FastListModelMixin
 
 
-class PurchaseViewSet(viewsets.ModelViewSet):
+class PurchaseViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     A viewset that provides `retrieve`, `create`, and `list` actions.
     """
     queryset = Purchase.objects.all()
     serializer_class = PurchaseSerializer
+    filter_fields = {
+        'user': 'user_id', 'status': 'status', 'att_sub': 'att_sub_id', 'sprint_sub': 'sprint_sub_id'
+    }
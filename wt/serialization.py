@@ -0,0 +1,240 @@
+"""Fast read path of DRF serializers for high-volume lists.
+
+`RowSerializer` compiles fields of a read-only DRF serializer once into closures that read, convert and encode one
+column of a row. Rows are converted without DRF field machinery (`get_attribute`, `to_representation` dispatch and
+`SkipField` handling per field), either to dicts or straight to JSON text in the format of `JSONRenderer`. Output is
+identical to the output of the DRF serializer.
+
+Rows are dicts (e.g. `.values()` or report rows) keyed by field sources. `SerializerMethodField`s are compiled by
+`fast_fields` attribute of serializer: field name to (source, converter of the source value). Fields may provide their
+own converter with `get_fast_converter()` method.
+"""
+import decimal
+import json
+
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable, List, Tuple, Type
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from rest_framework import fields as drf_fields, relations, serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+Converter = Callable[[object], object]
+
+# the same encoding as `rest_framework.renderers.JSONRenderer` with default settings
+_encoder = JSONEncoder(ensure_ascii=not api_settings.UNICODE_JSON, separators=(',', ':'))
+_encode_string = getattr(json.encoder, 'c_encode_basestring', None) or json.encoder.py_encode_basestring
+
+
+def encode_json(value) -> str:
+    return _encoder.encode(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def encode_json_string(value: str) -> str:
+    if not api_settings.UNICODE_JSON:
+        return encode_json(value)
+    return _encode_string(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def get_decimal_converter(field: drf_fields.DecimalField) -> Converter:
+    """Returns converter equal to `DecimalField.to_representation` with quantization context built once"""
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize:
+        return field.to_representation
+
+    Decimal = decimal.Decimal
+    to_string = '{0:f}'.format
+    if field.decimal_places is None:
+        def convert(value):
+            if type(value) is not Decimal:
+                value = Decimal(str(value).strip())
+            return to_string(value) if coerce_to_string else value
+        return convert
+
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    exponent = Decimal('.1') ** field.decimal_places
+    rounding = field.rounding
+
+    def convert(value):
+        if type(value) is not Decimal:
+            value = Decimal(str(value).strip())
+        value = value.quantize(exponent, rounding, context)
+        return to_string(value) if coerce_to_string else value
+
+    return convert
+
+
+def get_converter(field: drf_fields.Field) -> Converter:
+    """Returns converter of not None value equal to `to_representation` of field"""
+    if hasattr(field, 'get_fast_converter'):
+        return field.get_fast_converter()
+
+    to_representation = type(field).to_representation
+    if to_representation is drf_fields.IntegerField.to_representation:
+        return int
+    if to_representation is drf_fields.CharField.to_representation:
+        return str
+    if to_representation is drf_fields.DecimalField.to_representation:
+        return get_decimal_converter(field)
+    if to_representation is relations.PrimaryKeyRelatedField.to_representation and field.pk_field is None:
+        # values of foreign key columns are primary keys already
+        return lambda value: value
+    if to_representation is drf_fields.ListField.to_representation:
+        child = get_converter(field.child)
+        return lambda value: [child(item) if item is not None else None for item in value]
+    return field.to_representation
+
+
+def encode_json_value(value) -> str:
+    """Encodes not None representation of method field"""
+    value_type = type(value)
+    if value_type is str:
+        return encode_json_string(value)
+    if value_type is int:
+        return str(value)
+    return encode_json(value)
+
+
+def get_json_encoder(field: drf_fields.Field) -> Callable[[object], str]:
+    """Returns JSON encoder of not None representation of field"""
+    to_representation = type(field).to_representation
+    if to_representation is drf_fields.IntegerField.to_representation:
+        return str
+    if to_representation is drf_fields.CharField.to_representation:
+        return encode_json_string
+    is_decimal = to_representation is drf_fields.DecimalField.to_representation or (
+        isinstance(field, drf_fields.DecimalField) and hasattr(field, 'get_fast_converter')
+    )
+    if is_decimal and not field.localize and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        # digits, sign and point don't need escaping
+        return lambda value: '"' + value + '"'
+    return encode_json
+
+
+def get_representer(source: str, converter: Converter, check_none: bool) -> Callable[[dict], object]:
+    """Returns function of row that reads value of field from row and converts it"""
+    if not check_none:
+        return lambda row: converter(row[source])
+
+    def represent(row):
+        value = row[source]
+        return None if value is None else converter(value)
+
+    return represent
+
+
+def get_json_writer(
+        source: str,
+        converter: Converter,
+        check_none: bool,
+        encoder: Callable[[object], str],
+) -> Callable[[dict], str]:
+    """Returns function of row that reads value of field from row, converts and encodes it to JSON"""
+    if not check_none:
+        def write(row):
+            value = converter(row[source])
+            return 'null' if value is None else encoder(value)
+        return write
+
+    def write(row):
+        value = row[source]
+        if value is None:
+            return 'null'
+        value = converter(value)
+        return 'null' if value is None else encoder(value)
+
+    return write
+
+
+class RowSerializer:
+    """Compiled read path of serializer class for dict rows keyed by field sources. Use `get_row_serializer` to share
+        compiled instances"""
+
+    def __init__(self, serializer_class: Type[serializers.Serializer]):
+        serializer = serializer_class()
+        fast_fields = getattr(serializer_class, 'fast_fields', {})
+
+        # (name, source, converter, check of None, JSON encoder)
+        fields: List[Tuple[str, str, Converter, bool, Callable[[object], str]]] = []
+        for field in serializer._readable_fields:
+            if field.field_name in fast_fields:
+                source, converter = fast_fields[field.field_name]
+                fields.append((field.field_name, source, converter, False, encode_json_value))
+                continue
+            if isinstance(field, drf_fields.SerializerMethodField):
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{field.field_name}: method fields should be listed in `fast_fields`'
+                )
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{field.field_name}: nested sources are not supported'
+                )
+            fields.append((field.field_name, field.source, get_converter(field), True, get_json_encoder(field)))
+
+        # columns to select for rows of serializer
+        self.columns = list(OrderedDict.fromkeys(source for _, source, _, _, _ in fields))
+        self.representers = [
+            (name, get_representer(source, converter, check_none))
+            for name, source, converter, check_none, _ in fields
+        ]
+        self.json_writers = [
+            get_json_writer(source, converter, check_none, encoder)
+            for _, source, converter, check_none, encoder in fields
+        ]
+        # JSON object with a placeholder per field
+        self.json_template = '{' + ','.join(
+            encode_json_string(name).replace('%', '%%') + ':%s' for name, *_ in fields
+        ) + '}'
+
+    def to_representation(self, row: dict) -> OrderedDict:
+        return OrderedDict([(name, represent(row)) for name, represent in self.representers])
+
+    def to_json(self, row: dict) -> str:
+        return self.json_template % tuple([write(row) for write in self.json_writers])
+
+    def to_json_array(self, rows: Iterable[dict]) -> str:
+        return '[' + ','.join(map(self.to_json, rows)) + ']'
+
+
+@lru_cache(maxsize=None)
+def get_row_serializer(serializer_class: Type[serializers.Serializer]) -> RowSerializer:
+    """Returns compiled read path of serializer class (compiled once per class)"""
+    return RowSerializer(serializer_class)
+
+
+def serialize_rows(serializer_class: Type[serializers.Serializer], rows: Iterable) -> List[OrderedDict]:
+    """Equivalent of `serializer_class(rows, many=True).data` for dict rows"""
+    return list(map(get_row_serializer(serializer_class).to_representation, rows))
+
+
+class FastListModelMixin:
+    """List action of model viewset that selects `values()` of serialized fields and renders JSON straight from them
+        instead of serializing model instances. Other renderers (e.g. browsable API) use regular serializer"""
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        serializer = get_row_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset())
+        # cursor pagination reads position of the last row from its dict (DRF `CursorPagination` supports dict rows),
+        # so the primary key is selected even if it isn't serialized
+        pk = queryset.model._meta.pk.name
+        columns = serializer.columns if pk in serializer.columns else [pk, *serializer.columns]
+        queryset = queryset.values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return HttpResponse(serializer.to_json_array(queryset), content_type='application/json')
+
+        results = serializer.to_json_array(page)
+        data = self.get_paginated_response([]).data
+        content = '{' + ','.join(
+            encode_json_string(key) + ':' + (results if key == 'results' else encode_json(value))
+            for key, value in data.items()
+        ) + '}'
+        return HttpResponse(content, content_type='application/json')
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'wt.sprint_subscriptions.apps.SprintSubscriptionsConfig',
     'wt.usage.apps.UsageConfig',
     'wt.stats.apps.StatsConfig',
+    'wt.profiling.apps.ProfilingConfig',
 ]
 
 MIDDLEWARE = [
@@ -55,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'wt.profiling.middleware.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'wt.urls'
@@ -126,3 +128,68 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # stats reports: local-memory backend evicts least recently used entries above MAX_ENTRIES. Generations of usage
+    # (`wt.stats.cache`) live in this cache, so it should be shared by every process that writes usage or serves
+    # reports (e.g. Memcached or Redis) when there is more than one: with a local-memory backend invalidation never
+    # leaves the writing process (another WSGI worker, `rollup_usage`, `run_report_jobs`) and other processes serve
+    # stale reports up to TIMEOUT
+    'stats': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stats',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+
+# REST framework
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'wt.pagination.IdCursorPagination',
+    'DEFAULT_FILTER_BACKENDS': ['wt.filters.FieldFilterBackend'],
+}
+
+# page size of list endpoints, when request doesn't specify `page_size`
+API_PAGE_SIZE = 100
+
+API_MAX_PAGE_SIZE = 1000
+
+
+# Stats
+
+# cache alias for stats reports, None disables caching
+STATS_CACHE_ALIAS = 'stats'
+
+# page size of paginated stats reports, when request specifies cursor only
+STATS_PAGE_SIZE = 1000
+
+STATS_MAX_PAGE_SIZE = 10000
+
+STATS_MAX_TOP_COUNT = 1000
+
+# asynchronous report jobs: running job is claimed again by another worker after timeout (seconds)
+STATS_REPORT_JOB_TIMEOUT = 3600
+
+STATS_REPORT_JOB_POLL_INTERVAL = 1.0
+
+STATS_REPORT_JOB_CLAIM_BATCH = 10
+
+
+# Profiling
+
+# share of requests profiled by `wt.profiling.middleware.QueryProfilingMiddleware`, 0 disables profiling
+PROFILING_SAMPLE_RATE = 0.01
+
+# count of the slowest SQL statements kept per request and per view
+PROFILING_SLOWEST_QUERIES = 5
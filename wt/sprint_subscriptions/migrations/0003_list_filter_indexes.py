@@ -0,0 +1,25 @@
+# Generated by Django 2.2.1 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprint_subscriptions', '0002_auto_20200701_0649'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sprintsubscription',
+            index=models.Index(fields=['user', 'id'], name='subs_sprint_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sprintsubscription',
+            index=models.Index(fields=['status', 'id'], name='subs_sprint_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sprintsubscription',
+            index=models.Index(fields=['phone_number', 'id'], name='subs_sprint_phone_idx'),
+        ),
+    ]
@@ -6,7 +6,7 @@ from django.db import models
 from model_utils import Choices
 
 from wt.plans.models import Plan
-from wt.subscriptions.models import Subscription
+from wt.subscriptions.models import SUBSCRIPTION_TYPES, Subscription
 
 
 class SprintSubscription(Subscription):
@@ -23,5 +23,13 @@ class SprintSubscription(Subscription):
     status = models.CharField(max_length=10, choices=STATUS, default=STATUS.new)
     sprint_id = models.CharField(max_length=16, null=True)
 
+    SUBSCRIPTION_TYPE = SUBSCRIPTION_TYPES.sprint
+
     class Meta:
         db_table = 'subscriptions_sprint'
+        indexes = [
+            # filtered list endpoint is paginated by id
+            models.Index(fields=['user', 'id'], name='subs_sprint_user_idx'),
+            models.Index(fields=['status', 'id'], name='subs_sprint_status_idx'),
+            models.Index(fields=['phone_number', 'id'], name='subs_sprint_phone_idx'),
+        ]
@@ -1,3 +1,22 @@
-from django.test import TestCase
+from rest_framework.reverse import reverse
 
-# Create your tests here.
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.tests import BaseAPITestCase
+
+
+class SprintSubscriptionListTestCase(BaseAPITestCase):
+    url = reverse('api:sprintsubscription-list')
+
+    def test_filters(self):
+        subs = [self.create_sprint() for _ in range(3)]
+        SprintSubscription.objects.filter(id=subs[2].id).update(status=SprintSubscription.STATUS.active)
+
+        response = self.client.get(self.url, {'status': 'active'}).json()
+        self.assertEqual([sub['id'] for sub in response['results']], [subs[2].id])
+        response = self.client.get(self.url, {'status': 'new', 'user': self.user.id}).json()
+        self.assertEqual([sub['id'] for sub in response['results']], [subs[0].id, subs[1].id])
+
+    def test_incorrect_filters(self):
+        response = self.client.get(self.url, {'user': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'user'})
@@ -2,11 +2,13 @@ from wt.sprint_subscriptions.models import SprintSubscription
 from django.http import HttpResponse
 from rest_framework import viewsets
 from wt.sprint_subscriptions.serializers import SprintSubscriptionSerializer
+from wt.serialization import FastListModelMixin
 
 
-class SprintSubscriptionViewSet(viewsets.ModelViewSet):
+class SprintSubscriptionViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     A viewset that provides `retrieve`, `create`, and `list` actions.
     """
     queryset = SprintSubscription.objects.all()
     serializer_class = SprintSubscriptionSerializer
+    filter_fields = {'user': 'user_id', 'status': 'status', 'phone_number': 'phone_number'}
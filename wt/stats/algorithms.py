@@ -1,78 +1,289 @@
 import datetime
+import heapq
+
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator, List, Optional, Tuple
 
 from django.db import models
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
 
-from wt.usage.base_models import UsageRecord
-from wt.usage.managers import UsageQuerySet
-from wt.usage.models import DataUsageRecord, VoiceUsageRecord
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
+from wt.usage.managers import UsageQuerySet, subscription_key_after
+from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord, DataUsageRecord, VoiceUsageRecord
+from wt.usage.models import SubscriptionUsageTotal
 
+AGGREGATED_MODELS = {
+    DataUsageRecord: AggregatedDataUsageRecord,
+    VoiceUsageRecord: AggregatedVoiceUsageRecord,
+}
 
-def get_exceeding_subscriptions(initial_query: models.QuerySet, limit: float) -> models.QuerySet:
-    """This function takes initial queryset on subscription model (ATT or Spring) and annotates it with new field
-        (`subscription_type`) contains class name of subscription model and fields (`agg_data_usage_exceeds`,
-        `agg_voice_usage_exceeds`) containing information on exceeding given `limit` for all types of usage
+# count of subscriptions fetched by one query of usage metrics
+METRICS_CHUNK_SIZE = 2000
 
-    Args:
-        initial_query (QuerySet): initial queryset on child model of wt.usage.base_models.UsageRecord
-        limit (float): field name on initial_query to aggregate sum
+# time buckets of usage series
+SERIES_BUCKETS = ['hour', 'day', 'week', 'month']
 
-    Returns:
-        Queryset: annotated initial queryset
+# ordering of top subscriptions by usage metrics
+TOP_ORDER_FIELDS = {
+    'usage': 'agg_usage',
+    'price': 'agg_price',
+}
+
+
+def get_exceeding_totals(limit: Decimal, after: Optional[Tuple[int, int]] = None) -> models.QuerySet:
+    """Returns exceeding report of subscriptions of all types in one grouped query over running totals
+        (`wt.usage.models.SubscriptionUsageTotal`): totals exceeding given `limit` are selected by indexed range scan
+        and grouped by subscription. Returns queryset of dicts with fields `id_field`, `id_value`,
+        `agg_data_usage_exceeds` and `agg_voice_usage_exceeds` (zero for usage type that doesn't exceed limit)
+
+    Args:
+        limit (Decimal): price limit
+        after (Tuple[int, int], Optional): return only subscriptions following given (`subscription_type`,
+            `subscription_id`) key (keyset pagination)
     """
-    query = initial_query
-    # annotate subscription queryset with common for this project interface `id_value` and `id_field`
-    query = query.annotate(
-        id_value=models.F('id'),
-        id_field=models.Value(UsageRecord.get_related_field_name_by_model(query.model), output_field=models.CharField())
+    # equality on the leading column of (`subscription_type`, `price`) index lets the range condition use it
+    query = SubscriptionUsageTotal.objects.filter(
+        subscription_type__in=[subscription_type for subscription_type, _ in SUBSCRIPTION_TYPES], price__gt=limit
     )
+    if after is not None:
+        query = query.filter(subscription_key_after(*after))
 
-    # get aggregated price for every subscription
-    subquery_data = DataUsageRecord.objects.subquery_aggregate(need_usage=False).values('agg_price')
-    subquery_voice = VoiceUsageRecord.objects.subquery_aggregate(need_usage=False).values('agg_price')
+    query = query.annotate(id_field=models.F('subscription_type'), id_value=models.F('subscription_id'))
+    query = query.values('id_field', 'id_value')
 
-    query = query.annotate(
-        agg_data_usage_exceeds=models.Subquery(subquery_data, output_field=models.DecimalField()) - limit,
-        agg_voice_usage_exceeds=models.Subquery(subquery_voice, output_field=models.DecimalField()) - limit,
-        subscription_type=models.Value(query.model.__name__, models.CharField())
-    )
-    # return only those entries, that exceed limit by data or voice usage
-    query = query.filter(models.Q(agg_data_usage_exceeds__gt=0) | models.Q(agg_voice_usage_exceeds__gt=0))
-    return query
+    exceeds = {}
+    for usage_type in [DataUsageRecord.USAGE_TYPE, VoiceUsageRecord.USAGE_TYPE]:
+        exceeds[f'agg_{usage_type}_usage_exceeds'] = Coalesce(
+            models.Max(models.Case(
+                models.When(usage_type=usage_type, then=models.F('price') - models.Value(limit)),
+                output_field=models.DecimalField()
+            )),
+            0
+        )
+    return query.annotate(**exceeds)
+
+
+def get_grouped_usage_chunk(
+        query: UsageQuerySet,
+        after: Optional[Tuple[int, int]],
+        chunk_size: int,
+) -> models.QuerySet:
+    """Returns queryset of totals of the next `chunk_size` subscriptions following `after` key"""
+    chunk_query = query if after is None else query.after_subscription(*after)
+    return chunk_query.group_aggregate().order_by('id_field', 'id_value')[:chunk_size]
+
+
+def iterate_grouped_usage(
+        query: UsageQuerySet,
+        after: Optional[Tuple[int, int]],
+        chunk_size: int,
+) -> Iterator[dict]:
+    """Yields total usage and price by subscription (see `UsageQuerySet.group_aggregate`) in order of subscription key.
+        Groups are fetched by chunks of `chunk_size` with keyset predicate, so rows are read only as far as consumed"""
+    while True:
+        rows = list(get_grouped_usage_chunk(query, after, chunk_size))
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]['id_field'], rows[-1]['id_value'])
+
+
+def get_usage_sources(
+        initial_query: UsageQuerySet,
+        from_date: datetime.datetime,
+        to_date: datetime.datetime,
+        subscription_type: Optional[int] = None,
+) -> List[UsageQuerySet]:
+    """Returns querysets of aggregated usage (rolled up days) and raw usage (days that have not been rolled up yet)
+        within given period, optionally filtered by subscription type. Raw records without subscription are skipped
+        like rollup skips them"""
+    agg_model = AGGREGATED_MODELS[initial_query.model]
+    sources = [
+        agg_model.objects.within_days(from_date, to_date),
+        initial_query.within_days(from_date, to_date).filter(subscription_type__isnull=False),
+    ]
+    if subscription_type is not None:
+        sources = [query.filter(subscription_type=subscription_type) for query in sources]
+    return sources
 
 
 def get_usage_metrics(
         initial_query: UsageQuerySet,
         from_date: datetime.datetime,
         to_date: datetime.datetime,
-) -> models.QuerySet:
-    """This function takes initial queryset on child model of wt.usage.base_models.UsageRecord and annotates it with:
-        *   subscription identifier (`id_field`, `id_value` annotated fields),
+        after: Optional[Tuple[int, int]] = None,
+        chunk_size: int = METRICS_CHUNK_SIZE,
+        subscription_type: Optional[int] = None,
+) -> Iterator[dict]:
+    """This function takes initial queryset on child model of wt.usage.base_models.UsageRecord and yields in order of
+        subscription key:
+        *   subscription identifier (`id_field`, `id_value`),
         *   total usage and price (`agg_usage`, `agg_price`) within given period (`from_date`, `to_date`)
 
+        Rolled up days are read from the aggregated usage model (one row per subscription and day), raw records are
+        left only for days that have not been rolled up yet. Both are grouped by subscription and merged.
+
     Args:
         initial_query (QuerySet): initial queryset on child model of wt.usage.base_models.UsageRecord
         from_date (datetime.datetime): start date of period
         to_date (datetime.datetime): end date of period
+        after (Tuple[int, int], Optional): return only subscriptions following given (`subscription_type`,
+            `subscription_id`) key (keyset pagination)
+        chunk_size (int, Optional): count of subscriptions fetched by one query from every usage model
+        subscription_type (int, Optional): return only subscriptions of given type
 
     Returns:
-        Queryset: annotated initial queryset
+        Iterator[dict]: totals by subscription
     """
-    query = initial_query
-    # filter everything (main query and subqueries) within given period
-    query = query.filter(usage_date__date__gte=from_date, usage_date__date__lte=to_date)
+    # filter everything within given period; keyset predicate is applied to rows before grouping, so a page doesn't
+    # aggregate previous ones
+    sources = [
+        iterate_grouped_usage(query, after, chunk_size)
+        for query in get_usage_sources(initial_query, from_date, to_date, subscription_type)
+    ]
 
-    subquery_price = query.subquery_aggregate(need_usage=False).values('agg_price')
-    subquery_usage = query.subquery_aggregate(need_price=False).values('agg_usage')
+    # both sources are ordered by subscription key: merge join sums totals of the same subscription
+    get_key = itemgetter('id_field', 'id_value')
+    for (id_field, id_value), rows in groupby(heapq.merge(*sources, key=get_key), key=get_key):
+        rows = list(rows)
+        usage = sum(row['agg_usage'] for row in rows)
+        # filter subscriptions that have usage within given period
+        if usage > 0:
+            yield {
+                'id_field': id_field,
+                'id_value': id_value,
+                'agg_usage': usage,
+                'agg_price': sum(row['agg_price'] for row in rows),
+            }
 
-    # get unique subscriptions
-    query = query.annotate_id()
-    query = query.values('id_field', 'id_value')
-    query = query.distinct()
-    # for every of them count sum price and usage
+
+def get_top_query(
+        query: UsageQuerySet,
+        count: int,
+        order_by: str = 'usage',
+        threshold: Optional[Decimal] = None,
+) -> models.QuerySet:
+    """Returns queryset of `count` subscriptions with the greatest totals of one usage source sorted and limited by
+        database (see `get_top_usage`)"""
+    field = TOP_ORDER_FIELDS[order_by]
+    query = query.group_aggregate().filter(agg_usage__gt=0)
+    if threshold is not None:
+        query = query.filter(**{f'{field}__gte': threshold})
+    return query.order_by(f'-{field}', 'id_field', 'id_value')[:count]
+
+
+def get_top_usage(
+        initial_query: UsageQuerySet,
+        from_date: datetime.datetime,
+        to_date: datetime.datetime,
+        count: int,
+        order_by: str = 'usage',
+        subscription_type: Optional[int] = None,
+        threshold: Optional[Decimal] = None,
+) -> List[dict]:
+    """Returns `count` subscriptions with the greatest total usage or price within given period (ties are ordered by
+        subscription key) in format of `get_usage_metrics`.
+
+        Period served by one source (only rolled up or only not rolled up days) is sorted and limited by database.
+        Otherwise merged totals of both sources are streamed through a bounded heap, so memory usage is O(count)
+        instead of O(subscriptions).
+
+    Args:
+        initial_query (QuerySet): initial queryset on child model of wt.usage.base_models.UsageRecord
+        from_date (datetime.datetime): start date of period
+        to_date (datetime.datetime): end date of period
+        count (int): max count of returned subscriptions
+        order_by (str, Optional): `usage` or `price`
+        subscription_type (int, Optional): return only subscriptions of given type
+        threshold (Decimal, Optional): return only subscriptions with total usage or price (`order_by`) not less than
+            given one
+    """
+    field = TOP_ORDER_FIELDS[order_by]
+    sources = [query for query in get_usage_sources(initial_query, from_date, to_date, subscription_type)
+               if query.exists()]
+
+    if len(sources) < 2:
+        if not sources:
+            return []
+        return list(get_top_query(sources[0], count, order_by, threshold))
+
+    rows = get_usage_metrics(initial_query, from_date, to_date, subscription_type=subscription_type)
+    if threshold is not None:
+        rows = (row for row in rows if row[field] >= threshold)
+    return heapq.nlargest(count, rows, key=lambda row: (row[field], -row['id_field'], -row['id_value']))
+
+
+def get_bucketed_usage_query(query: UsageQuerySet, bucket_expression: models.Expression) -> models.QuerySet:
+    """Returns queryset of total usage and price by subscription and time bucket in order of subscription key and
+        bucket"""
+    query = query.annotate_id().annotate(bucket=bucket_expression).values('id_field', 'id_value', 'bucket')
     query = query.annotate(
-        agg_price=models.Subquery(subquery_price, output_field=models.DecimalField()),
-        agg_usage=models.Subquery(subquery_usage, output_field=models.IntegerField()),
+        agg_usage=Coalesce(models.Sum(query.model.USAGE_FIELD), 0, output_field=models.IntegerField()),
+        agg_price=Coalesce(models.Sum('price'), 0, output_field=models.DecimalField())
     )
-    # filter subscriptions that have usage within given period
-    query = query.filter(agg_usage__gt=0)
-    return query
+    return query.order_by('id_field', 'id_value', 'bucket')
+
+
+def iterate_bucketed_usage(query: UsageQuerySet, bucket_expression: models.Expression) -> Iterator[dict]:
+    """Yields rows of `get_bucketed_usage_query`"""
+    return get_bucketed_usage_query(query, bucket_expression).iterator(chunk_size=METRICS_CHUNK_SIZE)
+
+
+def get_usage_series(
+        initial_query: UsageQuerySet,
+        from_date: datetime.datetime,
+        to_date: datetime.datetime,
+        bucket: str = 'day',
+        subscription_type: Optional[int] = None,
+) -> Iterator[dict]:
+    """This function takes initial queryset on child model of wt.usage.base_models.UsageRecord and yields usage series
+        of every subscription with usage within given period in order of subscription key: subscription identifier
+        (`id_field`, `id_value`) and columns of non-empty time buckets (`buckets`, `usage`, `price`).
+
+        Both rolled up and raw usage are grouped by database into buckets (one query per usage model) and merged.
+        Aggregated usage has daily resolution, so with `hour` buckets rolled up day is reported in its first hour.
+
+    Args:
+        initial_query (QuerySet): initial queryset on child model of wt.usage.base_models.UsageRecord
+        from_date (datetime.datetime): start date of period
+        to_date (datetime.datetime): end date of period
+        bucket (str, Optional): `hour`, `day` (bucket is a date), `week` or `month` (bucket is the first date)
+        subscription_type (int, Optional): return only subscriptions of given type
+
+    Returns:
+        Iterator[dict]: usage series by subscription
+    """
+    agg_query, raw_query = get_usage_sources(initial_query, from_date, to_date, subscription_type)
+    if bucket == 'hour':
+        agg_rows = (
+            {**row, 'bucket': timezone.make_aware(datetime.datetime.combine(row['bucket'], datetime.time()))}
+            for row in iterate_bucketed_usage(agg_query, models.F(agg_query.model.DAY_FIELD))
+        )
+        raw_rows = iterate_bucketed_usage(raw_query, Trunc('usage_date', 'hour', output_field=models.DateTimeField()))
+    else:
+        # buckets of indexed day columns
+        agg_rows, raw_rows = [
+            iterate_bucketed_usage(
+                query,
+                models.F(query.model.DAY_FIELD) if bucket == 'day'
+                else Trunc(query.model.DAY_FIELD, bucket, output_field=models.DateField())
+            )
+            for query in [agg_query, raw_query]
+        ]
+
+    get_key = itemgetter('id_field', 'id_value')
+    get_bucket_key = itemgetter('id_field', 'id_value', 'bucket')
+    merged = heapq.merge(agg_rows, raw_rows, key=get_bucket_key)
+    for (id_field, id_value), subscription_rows in groupby(merged, key=get_key):
+        series = {'id_field': id_field, 'id_value': id_value, 'buckets': [], 'usage': [], 'price': []}
+        for (_, _, bucket_value), rows in groupby(subscription_rows, key=get_bucket_key):
+            rows = list(rows)
+            series['buckets'].append(bucket_value)
+            series['usage'].append(sum(row['agg_usage'] for row in rows))
+            series['price'].append(sum(row['agg_price'] for row in rows))
+        # filter subscriptions that have usage within given period
+        if sum(series['usage']) > 0:
+            yield series
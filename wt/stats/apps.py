@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StatsConfig(AppConfig):
     name = 'wt.stats'
     label = 'stats'
+
+    def ready(self):
+        # connects invalidation of cached reports to `wt.usage.signals.usage_changed`
+        from wt.stats import cache  # noqa: F401
@@ -0,0 +1,118 @@
+"""Cache of serialized stats reports (Django cache framework, alias `settings.STATS_CACHE_ALIAS`).
+
+Report is cached by its name, normalized request parameters and generations of usage it depends on. Generation is a
+random token replaced whenever usage rows of its scope are written or rolled up (`wt.usage.signals.usage_changed`):
+exceeding report depends on the global generation, usage metrics depend on generations of usage type and every day of
+requested period. Entries of outdated generations are never read again and expire by TTL or LRU eviction.
+
+Generations are replaced when writes are committed and are shared only as far as the cache backend is: multi-process
+deployments need a shared backend (see `CACHES` of settings).
+"""
+import datetime
+import hashlib
+import json
+import uuid
+
+from typing import Callable, Iterable, List, Optional, Type
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.dispatch import receiver
+
+from wt.usage.base_models import UsageRecord
+from wt.usage.signals import usage_changed
+
+GENERATION_KEY_PREFIX = 'stats:generation'
+REPORT_KEY_PREFIX = 'stats:report'
+
+# reports of longer periods are not cached: every day of period is a generation key to check
+CACHE_MAX_PERIOD_DAYS = 366
+
+
+def get_cache() -> Optional[BaseCache]:
+    alias = settings.STATS_CACHE_ALIAS
+    return caches[alias] if alias is not None else None
+
+
+def get_generation_key(usage_model: Type[UsageRecord] = None, date: datetime.date = None) -> str:
+    if usage_model is None:
+        return f'{GENERATION_KEY_PREFIX}:all'
+    return f'{GENERATION_KEY_PREFIX}:{usage_model._meta.db_table}:{date.isoformat()}'
+
+
+def get_generations(cache: BaseCache, keys: List[str]) -> List[str]:
+    generations = cache.get_many(keys)
+    # generation which is evicted (or not created yet) is replaced with a new one, so it never matches entries cached
+    # before eviction
+    missing = {key: uuid.uuid4().hex for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def get_report_key(report: str, params: dict, generations: List[str]) -> str:
+    payload = json.dumps([report, params, generations], sort_keys=True, cls=DjangoJSONEncoder)
+    return f'{REPORT_KEY_PREFIX}:{report}:{hashlib.md5(payload.encode()).hexdigest()}'
+
+
+def get_cached_report(report: str, params: dict, generation_keys: List[str], compute: Callable[[], object]):
+    """Returns cached data of report or computes and caches it
+
+    Args:
+        report (str): report name
+        params (dict): validated request parameters
+        generation_keys (List[str]): keys of usage generations report depends on
+        compute (Callable): computes serialized report data
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+
+    key = get_report_key(report, params, get_generations(cache, generation_keys))
+    data = cache.get(key)
+    if data is None:
+        data = compute()
+        cache.set(key, data)
+    return data
+
+
+def get_exceeding_report(params: dict, compute: Callable[[], object]):
+    """Cached exceeding report: total prices depend on all usage"""
+    return get_cached_report('exceeded', params, [get_generation_key()], compute)
+
+
+def get_usage_metrics_report(
+        usage_model: Type[UsageRecord],
+        params: dict,
+        compute: Callable[[], object],
+        report: str = 'usage-metrics',
+):
+    """Cached usage metrics (or another report over usage totals by period, e.g. top subscriptions): totals depend on
+        usage of given model within requested period"""
+    from_date, to_date = params['from_date'], params['to_date']
+    days = (to_date - from_date).days + 1
+    if days > CACHE_MAX_PERIOD_DAYS:
+        return compute()
+
+    generation_keys = [
+        get_generation_key(usage_model, from_date + datetime.timedelta(days=idx)) for idx in range(max(days, 0))
+    ]
+    return get_cached_report(report, params, generation_keys, compute)
+
+
+def invalidate(usage_model: Type[UsageRecord], dates: Iterable[Optional[datetime.date]]) -> None:
+    cache = get_cache()
+    if cache is None:
+        return
+
+    keys = [get_generation_key()]
+    keys.extend(get_generation_key(usage_model, date) for date in dates if date is not None)
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+@receiver(usage_changed)
+def invalidate_on_usage_changed(sender, dates, **kwargs):
+    invalidate(sender, dates)
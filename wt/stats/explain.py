@@ -0,0 +1,117 @@
+"""Query plans of stats and rollup querysets and a guard against plan regressions.
+
+Every queryset of `get_plan_queries` is explained (`QuerySet.explain()`) and its plan is checked for:
+
+* `seq_scan`: full scan of usage table (`usages_*`; SQLite names tables of subqueries by their aliases `U0`, `U1`...);
+* `subplan`: subquery evaluated per row of outer query (PostgreSQL `SubPlan`, SQLite correlated subquery).
+
+Known shapes may allow some problems (e.g. per-row subquery which is a unique index lookup), any other problem is a
+plan regression. Plans depend on table statistics: they should be captured on seeded and analyzed database
+(`wt.usage.synthetic`, `analyze`).
+"""
+import datetime
+import re
+
+from decimal import Decimal
+from typing import Dict, FrozenSet, List, NamedTuple, Tuple
+
+from django.conf import settings
+from django.db import connection, models, transaction
+
+from wt.usage.models import DataUsageRecord, VoiceUsageRecord
+
+from .algorithms import (
+    AGGREGATED_MODELS, METRICS_CHUNK_SIZE, get_bucketed_usage_query, get_exceeding_totals, get_grouped_usage_chunk,
+    get_top_query, get_usage_sources,
+)
+
+SEQ_SCAN = 'seq_scan'
+SUBPLAN = 'subplan'
+
+PLAN_PATTERNS = {
+    'postgresql': [
+        (SEQ_SCAN, re.compile(r'Seq Scan on usages_\w+')),
+        (SUBPLAN, re.compile(r'\bSubPlan \d+')),
+    ],
+    'sqlite': [
+        (SEQ_SCAN, re.compile(r'\bSCAN (TABLE )?(usages_\w+|U\d+)\b')),
+        (SUBPLAN, re.compile(r'\bCORRELATED (SCALAR|LIST) SUBQUERY\b')),
+    ],
+}
+
+
+class PlanQuery(NamedTuple):
+    name: str
+    query: models.QuerySet
+    allowed: FrozenSet[str] = frozenset()
+
+
+class PlanResult(NamedTuple):
+    name: str
+    plan: str
+    problems: List[Tuple[str, str]]  # (kind, line of plan) of problems that aren't allowed for the query
+
+
+def get_plan_queries(from_date: datetime.date, to_date: datetime.date, limit: Decimal) -> List[PlanQuery]:
+    """Returns querysets of stats reports and rollup built by the same functions as `wt.stats.algorithms` and
+        `wt.usage.base_models` build them"""
+    queries = [
+        PlanQuery(
+            'exceeding_totals', get_exceeding_totals(limit).order_by('id_field', 'id_value')
+        ),
+        PlanQuery(
+            'exceeding_totals_page', get_exceeding_totals(limit, after=(1, 1)).order_by('id_field', 'id_value')
+        ),
+    ]
+    for model in [DataUsageRecord, VoiceUsageRecord]:
+        for query in get_usage_sources(model.objects.all(), from_date, to_date):
+            table = query.model._meta.db_table
+            queries += [
+                PlanQuery(f'usage_metrics_{table}', get_grouped_usage_chunk(query, None, METRICS_CHUNK_SIZE)),
+                PlanQuery(f'usage_metrics_page_{table}', get_grouped_usage_chunk(query, (1, 1), METRICS_CHUNK_SIZE)),
+                PlanQuery(f'top_usage_{table}', get_top_query(query, settings.STATS_MAX_TOP_COUNT)),
+                PlanQuery(
+                    f'usage_series_{table}', get_bucketed_usage_query(query, models.F(query.model.DAY_FIELD))
+                ),
+            ]
+
+        # rollup of one day of raw usage
+        rollup = AGGREGATED_MODELS[model].get_rollup_totals(model.objects.on_day(to_date))
+        queries.append(PlanQuery(f'rollup_{model._meta.db_table}', rollup))
+
+    return queries
+
+
+def analyze() -> None:
+    """Updates table statistics used by query planner"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def find_problems(plan: str) -> List[Tuple[str, str]]:
+    """Returns (kind, line of plan) of every problem found in plan"""
+    patterns = PLAN_PATTERNS.get(connection.vendor, [])
+    return [
+        (kind, line.strip())
+        for line in plan.splitlines() for kind, pattern in patterns if pattern.search(line)
+    ]
+
+
+def explain(query: models.QuerySet, discourage_seq_scans: bool = False) -> str:
+    """Returns plan of queryset. With `discourage_seq_scans` PostgreSQL planner avoids sequential scans whenever an
+        index can be used (small tables of tests are scanned sequentially otherwise)"""
+    if discourage_seq_scans and connection.vendor == 'postgresql':
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            return query.explain()
+    return query.explain()
+
+
+def check_plans(queries: List[PlanQuery], discourage_seq_scans: bool = False) -> Dict[str, PlanResult]:
+    """Explains querysets and finds problems that aren't allowed for them"""
+    results = {}
+    for name, query, allowed in queries:
+        plan = explain(query, discourage_seq_scans)
+        problems = [(kind, line) for kind, line in find_problems(plan) if kind not in allowed]
+        results[name] = PlanResult(name, plan, problems)
+    return results
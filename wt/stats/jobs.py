@@ -0,0 +1,48 @@
+"""Workers of asynchronous stats reports (`wt.stats.models.ReportJob`)"""
+import json
+import time
+
+from typing import Callable
+
+from django.db import connection
+
+from .models import ReportJob
+
+
+def run_job(job: ReportJob) -> None:
+    """Computes report of claimed job and stores its result or error"""
+    from .views import REPORT_VIEWS
+
+    view = REPORT_VIEWS[job.report]
+    try:
+        request_serializer = view.request_serializer_class(data=json.loads(job.params))
+        request_serializer.is_valid(True)
+        data = view.get_data(request_serializer.validated_data)
+    except Exception as e:
+        job.finish(error=f'{e.__class__.__name__}: {e}')
+    else:
+        job.finish(result=data)
+
+
+def run_worker(worker: str, poll_interval: float, should_stop: Callable[[], bool], once: bool = False) -> int:
+    """Claims and runs jobs until `should_stop` returns True (or, with `once`, until the queue is empty). Returns count
+        of jobs run by worker"""
+    count = 0
+    while not should_stop():
+        job = ReportJob.claim(worker)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
+
+
+def run_worker_thread(worker: str, poll_interval: float, should_stop: Callable[[], bool], once: bool = False) -> int:
+    # every thread opens its own connection, which is closed when the thread finishes
+    try:
+        return run_worker(worker, poll_interval, should_stop, once)
+    finally:
+        connection.close()
@@ -0,0 +1,170 @@
+import datetime
+import decimal
+import json
+import statistics
+import sys
+import time
+
+from typing import Callable, List
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from wt.serialization import get_row_serializer
+from wt.stats.algorithms import get_exceeding_totals, get_usage_metrics
+from wt.stats.serializers import StatusUsageMetricsResponseSerializer
+from wt.usage import synthetic
+from wt.usage.models import AggregatedDataUsageRecord, DataUsageRecord
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks stats reports and rollup on synthetic data of given sizes. Every size is generated in a fresh '
+        'test database of the configured backend, so configured database is left intact. Results are written as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10000, 100000], help='counts of raw usage records'
+        )
+        parser.add_argument(
+            '--subscriptions-ratio', type=int, default=100, help='count of usage records per subscription'
+        )
+        parser.add_argument('--days', type=int, default=30, help='count of days with usage')
+        parser.add_argument('--repeat', type=int, default=3, help='count of runs of every benchmark')
+        parser.add_argument(
+            '--limit', type=decimal.Decimal, default=decimal.Decimal('100.00'), help='price limit of exceeded report'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='file of JSON results (stdout by default)')
+
+    def handle(self, *args, sizes, subscriptions_ratio, days, repeat, limit, seed, output, **options):
+        if min(sizes) < 1 or subscriptions_ratio < 1 or days < 1 or repeat < 1:
+            raise CommandError('`--sizes`, `--subscriptions-ratio`, `--days` and `--repeat` should be positive')
+
+        # progress goes to stderr when results are written to stdout
+        self.progress = self.stderr if output is None else self.stdout
+        self.repeat = repeat
+
+        results = {
+            'database': connection.vendor,
+            'database_version': self.get_database_version(),
+            'started_at': timezone.now().isoformat(),
+            'days': days,
+            'repeat': repeat,
+            'seed': seed,
+            'results': [],
+        }
+        setup_test_environment()
+        try:
+            for size in sizes:
+                results['results'].extend(self.run_size(size, max(size // subscriptions_ratio, 2), days, limit, seed))
+        finally:
+            teardown_test_environment()
+
+        data = json.dumps(results, indent=2)
+        if output is None:
+            sys.stdout.write(data + '\n')
+        else:
+            with open(output, 'w') as file:
+                file.write(data + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Results are written to {output}'))
+
+    @staticmethod
+    def get_database_version() -> str:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                return connection.Database.sqlite_version
+            cursor.execute('SELECT version()')
+            return cursor.fetchone()[0]
+
+    def run_size(self, size: int, subscriptions: int, days: int, limit: decimal.Decimal, seed: int) -> List[dict]:
+        with synthetic.temporary_test_database():
+            to_date = timezone.localdate()
+            from_date = to_date - datetime.timedelta(days=days - 1)
+
+            started = time.monotonic()
+            counts = synthetic.generate(subscriptions, size, days=days, to_date=to_date, seed=seed)
+            results = [self.get_result(size, 'generate', [time.monotonic() - started], sum(counts.values()))]
+
+            client = APIClient()
+            metrics_params = {'from_date': from_date, 'to_date': to_date, 'usage_type': 'data'}
+            benchmarks = [
+                ('get_exceeding_totals', lambda: len(get_exceeding_totals(limit))),
+                ('get_usage_metrics', lambda: sum(
+                    1 for _ in get_usage_metrics(DataUsageRecord.objects.all(), from_date, to_date)
+                )),
+                ('http_exceeded', lambda: self.post(client, 'stats-exceeded', {'limit': limit})),
+                ('http_usage_metrics', lambda: self.post(client, 'stats-usage-metrics', metrics_params)),
+                ('http_top', lambda: self.post(client, 'stats-top', metrics_params)),
+            ]
+            for name, run in benchmarks:
+                results.append(self.run_benchmark(size, name, run, self.repeat))
+
+            # read path of high-volume lists: a report row per raw usage record, DRF serializer against compiled one
+            rows = list(DataUsageRecord.objects.filter(subscription_type__isnull=False).values(
+                id_field=models.F('subscription_type'), id_value=models.F('subscription_id'),
+                agg_usage=models.F('kilobytes_used'), agg_price=models.F('price'),
+            ))
+            serializer_class = StatusUsageMetricsResponseSerializer
+            results.append(self.run_benchmark(size, 'serialize_drf', lambda: self.count(
+                JSONRenderer().render(serializer_class(rows, many=True).data), rows
+            ), self.repeat))
+            results.append(self.run_benchmark(size, 'serialize_fast', lambda: self.count(
+                get_row_serializer(serializer_class).to_json_array(rows).encode(), rows
+            ), self.repeat))
+
+            # rollup changes data, so every run rolls up another day
+            populate_dates = iter([to_date - datetime.timedelta(days=idx) for idx in range(days)])
+            results.append(self.run_benchmark(
+                size, 'populate', lambda: AggregatedDataUsageRecord.populate(next(populate_dates)),
+                min(self.repeat, days)
+            ))
+            results.append(self.run_benchmark(
+                size, 'get_usage_metrics_rolled_up',
+                lambda: sum(1 for _ in get_usage_metrics(DataUsageRecord.objects.all(), from_date, to_date)),
+                self.repeat
+            ))
+            return results
+
+    @staticmethod
+    def count(content: bytes, rows: list) -> int:
+        # serialized content is produced in full, count of rows is reported
+        return len(rows) if content else 0
+
+    @staticmethod
+    def post(client: APIClient, url_name: str, data: dict) -> int:
+        response = client.post(reverse(url_name), data=data)
+        if response.status_code != 200:
+            raise CommandError(f'{url_name}: unexpected response status {response.status_code}')
+        return len(response.json())
+
+    def run_benchmark(self, size: int, name: str, run: Callable[[], int], repeat: int) -> dict:
+        cache = caches[settings.STATS_CACHE_ALIAS] if settings.STATS_CACHE_ALIAS is not None else None
+        seconds = []
+        rows = 0
+        for _ in range(repeat):
+            # cached reports would measure the cache instead of queries
+            if cache is not None:
+                cache.clear()
+            started = time.monotonic()
+            rows = run()
+            seconds.append(time.monotonic() - started)
+        return self.get_result(size, name, seconds, rows)
+
+    def get_result(self, size: int, name: str, seconds: List[float], rows: int) -> dict:
+        result = {'size': size, 'benchmark': name, 'rows': rows, 'seconds': [round(value, 6) for value in seconds]}
+        result.update(
+            min=round(min(seconds), 6),
+            median=round(statistics.median(seconds), 6),
+            max=round(max(seconds), 6),
+        )
+        self.progress.write(f'{size} {name}: {rows} rows, median {result["median"]:.3f}s')
+        return result
@@ -0,0 +1,57 @@
+import datetime
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from wt.stats.explain import analyze, check_plans, get_plan_queries
+from wt.usage import synthetic
+from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints query plans of stats reports and rollup and fails if any plan has a sequential scan of usage table or '
+        'a per-row subquery that is not allowed for it. Plans are captured in a fresh test database seeded with '
+        'synthetic data unless `--current` is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help='count of synthetic raw usage records')
+        parser.add_argument('--days', type=int, default=30, help='count of days with usage (half are rolled up)')
+        parser.add_argument('--limit', type=Decimal, default=Decimal('100.00'), help='price limit of exceeded report')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--current', action='store_true', help='explain queries on configured database')
+        parser.add_argument('--problems-only', action='store_true', help='print plans of queries with problems only')
+
+    def handle(self, *args, size, days, limit, seed, current, problems_only, **options):
+        if size < 1 or days < 1:
+            raise CommandError('`--size` and `--days` should be positive')
+
+        to_date = timezone.localdate()
+        from_date = to_date - datetime.timedelta(days=days - 1)
+        if current:
+            results = check_plans(get_plan_queries(from_date, to_date, limit))
+        else:
+            with synthetic.temporary_test_database():
+                synthetic.generate(max(size // 100, 2), size, days=days, to_date=to_date, seed=seed)
+                # both aggregated and raw usage are read by reports
+                for idx in range(days // 2):
+                    for model in [AggregatedDataUsageRecord, AggregatedVoiceUsageRecord]:
+                        model.populate(from_date + datetime.timedelta(days=idx))
+                analyze()
+                results = check_plans(get_plan_queries(from_date, to_date, limit))
+
+        failed = [result for result in results.values() if result.problems]
+        for result in results.values():
+            if problems_only and not result.problems:
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(result.name))
+            self.stdout.write(result.plan)
+            for kind, line in result.problems:
+                self.stdout.write(self.style.ERROR(f'{kind}: {line}'))
+
+        if failed:
+            raise CommandError(f'Plan problems in {len(failed)} of {len(results)} queries')
+        self.stdout.write(self.style.SUCCESS(f'No plan problems in {len(results)} queries'))
@@ -0,0 +1,45 @@
+import os
+import socket
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wt.stats.jobs import run_worker, run_worker_thread
+
+
+class Command(BaseCommand):
+    help = 'Runs pool of worker threads computing queued stats report jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='count of worker threads')
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.STATS_REPORT_JOB_POLL_INTERVAL,
+            help='seconds to wait for new jobs when the queue is empty'
+        )
+        parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+
+    def handle(self, *args, workers, poll_interval, once, **options):
+        if workers < 1:
+            raise CommandError('`--workers` should be positive')
+
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        stop = threading.Event()
+        if workers == 1:
+            count = run_worker(f'{prefix}:0', poll_interval, stop.is_set, once)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(run_worker_thread, f'{prefix}:{idx}', poll_interval, stop.is_set, once)
+                    for idx in range(workers)
+                ]
+                try:
+                    count = sum(future.result() for future in futures)
+                except KeyboardInterrupt:
+                    # workers finish running jobs and exit
+                    stop.set()
+                    raise
+
+        self.stdout.write(self.style.SUCCESS(f'Run {count} report jobs'))
@@ -0,0 +1,77 @@
+import json
+
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from model_utils import Choices
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ReportJob(models.Model):
+    """Represents stats report computed asynchronously. Table is the queue of jobs: workers claim queued jobs by
+        conditional update, so no external broker is needed"""
+    REPORT = Choices(
+        ('exceeded', 'exceeded', 'Exceeded'),
+        ('usage-metrics', 'usage_metrics', 'Usage metrics'),
+        ('top', 'top', 'Top'),
+        ('usage-series', 'usage_series', 'Usage series'),
+    )
+    STATUS = Choices(
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    report = models.CharField(max_length=20, choices=REPORT)
+    params = models.TextField()  # JSON of request data
+    status = models.CharField(max_length=20, choices=STATUS, default=STATUS.queued)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    result = models.TextField(null=True)  # rendered JSON of report data
+    error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'stats_report_jobs'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='stats_report_jobs_status_idx'),
+        ]
+
+    @classmethod
+    def enqueue(cls, report: str, params: dict) -> 'ReportJob':
+        return cls.objects.create(report=report, params=json.dumps(params, cls=JSONEncoder))
+
+    @classmethod
+    def get_claimable(cls) -> models.Q:
+        # running jobs of workers that died are claimed again after timeout
+        stale = timezone.now() - timedelta(seconds=settings.STATS_REPORT_JOB_TIMEOUT)
+        return models.Q(status=cls.STATUS.queued) | models.Q(status=cls.STATUS.running, started_at__lt=stale)
+
+    @classmethod
+    def claim(cls, worker: str) -> Optional['ReportJob']:
+        """Marks the oldest claimable job as running by given worker and returns it, or None if there are no jobs.
+            Conditional update succeeds for only one of concurrent workers"""
+        candidates = cls.objects.filter(cls.get_claimable()).order_by('id').values_list('id', flat=True)
+        for job_id in candidates[:settings.STATS_REPORT_JOB_CLAIM_BATCH]:
+            claimed = cls.objects.filter(cls.get_claimable(), id=job_id).update(
+                status=cls.STATUS.running, worker=worker, started_at=timezone.now()
+            )
+            if claimed:
+                return cls.objects.get(id=job_id)
+        return None
+
+    def finish(self, result=None, error: str = '') -> None:
+        """Stores result (or error) of job unless it has been claimed by another worker meanwhile"""
+        self.status = self.STATUS.failed if error else self.STATUS.done
+        self.result = None if error else json.dumps(result, cls=JSONEncoder)
+        self.error = error
+        self.finished_at = timezone.now()
+        type(self).objects.filter(id=self.id, worker=self.worker, status=self.STATUS.running).update(
+            status=self.status, result=self.result, error=self.error, finished_at=self.finished_at
+        )
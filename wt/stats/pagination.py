@@ -0,0 +1,57 @@
+"""Keyset pagination of stats reports by typed subscription key (`subscription_type`, `subscription_id`).
+
+Cursor is an opaque url-safe string with the key of the last subscription of the previous page. Next page is selected
+with the key predicate pushed down to report queries, so its cost doesn't depend on count of previous pages.
+"""
+import base64
+import binascii
+import json
+
+from typing import Callable, List, Optional, Tuple, Type
+
+from rest_framework.serializers import Serializer, ValidationError
+
+from wt.profiling.recorder import section
+from wt.serialization import serialize_rows
+
+SubscriptionKey = Tuple[int, int]
+
+
+def encode_cursor(key: SubscriptionKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> SubscriptionKey:
+    """Returns subscription key of given cursor. Raises ValidationError for malformed cursor"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, binascii.Error):
+        key = None
+    if not isinstance(key, list) or len(key) != 2 or not all(type(value) is int for value in key):
+        raise ValidationError('Invalid cursor')
+    return key[0], key[1]
+
+
+def get_page_data(
+        rows: List,
+        page_size: int,
+        get_key: Callable[[object], SubscriptionKey],
+        serializer_class: Type[Serializer],
+) -> dict:
+    """Serializes page of report. `rows` are expected to be fetched with one extra row to detect if there is a next
+        page
+
+    Returns:
+        dict: `next` cursor (None for the last page) and serialized `results`
+    """
+    next_cursor: Optional[str] = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(get_key(rows[-1]))
+
+    with section('serialize'):
+        results = serialize_rows(serializer_class, rows)
+    return {
+        'next': next_cursor,
+        'results': results,
+    }
@@ -1,5 +1,40 @@
-from rest_framework.serializers import Serializer, DecimalField, IntegerField, ChoiceField, CharField, \
-    SerializerMethodField, DateField
+import datetime
+
+from typing import List, Union
+
+from django.conf import settings
+from rest_framework.reverse import reverse
+from rest_framework.serializers import ModelSerializer, Serializer, DecimalField, IntegerField, ChoiceField, \
+    CharField, SerializerMethodField, DateField, BooleanField, ListField
+
+from wt.att_subscriptions.models import ATTSubscription
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.serialization import get_decimal_converter
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
+
+from .algorithms import SERIES_BUCKETS
+from .models import ReportJob
+from .pagination import decode_cursor
+
+SUBSCRIPTION_MODEL_NAMES = {model.SUBSCRIPTION_TYPE: model.__name__ for model in [ATTSubscription, SprintSubscription]}
+
+
+def get_subscription_model_name(subscription_type: int) -> str:
+    try:
+        return SUBSCRIPTION_MODEL_NAMES[subscription_type]
+    except KeyError:
+        raise RuntimeError(f'Unsupported subscription type: {subscription_type}')
+
+
+def get_subscription_type_name(subscription_type: int) -> str:
+    try:
+        return SUBSCRIPTION_TYPES[subscription_type]
+    except KeyError:
+        raise RuntimeError(f'Unsupported subscription type: {subscription_type}')
+
+
+def format_buckets(buckets: List[Union[datetime.date, datetime.datetime]]) -> List[str]:
+    return [bucket.isoformat() for bucket in buckets]
 
 
 class CustomDecimalField(DecimalField):
@@ -18,35 +53,123 @@ class CustomDecimalField(DecimalField):
         else:
             return super().to_representation(value)
 
+    def get_fast_converter(self):
+        # converter of `wt.serialization.RowSerializer`
+        convert = get_decimal_converter(self)
+        if not self.only_positive_values:
+            return convert
+        return lambda value: None if value <= 0 else convert(value)
+
 
-class StatsExceedingRequestSerializer(Serializer):
+class AsyncRequestSerializer(Serializer):
+    # enqueue report job and return it instead of computing report in request
+    async_job = BooleanField(required=False, default=False)
+
+
+class StatsRequestSerializer(AsyncRequestSerializer):
+    # stream JSON array of results instead of rendering it at once
+    stream = BooleanField(required=False, default=False)
+    # keyset pagination: response is a page of results with cursor of the next one when any of these is given
+    page_size = IntegerField(required=False, min_value=1, max_value=settings.STATS_MAX_PAGE_SIZE)
+    cursor = CharField(required=False)
+
+    def validate_cursor(self, value):
+        return decode_cursor(value)
+
+    def validate(self, attrs):
+        if 'cursor' in attrs or 'page_size' in attrs:
+            attrs.setdefault('page_size', settings.STATS_PAGE_SIZE)
+        attrs.setdefault('cursor', None)
+        return attrs
+
+
+class StatsExceedingRequestSerializer(StatsRequestSerializer):
     limit = CustomDecimalField()
 
 
 class StatsExceedingResponseSerializer(Serializer):
-    id = IntegerField()
+    id = IntegerField(source='id_value')
     data_usage_exceeds = CustomDecimalField(source='agg_data_usage_exceeds')
     voice_usage_exceeds = CustomDecimalField(source='agg_voice_usage_exceeds')
-    subscription_type = CharField()
+    subscription_type = SerializerMethodField()
+
+    # method fields of `wt.serialization.RowSerializer`: (source, converter)
+    fast_fields = {'subscription_type': ('id_field', get_subscription_model_name)}
+
+    def get_subscription_type(self, obj):
+        # class name of subscription model
+        return get_subscription_model_name(obj['id_field'])
 
 
-class StatsUsageMetricsRequestSerializer(Serializer):
+class StatsUsageMetricsRequestSerializer(StatsRequestSerializer):
     from_date = DateField(required=True)
     to_date = DateField(required=True)
     usage_type = ChoiceField(choices=['data', 'voice'], required=True)
 
 
+class StatsTopRequestSerializer(AsyncRequestSerializer):
+    from_date = DateField(required=True)
+    to_date = DateField(required=True)
+    usage_type = ChoiceField(choices=['data', 'voice'], required=True)
+    order_by = ChoiceField(choices=['usage', 'price'], default='usage')
+    count = IntegerField(min_value=1, max_value=settings.STATS_MAX_TOP_COUNT, default=100)
+    subscription_type = ChoiceField(choices=['att', 'sprint'], required=False)
+    threshold = DecimalField(max_digits=12, decimal_places=2, required=False)
+
+
+class StatsUsageSeriesRequestSerializer(AsyncRequestSerializer):
+    from_date = DateField(required=True)
+    to_date = DateField(required=True)
+    usage_type = ChoiceField(choices=['data', 'voice'], required=True)
+    bucket = ChoiceField(choices=SERIES_BUCKETS, default='day')
+    subscription_type = ChoiceField(choices=['att', 'sprint'], required=False)
+    stream = BooleanField(required=False, default=False)
+
+
+class StatsUsageSeriesResponseSerializer(Serializer):
+    subscription_type = SerializerMethodField()
+    subscription_id = IntegerField(source='id_value')
+    # columns of the same length: start of time bucket, total usage and price within it
+    buckets = SerializerMethodField()
+    usage = ListField(child=IntegerField())
+    price = ListField(child=CustomDecimalField(only_positive_values=False))
+
+    # method fields of `wt.serialization.RowSerializer`: (source, converter)
+    fast_fields = {
+        'subscription_type': ('id_field', get_subscription_type_name),
+        'buckets': ('buckets', format_buckets),
+    }
+
+    def get_subscription_type(self, obj):
+        return get_subscription_type_name(obj['id_field'])
+
+    def get_buckets(self, obj):
+        return format_buckets(obj['buckets'])
+
+
 class StatusUsageMetricsResponseSerializer(Serializer):
     subscription_type = SerializerMethodField()
     subscription_id = IntegerField(source='id_value')
     usage = IntegerField(source='agg_usage')
     price = CustomDecimalField(only_positive_values=False, source='agg_price')
 
+    # method fields of `wt.serialization.RowSerializer`: (source, converter)
+    fast_fields = {'subscription_type': ('id_field', get_subscription_type_name)}
+
     def get_subscription_type(self, obj):
-        subscription_type = obj['id_field']
-        if subscription_type == 'att_subscription_id':
-            return 'ATT'
-        elif subscription_type == 'sprint_subscription_id':
-            return 'Sprint'
-        else:
-            raise RuntimeError(f'Unsupported subscription type: {subscription_type}')
+        return get_subscription_type_name(obj['id_field'])
+
+
+class ReportJobSerializer(ModelSerializer):
+    url = SerializerMethodField()
+    result_url = SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'report', 'status', 'error', 'created_at', 'started_at', 'finished_at', 'url', 'result_url']
+
+    def get_url(self, obj):
+        return reverse('stats-job', args=[obj.id])
+
+    def get_result_url(self, obj):
+        return reverse('stats-job-result', args=[obj.id]) if obj.status == ReportJob.STATUS.done else None
@@ -0,0 +1,35 @@
+from typing import Iterable, Iterator, Type
+
+from django.db import models
+from django.http import StreamingHttpResponse
+from rest_framework.serializers import Serializer
+
+from wt.serialization import get_row_serializer
+
+STREAM_CHUNK_SIZE = 2000
+
+
+def iterate_json_array(rows: Iterable, serializer_class: Type[Serializer]) -> Iterator[bytes]:
+    """Yields JSON array of serialized rows piece by piece: every piece contains up to `STREAM_CHUNK_SIZE` elements.
+        Rows are encoded straight to JSON by compiled read path of serializer (`wt.serialization.RowSerializer`)"""
+    serializer = get_row_serializer(serializer_class)
+
+    yield b'['
+    separator = b''
+    parts = []
+    for row in rows:
+        parts.append(serializer.to_json(row))
+        if len(parts) == STREAM_CHUNK_SIZE:
+            yield separator + ','.join(parts).encode()
+            separator = b','
+            parts = []
+    if parts:
+        yield separator + ','.join(parts).encode()
+    yield b']'
+
+
+def streaming_json_response(query: Iterable, serializer_class: Type[Serializer]) -> StreamingHttpResponse:
+    """Returns response streaming serialized queryset (or lazy iterable of rows) as JSON array. Queryset is iterated
+        with server-side cursor (where database supports it), so memory usage doesn't depend on size of the result"""
+    rows = query.iterator(chunk_size=STREAM_CHUNK_SIZE) if isinstance(query, models.QuerySet) else query
+    return StreamingHttpResponse(iterate_json_array(rows, serializer_class), content_type='application/json')
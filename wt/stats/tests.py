@@ -1,6 +1,33 @@
+import json
+
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import models
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 
+from wt.att_subscriptions.models import ATTSubscription
+from wt.serialization import get_row_serializer, serialize_rows
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.stats.algorithms import get_exceeding_totals, get_usage_metrics
+from wt.stats.explain import SEQ_SCAN, SUBPLAN, PlanQuery, analyze, check_plans, get_plan_queries
+from wt.stats.models import ReportJob
+from wt.stats.serializers import (
+    ReportJobSerializer, StatsExceedingResponseSerializer, StatsUsageSeriesResponseSerializer,
+    StatusUsageMetricsResponseSerializer,
+)
 from wt.tests import BaseAPITestCase
+from wt.usage import synthetic
+from wt.usage.ingest import ingest
+from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord, DataUsageRecord, VoiceUsageRecord
+from wt.usage.models import SubscriptionUsageTotal
 
 
 class BaseStatsTestCase(BaseAPITestCase):
@@ -9,6 +36,41 @@ class BaseStatsTestCase(BaseAPITestCase):
             self.assertIn(resp, response)
         self.assertEqual(len(correct), len(response))
 
+    def check_streaming(self, data):
+        response = self.client.post(self.url, data=data)
+        streaming_response = self.client.post(self.url, data={**data, 'stream': True})
+        self.assertTrue(streaming_response.streaming)
+        self.assertEqual(streaming_response['Content-Type'], 'application/json')
+        streamed = json.loads(b''.join(streaming_response.streaming_content))
+        self.assertTrue(streamed)
+        self.check_response(response.json(), streamed)
+
+    def check_pagination(self, data, page_size):
+        response = self.client.post(self.url, data=data).json()
+        pages = []
+        cursor = None
+        while True:
+            page_data = {**data, 'page_size': page_size}
+            if cursor is not None:
+                page_data['cursor'] = cursor
+            page = self.client.post(self.url, data=page_data)
+            self.assertEqual(page.status_code, 200)
+            page = page.json()
+            self.assertLessEqual(len(page['results']), page_size)
+            pages.append(page['results'])
+            cursor = page['next']
+            if cursor is None:
+                break
+
+        # every page is full except the last one, pages don't overlap and cover the whole report
+        self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+        self.assertEqual(len(pages), max(1, -(-len(response) // page_size)))
+        self.check_response(response, [row for page in pages for row in page])
+
+        response = self.client.post(self.url, data={**data, 'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'cursor': ['Invalid cursor']})
+
 
 class StatsExceedingTestCase(BaseStatsTestCase):
     url = reverse('stats-exceeded')
@@ -51,6 +113,33 @@ class StatsExceedingTestCase(BaseStatsTestCase):
         })
         self.check_response(correct_response, response.json())
 
+    def test_rolled_up(self):
+        sub_att, sub_sprint = self.create_basic_test_set()
+
+        # roll up today's usage: raw records are moved to aggregated tables
+        AggregatedDataUsageRecord.populate(self.today_date)
+        AggregatedVoiceUsageRecord.populate(self.today_date)
+
+        response = self.client.post(self.url, data={'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.check_response(
+            [
+                {
+                    'id': sub_att.id,
+                    'data_usage_exceeds': '1.00',  # 2 rolled up usages + 1 raw
+                    'voice_usage_exceeds': None,
+                    'subscription_type': 'ATTSubscription'
+                },
+                {
+                    'id': sub_sprint.id,
+                    'data_usage_exceeds': None,
+                    'voice_usage_exceeds': '1.00',  # 1 rolled up usage + 2 raw
+                    'subscription_type': 'SprintSubscription'
+                }
+            ],
+            response.json()
+        )
+
     def test_many(self):
         subs_count = 20
         usages_count = 10
@@ -75,6 +164,67 @@ class StatsExceedingTestCase(BaseStatsTestCase):
             )
         )
 
+    def test_streaming(self):
+        self.create_basic_test_set()
+        self.check_streaming({'limit': 0})
+
+    def test_pagination(self):
+        for func in [self.create_att, self.create_sprint]:
+            for _ in range(5):
+                self.create_data_usage(func(), 3, 1)
+
+        for page_size in [1, 3, 5, 10, 20]:
+            self.check_pagination({'limit': 2}, page_size)
+
+    def test_running_totals(self):
+        self.create_basic_test_set()
+        for _ in range(10):
+            self.create_att()
+
+        # one indexed range scan over running totals, usage history isn't read
+        query = get_exceeding_totals(Decimal(2))
+        self.assertNotIn('usages_data', str(query.query))
+        self.assertEqual(len(query), 2)
+
+    def test_single_query(self):
+        self.create_basic_test_set()
+        for func in [self.create_att, self.create_sprint]:
+            self.create_data_usage(func(), 3, 1)
+
+        query = get_exceeding_totals(Decimal(2))
+        self.assertEqual(str(query.query).count('SELECT'), 1)
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, data={'limit': 2})
+        self.assertEqual(len(response.json()), 4)
+
+    def test_cache(self):
+        sub_att, _ = self.create_basic_test_set()
+        response = response_before = self.client.post(self.url, data={'limit': 2}).json()
+
+        # the same (normalized) parameters are served from cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(self.url, data={'limit': '2.00'}).json(), response)
+
+        # any written usage invalidates the report, but only when it's committed: concurrent requests may cache
+        # the report before commit
+        with self.run_commit_callbacks():
+            record = DataUsageRecord.objects.create(
+                att_subscription=sub_att, kilobytes_used=1, price=1, usage_date=timezone.now()
+            )
+            with self.assertNumQueries(0):
+                self.client.post(self.url, data={'limit': 2})
+        response = self.client.post(self.url, data={'limit': 2}).json()
+        self.assertIn(
+            {'id': sub_att.id, 'data_usage_exceeds': '2.00', 'voice_usage_exceeds': None,
+             'subscription_type': 'ATTSubscription'},
+            response
+        )
+
+        # as well as deleted usage
+        with self.run_commit_callbacks():
+            record.delete()
+        self.assertEqual(self.client.post(self.url, data={'limit': 2}).json(), response_before)
+
     def test_incorrect_request(self):
         response = self.client.post(self.url, data={})
         self.assertEqual(response.status_code, 400)
@@ -210,3 +360,359 @@ class UsageMetricsTestCase(BaseStatsTestCase):
         for obj in response:
             self.assertEqual(obj['usage'], usages_count, obj)
             self.assertAlmostEqual(float(obj['price']), 1.01 * usages_count, 2)
+
+    def test_streaming(self):
+        self.create_basic_test_set()
+        self.check_streaming({'usage_type': 'voice', 'from_date': self.today_date, 'to_date': self.tomorrow_date})
+
+    def test_pagination(self):
+        for func in [self.create_att, self.create_sprint]:
+            for _ in range(5):
+                self.create_voice_usage(func(), 1, 1, self.today)
+
+        for page_size in [1, 3, 5, 10, 20]:
+            self.check_pagination(
+                {'usage_type': 'voice', 'from_date': self.today_date, 'to_date': self.today_date}, page_size
+            )
+
+        # next page is one grouped query per usage model, plus one to look ahead past the page's raw chunk
+        data = {'usage_type': 'voice', 'from_date': self.today_date, 'to_date': self.today_date, 'page_size': 4}
+        cursor = self.client.post(self.url, data=data).json()['next']
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, data={**data, 'cursor': cursor})
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_cache(self):
+        sub_att, _ = self.create_basic_test_set()
+        data = {'usage_type': 'data', 'from_date': self.today_date, 'to_date': self.today_date}
+        response = self.client.post(self.url, data=data).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(self.url, data=data).json(), response)
+
+        # usage of other type or day doesn't invalidate the report
+        self.create_voice_usage(sub_att, 1, 1, self.today)
+        self.create_data_usage(sub_att, 1, 1, self.tomorrow)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(self.url, data=data).json(), response)
+
+        # ingested usage of the day does
+        with self.run_commit_callbacks():
+            result = ingest([json.dumps({
+                'usage_type': 'data', 'subscription_type': 'att', 'subscription_id': sub_att.id, 'usage': 10,
+                'price': '1.00', 'usage_date': self.today.isoformat(),
+            }).encode()])
+        self.assertEqual(result['accepted'], 1)
+        new_response = self.client.post(self.url, data=data).json()
+        self.assertNotEqual(new_response, response)
+
+        # as well as rollup of the day
+        with self.run_commit_callbacks():
+            AggregatedDataUsageRecord.populate(self.today_date)
+        with self.assertNumQueries(2):
+            self.check_response(new_response, self.client.post(self.url, data=data).json())
+
+    def test_cache_moved_usage(self):
+        record = self.create_data_usage(self.create_att(), 1, 10, self.today)
+        data = {'usage_type': 'data', 'from_date': self.today_date, 'to_date': self.today_date}
+        self.assertEqual(self.send(**data).json()[0]['usage'], 10)
+
+        # usage moved to another day invalidates reports of both days
+        with self.run_commit_callbacks():
+            record.usage_date = self.tomorrow
+            record.save()
+        self.assertEqual(self.send(**data).json(), [])
+        self.assertEqual(self.send('data', self.tomorrow_date, self.tomorrow_date).json()[0]['usage'], 10)
+
+    def test_grouped_queries(self):
+        for func in [self.create_att, self.create_sprint]:
+            for _ in range(5):
+                self.create_data_usage(func(), 1, 1, self.today)
+
+        # no correlated subqueries: one grouped select of aggregated and one of raw usage
+        with self.assertNumQueries(2):
+            metrics = list(get_usage_metrics(DataUsageRecord.objects.all(), self.today_date, self.today_date))
+        self.assertEqual(len(metrics), 10)
+
+        # chunked reading returns the same totals
+        with self.assertNumQueries(5):  # 1 chunk of aggregated (empty) and 4 chunks of raw usage
+            chunked = list(
+                get_usage_metrics(DataUsageRecord.objects.all(), self.today_date, self.today_date, chunk_size=3)
+            )
+        self.assertEqual(chunked, metrics)
+
+    def test_rolled_up(self):
+        subs = [self.create_att(), self.create_sprint()]
+        yesterday = self.today - timedelta(days=1)
+        for sub in subs:
+            self.create_data_usage(sub, '1.00', 10, yesterday)
+            self.create_data_usage(sub, '2.00', 20, self.today)
+        AggregatedDataUsageRecord.populate(yesterday.date())
+        AggregatedDataUsageRecord.populate(self.today_date)
+
+        # raw tail of not yet rolled up usage
+        self.create_data_usage(subs[0], '0.50', 5, self.today)
+        self.create_data_usage(subs[1], '0.50', 5, self.tomorrow)
+
+        response = self.send('data', yesterday.date(), self.tomorrow_date)
+        self.check_response(
+            [
+                {'subscription_type': 'ATT', 'subscription_id': subs[0].id, 'usage': 35, 'price': '3.50'},
+                {'subscription_type': 'Sprint', 'subscription_id': subs[1].id, 'usage': 35, 'price': '3.50'},
+            ],
+            response.json()
+        )
+
+        # historical period is served from aggregated usage only
+        response = self.send('data', yesterday.date(), yesterday.date())
+        self.check_response(
+            [
+                {'subscription_type': 'ATT', 'subscription_id': subs[0].id, 'usage': 10, 'price': '1.00'},
+                {'subscription_type': 'Sprint', 'subscription_id': subs[1].id, 'usage': 10, 'price': '1.00'},
+            ],
+            response.json()
+        )
+
+
+class TopUsageTestCase(BaseStatsTestCase):
+    url = reverse('stats-top')
+
+    def setUp(self):
+        super().setUp()
+        self.yesterday = self.today - timedelta(days=1)
+        self.subs = []
+        for idx in range(1, 6):
+            for func in [self.create_att, self.create_sprint]:
+                sub = func()
+                self.subs.append(sub)
+                # price grows with index, usage decreases with it
+                self.create_data_usage(sub, f'{idx}.00', 100 - idx, self.yesterday)
+
+    def send(self, **params):
+        data = {'usage_type': 'data', 'from_date': self.yesterday.date(), 'to_date': self.today_date, **params}
+        response = self.client.post(self.url, data=data)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_correct(self):
+        # raw usage only: sorted and limited by database
+        response = self.send(count=3, order_by='price')
+        self.assertEqual([row['price'] for row in response], ['5.00', '5.00', '4.00'])
+        self.assertEqual([row['subscription_type'] for row in response], ['ATT', 'Sprint', 'ATT'])
+
+        response = self.send(count=2, order_by='usage', subscription_type='sprint')
+        self.assertEqual(
+            [(row['subscription_type'], row['usage']) for row in response], [('Sprint', 99), ('Sprint', 98)]
+        )
+
+        response = self.send(count=100, order_by='price', threshold='3.00')
+        self.assertEqual(len(response), 6)
+
+    def test_without_subscription(self):
+        # raw usage without subscription isn't reported
+        DataUsageRecord.objects.create(kilobytes_used=1000, price='100.00', usage_date=self.today)
+        response = self.send(count=1, order_by='price')
+        self.assertEqual([row['price'] for row in response], ['5.00'])
+
+    def test_merged(self):
+        AggregatedDataUsageRecord.populate(self.yesterday.date())
+        # raw tail moves the last subscription to the top
+        self.create_data_usage(self.subs[0], '10.00', 1, self.today)
+
+        with self.assertNumQueries(4):  # 2 existence checks and 2 grouped queries
+            response = self.send(count=2, order_by='price')
+        self.assertEqual(
+            response,
+            [
+                {'subscription_type': 'ATT', 'subscription_id': self.subs[0].id, 'usage': 100, 'price': '11.00'},
+                {'subscription_type': 'ATT', 'subscription_id': self.subs[8].id, 'usage': 95, 'price': '5.00'},
+            ]
+        )
+
+        response = self.send(count=100, order_by='price', threshold='5.00', subscription_type='att')
+        self.assertEqual([row['price'] for row in response], ['11.00', '5.00'])
+
+    def test_incorrect(self):
+        response = self.client.post(self.url, data={'usage_type': 'sms', 'count': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'usage_type', 'count', 'from_date', 'to_date'})
+
+
+class UsageSeriesTestCase(BaseStatsTestCase):
+    url = reverse('stats-usage-series')
+
+    def send(self, **params):
+        data = {'usage_type': 'voice', 'from_date': self.yesterday.date(), 'to_date': self.tomorrow_date, **params}
+        response = self.client.post(self.url, data=data)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def setUp(self):
+        super().setUp()
+        self.yesterday = self.today - timedelta(days=1)
+        self.sub_att, self.sub_sprint = self.create_att(), self.create_sprint()
+        for usage_date in [self.yesterday, self.today, self.today, self.tomorrow]:
+            self.create_voice_usage(self.sub_att, '1.00', 10, usage_date)
+        self.create_voice_usage(self.sub_sprint, '0.50', 5, self.tomorrow)
+        # rolled up and raw usage of the same day are merged into one bucket
+        AggregatedVoiceUsageRecord.populate(self.today_date)
+        self.create_voice_usage(self.sub_att, '1.00', 10, self.today)
+
+    def test_day(self):
+        with self.assertNumQueries(2):  # one grouped query per usage model
+            response = self.send()
+        self.assertEqual(
+            response,
+            [
+                {
+                    'subscription_type': 'ATT',
+                    'subscription_id': self.sub_att.id,
+                    'buckets': [self.yesterday.date().isoformat(), self.today_date.isoformat(),
+                                self.tomorrow_date.isoformat()],
+                    'usage': [10, 30, 10],
+                    'price': ['1.00', '3.00', '1.00'],
+                },
+                {
+                    'subscription_type': 'Sprint',
+                    'subscription_id': self.sub_sprint.id,
+                    'buckets': [self.tomorrow_date.isoformat()],
+                    'usage': [5],
+                    'price': ['0.50'],
+                },
+            ]
+        )
+
+    def test_buckets(self):
+        for bucket in ['hour', 'week', 'month']:
+            response = self.send(bucket=bucket, subscription_type='att')
+            self.assertEqual(len(response), 1)
+            series = response[0]
+            self.assertEqual(sum(series['usage']), 50)
+            self.assertEqual(len(series['buckets']), len(series['usage']))
+            self.assertEqual(series['buckets'], sorted(series['buckets']))
+
+        self.check_streaming({
+            'usage_type': 'voice', 'from_date': self.yesterday.date(), 'to_date': self.tomorrow_date, 'bucket': 'week'
+        })
+
+    def test_without_subscription(self):
+        VoiceUsageRecord.objects.create(seconds_used=10, price='1.00', usage_date=self.today)
+        self.assertEqual([row['usage'] for row in self.send()], [[10, 30, 10], [5]])
+
+    def test_incorrect(self):
+        response = self.client.post(self.url, data={'usage_type': 'voice', 'bucket': 'year'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'bucket', 'from_date', 'to_date'})
+
+
+class ReportJobTestCase(BaseStatsTestCase):
+    def run_jobs(self):
+        out = StringIO()
+        call_command('run_report_jobs', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_correct(self):
+        self.create_basic_test_set()
+        url = reverse('stats-usage-metrics')
+        data = {'usage_type': 'voice', 'from_date': self.today_date, 'to_date': self.tomorrow_date}
+
+        response = self.client.post(url, data={**data, 'async_job': True})
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['report'], job['status'], job['result_url']), ('usage-metrics', 'queued', None))
+        self.assertEqual(self.client.get(job['url']).json()['status'], 'queued')
+        self.assertEqual(self.client.get(reverse('stats-job-result', args=[job['id']])).status_code, 409)
+
+        self.assertIn('Run 1 report jobs', self.run_jobs())
+
+        job = self.client.get(job['url']).json()
+        self.assertEqual(job['status'], 'done')
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result['Content-Type'], 'application/json')
+        self.assertEqual(result.json(), self.client.post(url, data=data).json())
+
+    def test_failed(self):
+        job = ReportJob.enqueue(ReportJob.REPORT.top, {'usage_type': 'sms'})
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS.failed)
+        self.assertIn('ValidationError', job.error)
+        self.assertIsNone(job.result)
+
+    def test_claim(self):
+        job = ReportJob.enqueue(ReportJob.REPORT.exceeded, {'limit': 1})
+        self.assertEqual(ReportJob.claim('first').id, job.id)
+        # claimed job isn't claimed by another worker until timeout
+        self.assertIsNone(ReportJob.claim('second'))
+        ReportJob.objects.update(started_at=timezone.now() - timedelta(seconds=settings.STATS_REPORT_JOB_TIMEOUT + 1))
+        self.assertEqual(ReportJob.claim('second').worker, 'second')
+
+        # result of worker that lost the job is discarded
+        job.refresh_from_db()
+        job.worker = 'first'
+        job.finish(result=[])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (ReportJob.STATUS.running, 'second'))
+
+
+class QueryPlanTestCase(BaseStatsTestCase):
+    def test_plans(self):
+        from_date = self.today_date - timedelta(days=2)
+        synthetic.generate(20, 2000, days=3, to_date=self.today_date)
+        # both aggregated and raw usage are read
+        AggregatedDataUsageRecord.populate(from_date)
+        AggregatedVoiceUsageRecord.populate(from_date)
+        analyze()
+
+        results = check_plans(get_plan_queries(from_date, self.today_date, Decimal(10)), discourage_seq_scans=True)
+        self.assertEqual({name: result.problems for name, result in results.items() if result.problems}, {})
+
+    def test_problems(self):
+        # price of raw usage isn't indexed
+        results = check_plans([
+            PlanQuery('scan', DataUsageRecord.objects.filter(price__gt=1)),
+            # total of every subscription is looked up per row
+            PlanQuery('exceeding', ATTSubscription.objects.annotate(total=models.Subquery(
+                SubscriptionUsageTotal.objects.filter(
+                    subscription_type=ATTSubscription.SUBSCRIPTION_TYPE, subscription_id=models.OuterRef('id'),
+                    usage_type=DataUsageRecord.USAGE_TYPE
+                ).values('price')
+            ))),
+        ])
+        self.assertEqual([kind for kind, _ in results['scan'].problems], [SEQ_SCAN])
+        self.assertEqual({kind for kind, _ in results['exceeding'].problems}, {SUBPLAN})
+
+
+class RowSerializerTestCase(BaseStatsTestCase):
+    def check_serializer(self, serializer_class, rows):
+        # compiled read path renders the same data and the same JSON as DRF serializer
+        data = serializer_class(rows, many=True).data
+        self.assertEqual(serialize_rows(serializer_class, rows), data)
+        self.assertEqual(get_row_serializer(serializer_class).to_json_array(rows).encode(), JSONRenderer().render(data))
+
+    def test_stats_serializers(self):
+        self.check_serializer(StatsExceedingResponseSerializer, [
+            {'id_field': ATTSubscription.SUBSCRIPTION_TYPE, 'id_value': 1, 'agg_data_usage_exceeds': Decimal('1.005'),
+             'agg_voice_usage_exceeds': Decimal('-1')},
+            {'id_field': SprintSubscription.SUBSCRIPTION_TYPE, 'id_value': 2, 'agg_data_usage_exceeds': None,
+             'agg_voice_usage_exceeds': 3.5},
+        ])
+        self.check_serializer(StatusUsageMetricsResponseSerializer, [
+            {'id_field': ATTSubscription.SUBSCRIPTION_TYPE, 'id_value': 1, 'agg_usage': 10, 'agg_price': Decimal('-2')},
+            {'id_field': SprintSubscription.SUBSCRIPTION_TYPE, 'id_value': 2, 'agg_usage': None, 'agg_price': None},
+        ])
+        self.check_serializer(StatsUsageSeriesResponseSerializer, [
+            {'id_field': ATTSubscription.SUBSCRIPTION_TYPE, 'id_value': 1,
+             'buckets': [self.today_date, self.tomorrow], 'usage': [1, None], 'price': [Decimal('0'), Decimal('1.1')]},
+        ])
+
+    def test_unsupported(self):
+        # both paths share converters of method fields
+        row = {'id_field': 0, 'id_value': 1, 'agg_usage': 10, 'agg_price': Decimal('1'), 'buckets': [], 'usage': [],
+               'price': []}
+        for serializer_class in [StatusUsageMetricsResponseSerializer, StatsUsageSeriesResponseSerializer]:
+            with self.assertRaises(RuntimeError):
+                serialize_rows(serializer_class, [row])
+            with self.assertRaises(RuntimeError):
+                serializer_class([row], many=True).data
+        with self.assertRaises(ImproperlyConfigured):
+            get_row_serializer(ReportJobSerializer)
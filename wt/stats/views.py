@@ -1,39 +1,209 @@
+from itertools import islice
+
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from wt.att_subscriptions.models import ATTSubscription
-from wt.sprint_subscriptions.models import SprintSubscription
+from wt.profiling.recorder import section
+from wt.serialization import serialize_rows
 from wt.usage.models import VoiceUsageRecord, DataUsageRecord
 
-from .algorithms import get_exceeding_subscriptions, get_usage_metrics
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
+
+from .algorithms import get_exceeding_totals, get_top_usage, get_usage_metrics, get_usage_series
+from .cache import get_exceeding_report, get_usage_metrics_report
+from .models import ReportJob
 from .serializers import StatsExceedingRequestSerializer, StatsExceedingResponseSerializer
 from .serializers import StatsUsageMetricsRequestSerializer, StatusUsageMetricsResponseSerializer
+from .serializers import StatsTopRequestSerializer
+from .serializers import StatsUsageSeriesRequestSerializer, StatsUsageSeriesResponseSerializer
+from .serializers import ReportJobSerializer
+from .pagination import get_page_data
+from .streaming import streaming_json_response
 
 
-class StatsExceedingView(APIView):
-    def post(self, request):
-        query_serializer = StatsExceedingRequestSerializer(data=request.data)
-        query_serializer.is_valid(True)
-        limit = query_serializer.validated_data['limit']
+def get_usage_model(request_params):
+    return DataUsageRecord if request_params['usage_type'] == 'data' else VoiceUsageRecord
+
+
+def serialize(serializer_class, rows):
+    """Serializes rows of report with compiled read path of serializer (profiled as `serialize` section excluding SQL
+        of lazy rows)"""
+    with section('serialize'):
+        return serialize_rows(serializer_class, rows)
 
-        att_exceeded_subscriptions = get_exceeding_subscriptions(ATTSubscription.objects.all(), limit)
-        sprint_exceeded_subscriptions = get_exceeding_subscriptions(SprintSubscription.objects.all(), limit)
-        # union querysets with att and sprint subscriptions
-        query = att_exceeded_subscriptions.union(sprint_exceeded_subscriptions)
 
-        data = StatsExceedingResponseSerializer(query, many=True).data
-        return Response(data)
+def get_subscription_type(request_params):
+    subscription_type = request_params.get('subscription_type')
+    return getattr(SUBSCRIPTION_TYPES, subscription_type) if subscription_type else None
 
 
-class StatsUsageMetricsView(APIView):
+class StatsReportView(APIView):
+    """Base view of stats report: computes report synchronously or, with `async_job` request parameter, enqueues
+        report job (`wt.stats.models.ReportJob`) computed by `manage.py run_report_jobs` workers"""
+    report: str = None
+    request_serializer_class = None
+
     def post(self, request):
-        request_serializer = StatsUsageMetricsRequestSerializer(data=request.data)
+        request_serializer = self.request_serializer_class(data=request.data)
         request_serializer.is_valid(True)
         request_params = request_serializer.validated_data
 
-        model = DataUsageRecord if request_params['usage_type'] == 'data' else VoiceUsageRecord
+        if request_params['async_job']:
+            data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+            data.pop('async_job')
+            job = ReportJob.enqueue(self.report, data)
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        return self.get_response(request_params)
+
+    def get_response(self, request_params):
+        return Response(self.get_data(request_params))
+
+    @classmethod
+    def get_data(cls, request_params):
+        """Returns serialized report data for validated request parameters"""
+        raise NotImplementedError
+
+
+class StatsExceedingView(StatsReportView):
+    report = ReportJob.REPORT.exceeded
+    request_serializer_class = StatsExceedingRequestSerializer
+
+    def get_response(self, request_params):
+        if request_params['stream'] and 'page_size' not in request_params:
+            # streamed reports are too large to be cached
+            return streaming_json_response(self.get_query(request_params), StatsExceedingResponseSerializer)
+        return super().get_response(request_params)
+
+    @classmethod
+    def get_data(cls, request_params):
+        if 'page_size' in request_params:
+            return get_exceeding_report(request_params, lambda: cls.get_page_data(request_params))
+        return get_exceeding_report(
+            request_params,
+            lambda: serialize(StatsExceedingResponseSerializer, cls.get_query(request_params))
+        )
+
+    @staticmethod
+    def get_query(request_params):
+        # one grouped query over running totals of both subscription types
+        return get_exceeding_totals(request_params['limit']).order_by('id_field', 'id_value')
+
+    @staticmethod
+    def get_page_data(request_params):
+        page_size = request_params['page_size']
+        query = get_exceeding_totals(request_params['limit'], after=request_params['cursor'])
+        rows = list(query.order_by('id_field', 'id_value')[:page_size + 1])
+        return get_page_data(
+            rows, page_size, lambda obj: (obj['id_field'], obj['id_value']), StatsExceedingResponseSerializer
+        )
+
+
+class StatsUsageMetricsView(StatsReportView):
+    report = ReportJob.REPORT.usage_metrics
+    request_serializer_class = StatsUsageMetricsRequestSerializer
+
+    def get_response(self, request_params):
+        if request_params['stream'] and 'page_size' not in request_params:
+            # streamed reports are too large to be cached
+            return streaming_json_response(self.get_metrics(request_params), StatusUsageMetricsResponseSerializer)
+        return super().get_response(request_params)
+
+    @classmethod
+    def get_data(cls, request_params):
+        model = get_usage_model(request_params)
+        if 'page_size' in request_params:
+            return get_usage_metrics_report(model, request_params, lambda: cls.get_page_data(request_params))
+        return get_usage_metrics_report(
+            model, request_params,
+            lambda: serialize(StatusUsageMetricsResponseSerializer, cls.get_metrics(request_params))
+        )
+
+    @staticmethod
+    def get_metrics(request_params):
+        model = get_usage_model(request_params)
+        return get_usage_metrics(model.objects.all(), request_params['from_date'], request_params['to_date'])
+
+    @staticmethod
+    def get_page_data(request_params):
+        model = get_usage_model(request_params)
+        page_size = request_params['page_size']
+        rows = get_usage_metrics(
+            model.objects.all(), request_params['from_date'], request_params['to_date'],
+            after=request_params['cursor'], chunk_size=page_size + 1
+        )
+        rows = list(islice(rows, page_size + 1))
+        return get_page_data(
+            rows, page_size, lambda obj: (obj['id_field'], obj['id_value']), StatusUsageMetricsResponseSerializer
+        )
+
+
+class StatsTopView(StatsReportView):
+    report = ReportJob.REPORT.top
+    request_serializer_class = StatsTopRequestSerializer
+
+    @classmethod
+    def get_data(cls, request_params):
+        model = get_usage_model(request_params)
+
+        def compute():
+            rows = get_top_usage(
+                model.objects.all(), request_params['from_date'], request_params['to_date'], request_params['count'],
+                order_by=request_params['order_by'],
+                subscription_type=get_subscription_type(request_params),
+                threshold=request_params.get('threshold')
+            )
+            return serialize(StatusUsageMetricsResponseSerializer, rows)
+
+        return get_usage_metrics_report(model, request_params, compute, report='top')
+
+
+class StatsUsageSeriesView(StatsReportView):
+    report = ReportJob.REPORT.usage_series
+    request_serializer_class = StatsUsageSeriesRequestSerializer
+
+    def get_response(self, request_params):
+        if request_params['stream']:
+            # streamed reports are too large to be cached
+            return streaming_json_response(self.get_series(request_params), StatsUsageSeriesResponseSerializer)
+        return super().get_response(request_params)
+
+    @classmethod
+    def get_data(cls, request_params):
+        return get_usage_metrics_report(
+            get_usage_model(request_params), request_params,
+            lambda: serialize(StatsUsageSeriesResponseSerializer, cls.get_series(request_params)),
+            report='usage-series'
+        )
+
+    @staticmethod
+    def get_series(request_params):
+        model = get_usage_model(request_params)
+        return get_usage_series(
+            model.objects.all(), request_params['from_date'], request_params['to_date'], request_params['bucket'],
+            subscription_type=get_subscription_type(request_params)
+        )
+
+
+# report views by report name of job
+REPORT_VIEWS = {
+    view.report: view for view in [StatsExceedingView, StatsUsageMetricsView, StatsTopView, StatsUsageSeriesView]
+}
+
+
+class ReportJobView(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(ReportJob, id=job_id)
+        return Response(ReportJobSerializer(job).data)
 
-        query = get_usage_metrics(model.objects.all(), request_params['from_date'], request_params['to_date'])
 
-        data = StatusUsageMetricsResponseSerializer(query, many=True).data
-        return Response(data)
+class ReportJobResultView(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(ReportJob, id=job_id)
+        if job.status != ReportJob.STATUS.done:
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_409_CONFLICT)
+        # stored artifact is rendered JSON already
+        return HttpResponse(job.result, content_type='application/json')
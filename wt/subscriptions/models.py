@@ -1,8 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
+from model_utils import Choices
 
 from wt.plans.models import Plan
 
+# carriers discriminator stored with usage records
+SUBSCRIPTION_TYPES = Choices(
+    (1, 'att', 'ATT'),
+    (2, 'sprint', 'Sprint'),
+)
+
 
 class Subscription(models.Model):
     """Represents a subscription with AT&T for a user and a single device"""
@@ -21,5 +28,7 @@ class Subscription(models.Model):
 
     deleted = models.BooleanField(default=False)
 
+    SUBSCRIPTION_TYPE: int = None
+
     class Meta:
         abstract = True
@@ -1,7 +1,11 @@
+from contextlib import contextmanager
 from datetime import timedelta
 from typing import Type
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
 from django.utils import timezone
 
 from rest_framework.test import APITestCase
@@ -26,6 +30,22 @@ class BaseAPITestCase(APITestCase):
         cls.tomorrow = cls.today + timedelta(days=1)
         cls.tomorrow_date = cls.tomorrow.date()
 
+    def setUp(self):
+        super().setUp()
+        # rolled back test data doesn't invalidate cached stats reports
+        caches[settings.STATS_CACHE_ALIAS].clear()
+
+    @contextmanager
+    def run_commit_callbacks(self):
+        """Runs `transaction.on_commit` callbacks registered within the block: test data is never committed
+            (`TestCase.captureOnCommitCallbacks(execute=True)` of newer Django)"""
+        start = len(connection.run_on_commit)
+        yield
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
     def create_att(self):
         return ATTSubscription.objects.create(
             user=self.user, plan=self.plan, status='new', device_id='test', phone_number='test', phone_model='test',
@@ -38,8 +58,7 @@ class BaseAPITestCase(APITestCase):
             sprint_id='test', effective_date=timezone.now(), deleted=False
         )
 
-    @staticmethod
-    def _create_usage(model: Type[UsageRecord], subscription: UsageRecord, price, usage, usage_date):
+    def _create_usage(self, model: Type[UsageRecord], subscription: UsageRecord, price, usage, usage_date):
         usage_date = usage_date if usage_date is not None else timezone.now()
 
         if isinstance(subscription, ATTSubscription):
@@ -49,14 +68,15 @@ class BaseAPITestCase(APITestCase):
         else:
             raise RuntimeError('Unknown subscription object: it should be ATTSubscription or SprintSubscription')
 
-        return model.objects.create(
-            **{
-                field_name: subscription,
-                model.USAGE_FIELD: usage
-            },
-            price=price,
-            usage_date=usage_date
-        )
+        with self.run_commit_callbacks():
+            return model.objects.create(
+                **{
+                    field_name: subscription,
+                    model.USAGE_FIELD: usage
+                },
+                price=price,
+                usage_date=usage_date
+            )
 
     def create_data_usage(self, subscription, price, kilobytes, usage_date=None):
         return self._create_usage(DataUsageRecord, subscription, price, kilobytes, usage_date)
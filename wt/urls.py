@@ -21,9 +21,12 @@ from rest_framework import routers
 
 from wt.att_subscriptions.views import ATTSubscriptionViewSet
 from wt.plans.views import PlanViewSet
+from wt.profiling.views import ProfilingHistogramsView
 from wt.purchases.views import PurchaseViewSet
 from wt.sprint_subscriptions.views import SprintSubscriptionViewSet
-from wt.stats.views import StatsExceedingView, StatsUsageMetricsView
+from wt.stats.views import ReportJobResultView, ReportJobView, StatsExceedingView, StatsTopView, \
+    StatsUsageMetricsView, StatsUsageSeriesView
+from wt.usage.views import UsageBulkIngestView, UsageExportView
 
 router = routers.DefaultRouter()
 
@@ -37,4 +40,11 @@ urlpatterns = [
     url(r'^api/', include((router.urls, 'api'), namespace='api')),
     url(r'^api/stats/exceeded', StatsExceedingView.as_view(), name='stats-exceeded'),
     url(r'^api/stats/usage-metrics', StatsUsageMetricsView.as_view(), name='stats-usage-metrics'),
+    url(r'^api/stats/top', StatsTopView.as_view(), name='stats-top'),
+    url(r'^api/stats/usage-series', StatsUsageSeriesView.as_view(), name='stats-usage-series'),
+    url(r'^api/stats/jobs/(?P<job_id>\d+)/result$', ReportJobResultView.as_view(), name='stats-job-result'),
+    url(r'^api/stats/jobs/(?P<job_id>\d+)$', ReportJobView.as_view(), name='stats-job'),
+    url(r'^api/usage/bulk', UsageBulkIngestView.as_view(), name='usage-bulk'),
+    url(r'^api/usage/export', UsageExportView.as_view(), name='usage-export'),
+    url(r'^api/profiling/histograms$', ProfilingHistogramsView.as_view(), name='profiling-histograms'),
 ]
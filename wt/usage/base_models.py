@@ -1,105 +1,363 @@
 import datetime
 
-from typing import Type
+from decimal import Decimal
+from typing import Dict, Optional, Tuple, Type
 
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.utils import timezone
+from model_utils import Choices
 
 from wt.att_subscriptions.models import ATTSubscription
 from wt.sprint_subscriptions.models import SprintSubscription
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
+from wt.usage import partitioning
 from wt.usage.managers import UsageQuerySet
-from wt.usage.utils import chunks
+from wt.usage.signals import send_usage_changed
+from wt.usage.utils import chunks, get_usage_day, supports_on_conflict
 
 POPULATE_BULK_CREATE_CHUNK_SIZE = 100
+INCREMENTAL_ROLLUP_BATCH_SIZE = 1000
+# primary keys are allocated before commit: high-water mark of incremental rollup trails the greatest seen primary key
+# by this delay, so records of transactions that were in flight when it was seen (with lower keys) are still scanned
+INCREMENTAL_ROLLUP_LAG = datetime.timedelta(minutes=5)
+# keeps `IN (...)` lists below SQLite limit of query parameters
+DELETE_CHUNK_SIZE = 500
 
+# (subscription_type, subscription_id, usage date)
+AggregateKey = Tuple[int, int, datetime.date]
 
-class UsageRecord(models.Model):
+USAGE_TYPES = Choices('data', 'voice')
+
+SUBSCRIPTION_FIELDS = {
+    SUBSCRIPTION_TYPES.att: 'att_subscription_id',
+    SUBSCRIPTION_TYPES.sprint: 'sprint_subscription_id',
+}
+
+
+def get_subscription_key(record: models.Model) -> Tuple[Optional[int], Optional[int]]:
+    """Returns typed key (subscription type, subscription id) of record by its subscription foreign keys"""
+    for subscription_type, field_name in SUBSCRIPTION_FIELDS.items():
+        subscription_id = getattr(record, field_name)
+        if subscription_id is not None:
+            return subscription_type, subscription_id
+    return None, None
+
+
+def get_subscription_fields(subscription_type: int, subscription_id: int) -> Dict[str, Optional[int]]:
+    """Returns values of subscription foreign keys by typed subscription key"""
+    return {
+        field_name: subscription_id if field_type == subscription_type else None
+        for field_type, field_name in SUBSCRIPTION_FIELDS.items()
+    }
+
+
+class UsageTotalsMixin:
+    """Keeps running totals of subscriptions (`wt.usage.models.SubscriptionUsageTotal`) in sync with saved and deleted
+        usage records. Writes that bypass `save` and `delete` should update totals explicitly, except rollup: it moves
+        usage from raw to aggregated records and doesn't change totals"""
+
+    def save(self, *args, **kwargs):
+        from wt.usage.models import SubscriptionUsageTotal
+
+        with transaction.atomic():
+            # totals get the difference with previously saved version of record
+            previous = type(self).objects.filter(pk=self.pk).first() if self.pk is not None else None
+            super().save(*args, **kwargs)
+            SubscriptionUsageTotal.add_records([self], removed=[previous] if previous is not None else [])
+            # reports of the previous day are stale too when record is moved to another day
+            dates = {getattr(record, self.DAY_FIELD) for record in [self, previous] if record is not None}
+            send_usage_changed(getattr(type(self), 'BASE_MODEL', type(self)), dates)
+
+    def delete(self, *args, **kwargs):
+        from wt.usage.models import SubscriptionUsageTotal
+
+        with transaction.atomic():
+            SubscriptionUsageTotal.add_records([], removed=[self])
+            deleted = super().delete(*args, **kwargs)
+            send_usage_changed(getattr(type(self), 'BASE_MODEL', type(self)), {getattr(self, self.DAY_FIELD)})
+        return deleted
+
+
+class UsageRecord(UsageTotalsMixin, models.Model):
     """Abstract model for subscription usage"""
     att_subscription = models.ForeignKey(ATTSubscription, null=True, on_delete=models.PROTECT)
     sprint_subscription = models.ForeignKey(SprintSubscription, null=True, on_delete=models.PROTECT)
     price = models.DecimalField(decimal_places=2, max_digits=5, default=0)
     usage_date = models.DateTimeField(null=True)
+    # materialized date of `usage_date` (in current timezone) to filter by day using indexes
+    usage_day = models.DateField(null=True, editable=False)
+    # typed subscription key kept in sync with subscription foreign keys on write to use indexes instead of
+    # computed expressions
+    subscription_type = models.PositiveSmallIntegerField(choices=SUBSCRIPTION_TYPES, null=True, editable=False)
+    subscription_id = models.IntegerField(null=True, editable=False)
 
     USAGE_FIELD: str = None
+    USAGE_TYPE: str = None
+    DAY_FIELD = 'usage_day'
 
     objects = UsageQuerySet.as_manager()
 
     class Meta:
         abstract = True
 
-    @classmethod
-    def get_related_field_name_by_model(cls, model: Type[models.Model]):
-        """Returns related to given model field's column name"""
-        for field in cls._meta.fields:
-            if field.is_relation and field.related_model == model:
-                return field.column
-        raise RuntimeError(f'No related field for model {cls.__name__} on model {model.__name__}')
+    def fill_computed_fields(self) -> None:
+        """Fills fields derived from other fields of record. Should be called explicitly before writes that bypass
+            `save` (e.g. `bulk_create`)"""
+        self.usage_day = get_usage_day(self.usage_date)
+        self.subscription_type, self.subscription_id = get_subscription_key(self)
+
+    def save(self, *args, **kwargs):
+        self.fill_computed_fields()
+        super().save(*args, **kwargs)
 
 
-class AggregatedUsageRecord(models.Model):
+class AggregatedUsageRecord(UsageTotalsMixin, models.Model):
     """Abstract model for aggregated subscription usage by date"""
     att_subscription = models.ForeignKey(ATTSubscription, null=True, on_delete=models.PROTECT)
     sprint_subscription = models.ForeignKey(SprintSubscription, null=True, on_delete=models.PROTECT)
     price = models.DecimalField(decimal_places=2, max_digits=10, default=0)
     usage_date = models.DateField()
+    # typed subscription key kept in sync with subscription foreign keys on write to use indexes instead of
+    # computed expressions
+    subscription_type = models.PositiveSmallIntegerField(choices=SUBSCRIPTION_TYPES, null=True, editable=False)
+    subscription_id = models.IntegerField(null=True, editable=False)
 
     BASE_MODEL: Type[UsageRecord] = None
+    USAGE_FIELD: str = None
+    USAGE_TYPE: str = None
+    DAY_FIELD = 'usage_date'
 
     objects = UsageQuerySet.as_manager()
 
     class Meta:
         abstract = True
 
+    def fill_computed_fields(self) -> None:
+        """Fills fields derived from other fields of record. Should be called explicitly before writes that bypass
+            `save` (e.g. `bulk_create`)"""
+        self.subscription_type, self.subscription_id = get_subscription_key(self)
+
+    def save(self, *args, **kwargs):
+        self.fill_computed_fields()
+        super().save(*args, **kwargs)
+
     @classmethod
-    def get_not_existing_aggregate_records(cls, date: datetime.date) -> UsageQuerySet:
-        """Returns queryset (on BASE_MODEL) containing fields `att_subscription_id` and `sprint_subscription_id` that
-            represent subscriptions without aggregated record for given date"""
-        query = cls.BASE_MODEL.objects.filter(usage_date__date=date)
-        query = query.values('att_subscription_id', 'sprint_subscription_id').distinct()
-        query = query.annotate_id()
+    def populate(cls, date: datetime.date) -> int:
+        """Populates aggregated usage model with raw records on given date and then deletes counted raw records.
+            If raw usage table is partitioned by day (see `wt.usage.partitioning`), the day's partition is retired
+            (detached and dropped) instead of deleting its rows. Returns count of rolled up raw records"""
+        rolled_up = 0
+        if partitioning.is_partitioned(cls.BASE_MODEL):
+            rolled_up += cls._populate_partition(date)
+        # rows of the day outside of its partition (e.g. inserted into the default partition after it was retired)
+        rolled_up += cls._populate_rows(date)
+
+        send_usage_changed(cls.BASE_MODEL, {date})
+        return rolled_up
 
-        subquery = cls.objects.annotate_id().filter_outer_id()
-        subquery = subquery.filter(usage_date=date)
+    @classmethod
+    def _populate_partition(cls, date: datetime.date) -> int:
+        # detached in its own short transaction, then rows of the day inserted later go to the default partition
+        table = partitioning.detach_day_partition(cls.BASE_MODEL, date)
+        if table is None:
+            return 0
 
-        query = query.annotate(agg_record_exists=models.Exists(subquery))
-        query = query.filter(agg_record_exists=False)
+        with transaction.atomic():
+            totals = partitioning.aggregate_table(cls.BASE_MODEL, table)
+            for rows in chunks(totals, POPULATE_BULK_CREATE_CHUNK_SIZE):
+                cls.upsert_usage({
+                    (subscription_type, subscription_id, date): (usage, price)
+                    for subscription_type, subscription_id, usage, price in rows
+                })
 
-        return query
+            rolled_up = partitioning.count_rows(table)
+            partitioning.drop_table(table)
+        return rolled_up
+
+    @classmethod
+    def get_rollup_totals(cls, raw_records: models.QuerySet) -> models.QuerySet:
+        """Returns queryset of total usage and price of raw records by subscription. Only subscriptions with non-zero
+            usage or price are counted"""
+        totals = raw_records.filter(subscription_type__isnull=False)
+        totals = totals.values('subscription_type', 'subscription_id').annotate(
+            agg_usage=models.Sum(cls.USAGE_FIELD),
+            agg_price=models.Sum('price')
+        )
+        return totals.filter(models.Q(agg_usage__gt=0) | ~models.Q(agg_price=0)).order_by()
 
     @classmethod
     @transaction.atomic()
-    def populate(cls, date: datetime.date) -> None:
-        """Populates aggregated usage model with raw records on given date and then deletes counted raw records"""
-        # 1. create not existing aggregated records for given date for those subscription that have usage at given date
-        agg_records_to_create = cls.get_not_existing_aggregate_records(date)
-        for dicts in chunks(agg_records_to_create, POPULATE_BULK_CREATE_CHUNK_SIZE):
-            objects = [
-                cls(
-                    pk=None,
-                    att_subscription_id=d['att_subscription_id'],
-                    sprint_subscription_id=d['sprint_subscription_id'],
-                    usage_date=date
-                )
+    def _populate_rows(cls, date: datetime.date) -> int:
+        raw_records = cls.BASE_MODEL.objects.on_day(date)
+        # records created after the rollup has started are left for the next rollup
+        max_id = raw_records.aggregate(max_id=models.Max('id'))['max_id']
+        if max_id is None:
+            return 0
+        raw_records = raw_records.filter(id__lte=max_id)
+
+        # 1. total usage and price of every subscription in one grouped scan
+        totals = cls.get_rollup_totals(raw_records)
+
+        # 2. upsert aggregated records chunk by chunk
+        for dicts in chunks(totals.iterator(), POPULATE_BULK_CREATE_CHUNK_SIZE):
+            cls.upsert_usage({
+                (d['subscription_type'], d['subscription_id'], date): (d['agg_usage'], d['agg_price'])
                 for d in dicts
-            ]
-            cls.objects.bulk_create(objects)
+            })
 
-        # 2. update aggregated records
-        subquery = cls.BASE_MODEL.objects.filter(usage_date__date=date)
-        subquery = subquery.subquery_aggregate()
+        # 3. delete raw usage records that have been counted above
+        deleted, _ = raw_records.delete()
+        return deleted
+
+    @classmethod
+    def upsert_usage(cls, totals: Dict[AggregateKey, Tuple[int, Decimal]]) -> None:
+        """Adds usage and price to aggregated records by (subscription, date) keys creating missing records. Uses
+            native `INSERT ... ON CONFLICT DO UPDATE` where database supports it, so concurrent rollups write
+            idempotently in one round trip per chunk"""
+        if supports_on_conflict():
+            upsert = cls._upsert_usage_on_conflict
+        else:
+            upsert = cls._upsert_usage_fallback
+
+        for keys in chunks(totals, POPULATE_BULK_CREATE_CHUNK_SIZE):
+            upsert({key: totals[key] for key in keys})
 
-        query = cls.objects.filter(usage_date=date).annotate_id()
-        query = query.annotate(
-            agg_usage=models.Subquery(subquery.values('agg_usage'), output_field=models.IntegerField()),
-            agg_price=models.Subquery(subquery.values('agg_price'), output_field=models.DecimalField())
+    @classmethod
+    def _upsert_usage_on_conflict(cls, totals: Dict[AggregateKey, Tuple[int, Decimal]]) -> None:
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        key_fields = ['subscription_type', 'subscription_id', 'usage_date']
+        fields = [cls._meta.get_field(name) for name in [*SUBSCRIPTION_FIELDS.values(), *key_fields]]
+        fields += [cls._meta.get_field(cls.USAGE_FIELD), cls._meta.get_field('price')]
+        key_columns = ', '.join(qn(cls._meta.get_field(name).column) for name in key_fields)
+        usage_column, price_column = qn(fields[-2].column), qn(fields[-1].column)
+
+        rows = [
+            (*get_subscription_fields(subscription_type, subscription_id).values(), subscription_type, subscription_id,
+             date, usage, price)
+            for (subscription_type, subscription_id, date), (usage, price) in totals.items()
+        ]
+        params = [field.get_db_prep_save(value, connection) for row in rows for field, value in zip(fields, row)]
+        placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(rows))
+        sql = (
+            f'INSERT INTO {table} ({", ".join(qn(field.column) for field in fields)}) VALUES {placeholders} '
+            f'ON CONFLICT ({key_columns}) DO UPDATE SET '
+            f'{usage_column} = {table}.{usage_column} + EXCLUDED.{usage_column}, '
+            f'{price_column} = {table}.{price_column} + EXCLUDED.{price_column}'
         )
-        # counting only subscriptions with non-zero usage
-        query = query.filter(agg_usage__gt=0)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
 
-        # update
-        query.update(**{
-            cls.BASE_MODEL.USAGE_FIELD: models.F(cls.BASE_MODEL.USAGE_FIELD) + models.F('agg_usage'),
-            'price': models.F('price') + models.F('agg_price')
-        })
+    @classmethod
+    @transaction.atomic()
+    def _upsert_usage_fallback(cls, totals: Dict[AggregateKey, Tuple[int, Decimal]]) -> None:
+        usage_field = cls.USAGE_FIELD
+        condition = models.Q()
+        for subscription_type in SUBSCRIPTION_FIELDS:
+            ids = {subscription_id for key_type, subscription_id, _ in totals if key_type == subscription_type}
+            if ids:
+                condition |= models.Q(subscription_type=subscription_type, subscription_id__in=ids)
+        dates = {date for _, _, date in totals}
 
-        # 3. delete raw usage records that have been counted above
-        cls.BASE_MODEL.objects.filter(usage_date__date=date).delete()
+        existing = cls.objects.select_for_update().filter(condition, usage_date__in=dates)
+        existing = {(r.subscription_type, r.subscription_id, r.usage_date): r for r in existing}
+
+        to_update, to_create = [], []
+        for key, (usage, price) in totals.items():
+            record = existing.get(key)
+            if record is None:
+                subscription_type, subscription_id, date = key
+                record = cls(**get_subscription_fields(subscription_type, subscription_id), usage_date=date)
+                record.fill_computed_fields()
+                to_create.append(record)
+            else:
+                to_update.append(record)
+            setattr(record, usage_field, getattr(record, usage_field) + usage)
+            record.price += price
+
+        cls.objects.bulk_update(to_update, [usage_field, 'price'])
+        cls.objects.bulk_create(to_create)
+
+    @classmethod
+    def populate_incremental(
+            cls,
+            batch_size: int = INCREMENTAL_ROLLUP_BATCH_SIZE,
+            max_batches: int = None,
+            lag: datetime.timedelta = INCREMENTAL_ROLLUP_LAG,
+    ) -> int:
+        """Folds raw records above the high-water mark into aggregated usage model in bounded batches. Every batch is
+            a short transaction: it locks only the model's watermark, selected raw records and touched aggregated
+            records, and deletes exactly the raw records it has counted. Returns count of folded raw records.
+
+            Primary keys become visible in commit order, not in key order: a record with lower key may be committed
+            after a greater one has been folded. So the mark isn't the greatest folded key: it's the greatest key seen
+            by a run at least `lag` before the current run started. Records above the mark are scanned by every run
+            (folded ones are deleted, so they are scanned once), and late commits are folded as long as transactions
+            of writers are shorter than `lag`. Longer transactions (or a clock jump) can still leave records behind:
+            whole-day `populate` reconciles them.
+
+            Args:
+                batch_size (int, Optional): max count of raw records folded per transaction
+                max_batches (int, Optional): max count of batches to run (until no new raw records by default)
+                lag (timedelta, Optional): delay of the mark behind the greatest seen primary key
+        """
+        from wt.usage.models import RollupWatermark
+
+        usage_field = cls.USAGE_FIELD
+        started = timezone.now()
+        watermark, _ = RollupWatermark.objects.get_or_create(model=cls._meta.label)
+        after_id = watermark.last_id
+        folded = 0
+        batches = 0
+        dates = set()
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            with transaction.atomic():
+                # lock serializes concurrent incremental rollups of the model
+                RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+
+                rows = cls.BASE_MODEL.objects.filter(id__gt=after_id).order_by('id').values_list(
+                    'id', 'subscription_type', 'subscription_id', 'usage_day', usage_field, 'price'
+                )
+                rows = list(rows[:batch_size])
+                if not rows:
+                    break
+
+                totals = {}
+                ids = []
+                for row_id, subscription_type, subscription_id, date, usage, price in rows:
+                    if date is None or subscription_type is None:
+                        # records without usage date or subscription can't be aggregated
+                        continue
+                    key = (subscription_type, subscription_id, date)
+                    usage_total, price_total = totals.get(key, (0, 0))
+                    totals[key] = (usage_total + usage, price_total + price)
+                    ids.append(row_id)
+                    dates.add(date)
+
+                cls.upsert_usage(totals)
+                for ids_chunk in chunks(ids, DELETE_CHUNK_SIZE):
+                    cls.BASE_MODEL.objects.filter(id__in=ids_chunk).delete()
+
+                RollupWatermark.objects.filter(pk=watermark.pk).update(
+                    rows_folded=models.F('rows_folded') + len(ids)
+                )
+                after_id = rows[-1][0]
+
+            folded += len(ids)
+            if len(rows) < batch_size:
+                break
+
+        with transaction.atomic():
+            watermark = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+            if watermark.seen_at is not None and watermark.seen_at <= started - lag:
+                # every record up to the key seen before the lag was committed before this run and scanned by it
+                watermark.last_id = max(watermark.last_id, watermark.seen_id)
+                watermark.seen_at = None
+            if watermark.seen_at is None and after_id > watermark.last_id:
+                watermark.seen_id, watermark.seen_at = after_id, timezone.now()
+            watermark.save()
+
+        if dates:
+            send_usage_changed(cls.BASE_MODEL, dates)
+        return folded
@@ -0,0 +1,160 @@
+"""Columnar export of raw and aggregated usage records within a period of days.
+
+Rows are read with server-side cursor (where database supports it) in chunks of `EXPORT_CHUNK_SIZE` tuples, every
+chunk is transposed into columns and written as one batch, so no per-row dicts or serializers are involved. Formats:
+
+* `parquet`: Apache Parquet file with one row group per batch (requires optional `pyarrow` package);
+* `json`: gzip-compressed newline-delimited JSON with one object of columns per batch, e.g.
+  `{"id": [1, 2], "price": ["0.10", "1.00"], ...}`. It needs no extra packages and is written as a stream.
+"""
+import datetime
+import zlib
+
+from typing import BinaryIO, Dict, Iterator, List, Type
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord, DataUsageRecord, VoiceUsageRecord
+from wt.usage.utils import chunks
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+EXPORT_CHUNK_SIZE = 50000
+
+EXPORT_MODELS = {
+    'data': DataUsageRecord,
+    'voice': VoiceUsageRecord,
+    'agg-data': AggregatedDataUsageRecord,
+    'agg-voice': AggregatedVoiceUsageRecord,
+}
+
+EXPORT_FORMATS = ['parquet', 'json']
+
+EXPORT_CONTENT_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'json': 'application/gzip',
+}
+
+EXPORT_EXTENSIONS = {
+    'parquet': 'parquet',
+    'json': 'json.gz',
+}
+
+
+class ExportError(ValueError):
+    """Raised for export that can't be done in this environment"""
+
+
+def get_export_formats() -> List[str]:
+    """Returns formats supported by installed packages"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def get_columns(model: Type[models.Model]) -> List[str]:
+    return ['id', 'subscription_type', 'subscription_id', 'usage_date', model.USAGE_FIELD, 'price']
+
+
+def iterate_batches(
+        model: Type[models.Model],
+        from_date: datetime.date,
+        to_date: datetime.date,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[Dict[str, tuple]]:
+    """Yields columns (dict of column name to values) of model's records within given days by batches of
+        `chunk_size` records ordered by primary key"""
+    columns = get_columns(model)
+    rows = model.objects.within_days(from_date, to_date).order_by('id').values_list(*columns)
+    for chunk in chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+        yield dict(zip(columns, zip(*chunk)))
+
+
+def iterate_json(
+        model: Type[models.Model],
+        from_date: datetime.date,
+        to_date: datetime.date,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Yields gzip-compressed newline-delimited JSON of column batches piece by piece"""
+    encoder = DjangoJSONEncoder()
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    for batch in iterate_batches(model, from_date, to_date, chunk_size):
+        data = compressor.compress((encoder.encode(batch) + '\n').encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_arrow_type(field: models.Field) -> 'pyarrow.DataType':
+    """Returns Arrow type of model field by its internal type, so subclasses of mapped fields are mapped as well"""
+    if isinstance(field, models.DecimalField):
+        return pyarrow.decimal128(field.max_digits, field.decimal_places)
+
+    internal_type = field.get_internal_type()
+    types = {
+        'AutoField': pyarrow.int64(),
+        'BigAutoField': pyarrow.int64(),
+        'IntegerField': pyarrow.int64(),
+        'BigIntegerField': pyarrow.int64(),
+        'PositiveIntegerField': pyarrow.int64(),
+        'SmallIntegerField': pyarrow.int16(),
+        'PositiveSmallIntegerField': pyarrow.int16(),
+        'BooleanField': pyarrow.bool_(),
+        'CharField': pyarrow.string(),
+        'TextField': pyarrow.string(),
+        'DateField': pyarrow.date32(),
+        'DateTimeField': pyarrow.timestamp('us', tz='UTC'),
+    }
+    if internal_type not in types:
+        raise ExportError(f'Unsupported field type of Parquet export: {internal_type}')
+    return types[internal_type]
+
+
+def get_arrow_schema(model: Type[models.Model]) -> 'pyarrow.Schema':
+    fields = []
+    for name in get_columns(model):
+        field = model._meta.get_field(name)
+        fields.append(pyarrow.field(name, get_arrow_type(field), nullable=field.null))
+    return pyarrow.schema(fields)
+
+
+def write_parquet(
+        model: Type[models.Model],
+        from_date: datetime.date,
+        to_date: datetime.date,
+        file: BinaryIO,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> int:
+    """Writes model's records within given days to Parquet file. Returns count of written records"""
+    if pyarrow is None:
+        raise ExportError('Parquet export requires `pyarrow` package')
+
+    schema = get_arrow_schema(model)
+    count = 0
+    with pyarrow.parquet.ParquetWriter(file, schema, compression='zstd') as writer:
+        for batch in iterate_batches(model, from_date, to_date, chunk_size):
+            arrays = [pyarrow.array(batch[field.name], type=field.type) for field in schema]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            count += len(batch['id'])
+    return count
+
+
+def write_export(
+        model: Type[models.Model],
+        from_date: datetime.date,
+        to_date: datetime.date,
+        fmt: str,
+        file: BinaryIO,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> None:
+    """Writes model's records within given days to binary file in given format"""
+    if fmt == 'parquet':
+        write_parquet(model, from_date, to_date, file, chunk_size)
+        return
+
+    for data in iterate_json(model, from_date, to_date, chunk_size):
+        file.write(data)
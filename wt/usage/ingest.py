@@ -0,0 +1,250 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from wt.att_subscriptions.models import ATTSubscription
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.usage.base_models import UsageRecord
+from wt.usage.models import DataUsageRecord, SubscriptionUsageTotal, VoiceUsageRecord
+from wt.usage.signals import send_usage_changed
+from wt.usage.utils import chunks
+
+INGEST_CHUNK_SIZE = 5000
+INGEST_MAX_REPORTED_ERRORS = 100
+
+USAGE_MODELS = {
+    'data': DataUsageRecord,
+    'voice': VoiceUsageRecord,
+}
+
+SUBSCRIPTION_MODELS = {
+    'att': ATTSubscription,
+    'sprint': SprintSubscription,
+}
+
+EVENT_FIELDS = ['usage_type', 'subscription_type', 'subscription_id', 'usage', 'price', 'usage_date']
+
+PRICE_QUANTUM = decimal.Decimal('0.01')
+PRICE_MAX = decimal.Decimal('999.99')  # max_digits=5, decimal_places=2 of UsageRecord.price
+INTEGER_MAX = 2147483647  # the greatest value of `IntegerField` of all backends (int4 of PostgreSQL)
+
+
+class EventError(ValueError):
+    """Raised for a usage event that can't be ingested"""
+
+
+def parse_ndjson(lines: Iterable[bytes]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yields `(line number, event, error)` for every non-empty line of newline-delimited JSON"""
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            yield line_no, None, 'Invalid JSON'
+            continue
+        if not isinstance(event, dict):
+            yield line_no, None, 'Event should be a JSON object'
+            continue
+        yield line_no, event, None
+
+
+def is_utf8(value: Optional[str]) -> bool:
+    try:
+        if value is not None:
+            value.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def parse_csv(lines: Iterable[bytes]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yields `(line number, event, error)` for every row of CSV with header line"""
+    # bytes that aren't UTF-8 are decoded to lone surrogates, so only rows containing them are rejected
+    reader = csv.DictReader(line.decode('utf-8', 'surrogateescape') for line in lines)
+    for event in reader:
+        if None in event:
+            yield reader.line_num, None, 'Too many values'
+            continue
+        if not all(is_utf8(value) for value in event.values()):
+            yield reader.line_num, None, 'Invalid UTF-8'
+            continue
+        yield reader.line_num, event, None
+
+
+def parse_integer(value) -> int:
+    """Returns integer of JSON integer or of CSV string of integer. Raises `ValueError` for other values, values are
+        never rounded"""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return int(value.strip())
+    raise ValueError(value)
+
+
+def validate_event(event: dict) -> UsageRecord:
+    """Converts raw event to unsaved usage record (subscription existence is not checked here)"""
+    missing = [field for field in EVENT_FIELDS if event.get(field) in (None, '')]
+    if missing:
+        raise EventError(f'Missing fields: {", ".join(missing)}')
+
+    # values of JSON events may be of any type
+    model = USAGE_MODELS.get(event['usage_type']) if isinstance(event['usage_type'], str) else None
+    if model is None:
+        raise EventError(f'Unsupported usage type: {event["usage_type"]}')
+    if not isinstance(event['subscription_type'], str) or event['subscription_type'] not in SUBSCRIPTION_MODELS:
+        raise EventError(f'Unsupported subscription type: {event["subscription_type"]}')
+
+    try:
+        subscription_id = parse_integer(event['subscription_id'])
+        usage = parse_integer(event['usage'])
+    except ValueError:
+        raise EventError('`subscription_id` and `usage` should be integers')
+    if not 0 < subscription_id <= INTEGER_MAX:
+        raise EventError(f'`subscription_id` should be between 1 and {INTEGER_MAX}')
+    if not 0 <= usage <= INTEGER_MAX:
+        raise EventError(f'`usage` should be between 0 and {INTEGER_MAX}')
+
+    try:
+        price = decimal.Decimal(str(event['price']))
+    except decimal.InvalidOperation:
+        raise EventError('`price` should be a decimal number')
+    if not price.is_finite() or price != price.quantize(PRICE_QUANTUM) or abs(price) > PRICE_MAX:
+        raise EventError(f'`price` should have at most 2 decimal places and not exceed {PRICE_MAX}')
+
+    usage_date = event['usage_date']
+    if not isinstance(usage_date, datetime.datetime):
+        try:
+            usage_date = parse_datetime(str(usage_date))
+        except ValueError:
+            usage_date = None
+        if usage_date is None:
+            raise EventError('`usage_date` should be an ISO 8601 datetime')
+    if timezone.is_naive(usage_date):
+        usage_date = timezone.make_aware(usage_date)
+
+    record = model(
+        **{
+            f'{event["subscription_type"]}_subscription_id': subscription_id,
+            model.USAGE_FIELD: usage,
+        },
+        price=price,
+        usage_date=usage_date
+    )
+    record.fill_computed_fields()
+    return record
+
+
+def get_existing_subscriptions(records: List[UsageRecord]) -> Dict[str, set]:
+    """Returns ids of existing subscriptions (by subscription type) referenced by given records"""
+    existing = {}
+    for subscription_type, model in SUBSCRIPTION_MODELS.items():
+        field_name = f'{subscription_type}_subscription_id'
+        ids = {getattr(record, field_name) for record in records} - {None}
+        existing[subscription_type] = set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+    return existing
+
+
+def copy_records(model: Type[UsageRecord], records: List[UsageRecord]) -> None:
+    """Writes records with PostgreSQL `COPY` (psycopg2 backend only)"""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        # empty unquoted value is NULL for COPY in CSV format
+        writer.writerow(
+            [
+                '' if value is None else value
+                for value in (field.get_db_prep_save(getattr(record, field.attname), connection) for field in fields)
+            ]
+        )
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def write_records(model: Type[UsageRecord], records: List[UsageRecord]) -> None:
+    """Writes records of given model in one batch (`COPY` on PostgreSQL, `bulk_create` elsewhere)"""
+    if connection.vendor == 'postgresql':
+        copy_records(model, records)
+    else:
+        model.objects.bulk_create(records, batch_size=INGEST_CHUNK_SIZE)
+
+
+def add_error(result: dict, line_no: int, error: str) -> None:
+    result['rejected'] += 1
+    if len(result['errors']) < INGEST_MAX_REPORTED_ERRORS:
+        result['errors'].append({'line': line_no, 'error': error})
+
+
+def ingest_chunk(parsed: List[Tuple[int, Optional[dict], Optional[str]]], result: dict) -> None:
+    records = {model: [] for model in USAGE_MODELS.values()}
+    valid = []
+    for line_no, event, error in parsed:
+        if error is None:
+            try:
+                valid.append((line_no, validate_event(event)))
+                continue
+            except EventError as e:
+                error = str(e)
+        add_error(result, line_no, error)
+
+    existing = get_existing_subscriptions([record for _, record in valid])
+    for line_no, record in valid:
+        for subscription_type in SUBSCRIPTION_MODELS:
+            subscription_id = getattr(record, f'{subscription_type}_subscription_id')
+            if subscription_id is not None and subscription_id not in existing[subscription_type]:
+                add_error(result, line_no, f'Subscription {subscription_type}:{subscription_id} does not exist')
+                break
+        else:
+            records[type(record)].append(record)
+
+    with transaction.atomic():
+        for model, model_records in records.items():
+            if model_records:
+                write_records(model, model_records)
+                result['accepted'] += len(model_records)
+        # running totals are updated in the same transaction as written records
+        SubscriptionUsageTotal.add_records(record for model_records in records.values() for record in model_records)
+
+    for model, model_records in records.items():
+        if model_records:
+            send_usage_changed(model, {record.usage_day for record in model_records})
+
+
+def ingest(lines: Iterable[bytes], fmt: str = 'ndjson') -> dict:
+    """Validates and writes stream of data and voice usage events chunk by chunk. Every chunk is written in its own
+        transaction, so memory usage doesn't depend on size of the stream.
+
+        Every event should contain fields: `usage_type` (`data` or `voice`), `subscription_type` (`att` or `sprint`),
+        `subscription_id`, `usage` (kilobytes or seconds), `price` and `usage_date` (ISO 8601).
+
+        Args:
+            lines (Iterable[bytes]): lines of newline-delimited JSON or CSV with header
+            fmt (str, Optional): `ndjson` or `csv`
+
+        Returns:
+            dict: accepted and rejected events counters and first rejected events with reasons (`errors`)
+    """
+    parse = parse_csv if fmt == 'csv' else parse_ndjson
+    result = {'accepted': 0, 'rejected': 0, 'errors': []}
+
+    for parsed in chunks(parse(lines), INGEST_CHUNK_SIZE):
+        ingest_chunk(parsed, result)
+
+    return result
@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wt.usage.export import EXPORT_EXTENSIONS, EXPORT_FORMATS, EXPORT_MODELS, EXPORT_CHUNK_SIZE, get_export_formats, \
+    write_export
+from wt.usage.management.commands.rollup_usage import parse_date_argument
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports raw and aggregated usage records within given period to compressed columnar files: one file per '
+        'usage model in output directory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', type=parse_date_argument, required=True)
+        parser.add_argument('--to', dest='to_date', type=parse_date_argument, required=True)
+        parser.add_argument(
+            '--model', dest='models', choices=list(EXPORT_MODELS), action='append',
+            help='usage model to export (may be repeated, all models by default)'
+        )
+        parser.add_argument(
+            '--format', dest='fmt', choices=EXPORT_FORMATS, default=None,
+            help='file format (`parquet` if `pyarrow` is installed, `json` otherwise by default)'
+        )
+        parser.add_argument('--output', default='.', help='output directory')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='count of records per batch')
+
+    def handle(self, *args, from_date, to_date, models, fmt, output, chunk_size, **options):
+        if from_date > to_date:
+            raise CommandError('`--from` date should not be after `--to` date')
+        if chunk_size < 1:
+            raise CommandError('`--chunk-size` should be positive')
+
+        formats = get_export_formats()
+        fmt = fmt or formats[0]
+        if fmt not in formats:
+            raise CommandError(f'Format `{fmt}` requires `pyarrow` package')
+        if not os.path.isdir(output):
+            raise CommandError(f'No such directory: {output}')
+
+        for name in models or EXPORT_MODELS:
+            path = os.path.join(
+                output, f'{name}_{from_date.isoformat()}_{to_date.isoformat()}.{EXPORT_EXTENSIONS[fmt]}'
+            )
+            started = time.monotonic()
+            with open(path, 'wb') as file:
+                write_export(EXPORT_MODELS[name], from_date, to_date, fmt, file, chunk_size)
+            self.stdout.write(f'{name}: {path} ({os.path.getsize(path)} bytes) in {time.monotonic() - started:.2f}s')
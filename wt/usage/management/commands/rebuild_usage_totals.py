@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wt.usage.models import SubscriptionUsageTotal
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds running totals of subscriptions from scratch by raw and aggregated usage records'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = SubscriptionUsageTotal.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} totals in {time.monotonic() - started:.2f}s'))
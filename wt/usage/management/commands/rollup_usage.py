@@ -0,0 +1,123 @@
+import datetime
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+import django
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils.dateparse import parse_date
+
+AGGREGATED_MODELS = {
+    'data': 'usage.AggregatedDataUsageRecord',
+    'voice': 'usage.AggregatedVoiceUsageRecord',
+}
+
+
+def init_worker() -> None:
+    # worker processes may be spawned (not forked) and then need their own configured Django
+    django.setup()
+
+
+def rollup(usage_type: str, date: datetime.date) -> Tuple[str, datetime.date, int, float]:
+    """Rolls up raw usage of given type on given date. Runs in worker process with its own DB connection"""
+    from django.apps import apps
+
+    model = apps.get_model(AGGREGATED_MODELS[usage_type])
+    started = time.monotonic()
+    rows = model.populate(date)
+    return usage_type, date, rows, time.monotonic() - started
+
+
+def rollup_incremental(usage_type: str, batch_size: int, max_batches: int = None) -> Tuple[str, int, float]:
+    """Folds raw usage of given type created after the rollup's high-water mark"""
+    from django.apps import apps
+
+    model = apps.get_model(AGGREGATED_MODELS[usage_type])
+    started = time.monotonic()
+    rows = model.populate_incremental(batch_size=batch_size, max_batches=max_batches)
+    return usage_type, rows, time.monotonic() - started
+
+
+def parse_date_argument(value: str) -> datetime.date:
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(f'Invalid date: {value}')
+    return date
+
+
+class Command(BaseCommand):
+    help = (
+        'Rolls up raw usage records into aggregated usage tables for every date within given period or, in '
+        'incremental mode, folds raw usage records created since the previous rollup'
+    )
+
+    def add_arguments(self, parser):
+        # models are not imported on module level: the module is imported by spawned workers before Django setup
+        from wt.usage.base_models import INCREMENTAL_ROLLUP_BATCH_SIZE
+
+        parser.add_argument('--from', dest='from_date', type=parse_date_argument)
+        parser.add_argument('--to', dest='to_date', type=parse_date_argument)
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='fold only raw records created after the high-water mark in small transactions (whole-day rollup '
+                 'still reconciles records committed later than the mark lag)'
+        )
+        parser.add_argument('--batch-size', type=int, default=INCREMENTAL_ROLLUP_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help='max count of batches per usage type in incremental mode')
+        parser.add_argument('--workers', type=int, default=1, help='count of worker processes')
+        parser.add_argument(
+            '--usage-type', dest='usage_types', choices=list(AGGREGATED_MODELS), action='append',
+            help='usage type to roll up (may be repeated, all types by default)'
+        )
+
+    def handle(self, *args, from_date, to_date, workers, usage_types, incremental, **options):
+        if incremental:
+            return self.handle_incremental(usage_types or list(AGGREGATED_MODELS), **options)
+
+        if from_date is None or to_date is None:
+            raise CommandError('`--from` and `--to` dates are required unless `--incremental` is given')
+        if from_date > to_date:
+            raise CommandError('`--from` date should not be after `--to` date')
+        if workers < 1:
+            raise CommandError('`--workers` should be positive')
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite does not support concurrent writers, rolling up in a single process')
+            workers = 1
+
+        dates = [from_date + datetime.timedelta(days=idx) for idx in range((to_date - from_date).days + 1)]
+        tasks = [(usage_type, date) for date in dates for usage_type in usage_types or AGGREGATED_MODELS]
+
+        started = time.monotonic()
+        total_rows = 0
+        for usage_type, date, rows, seconds in self.run(tasks, workers):
+            total_rows += rows
+            self.stdout.write(f'{date.isoformat()} {usage_type}: {rows} rows in {seconds:.2f}s')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {total_rows} rows for {len(dates)} dates in {time.monotonic() - started:.2f}s'
+        ))
+
+    def handle_incremental(self, usage_types, batch_size, max_batches, **options):
+        if batch_size < 1:
+            raise CommandError('`--batch-size` should be positive')
+
+        for usage_type in usage_types:
+            _, rows, seconds = rollup_incremental(usage_type, batch_size, max_batches)
+            self.stdout.write(f'incremental {usage_type}: {rows} rows in {seconds:.2f}s')
+
+    @staticmethod
+    def run(tasks, workers):
+        if workers == 1:
+            for task in tasks:
+                yield rollup(*task)
+            return
+
+        # forked workers must not share parent's connections: every worker opens its own one
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = [executor.submit(rollup, *task) for task in tasks]
+            for future in futures:
+                yield future.result()
@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from wt.usage import partitioning
+from wt.usage.models import DataUsageRecord, VoiceUsageRecord
+
+RAW_MODELS = {
+    'data': DataUsageRecord,
+    'voice': VoiceUsageRecord,
+}
+
+
+class Command(BaseCommand):
+    help = 'Pre-creates daily partitions of raw usage tables for upcoming days (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='convert not partitioned raw usage tables to tables partitioned by usage day first'
+        )
+        parser.add_argument('--days-ahead', type=int, default=7, help='count of upcoming days to create partitions for')
+        parser.add_argument(
+            '--usage-type', dest='usage_types', choices=list(RAW_MODELS), action='append',
+            help='usage type to partition (may be repeated, all types by default)'
+        )
+
+    def handle(self, *args, convert, days_ahead, usage_types, **options):
+        if not partitioning.is_supported():
+            raise CommandError('Partitioning of usage tables is supported on PostgreSQL only')
+        if days_ahead < 0:
+            raise CommandError('`--days-ahead` should not be negative')
+
+        today = timezone.localdate()
+        for usage_type in usage_types or RAW_MODELS:
+            model = RAW_MODELS[usage_type]
+            if not partitioning.is_partitioned(model):
+                if not convert:
+                    raise CommandError(f'Table {model._meta.db_table} is not partitioned, use `--convert` first')
+                partitioning.convert_to_partitioned(model)
+                self.stdout.write(f'{usage_type}: converted {model._meta.db_table} to partitioned table')
+
+            created = partitioning.create_partitions(model, today, today + datetime.timedelta(days=days_ahead))
+            self.stdout.write(f'{usage_type}: created {len(created)} partitions')
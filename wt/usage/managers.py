@@ -2,57 +2,53 @@ from django.db import models
 from django.db.models.functions import Coalesce
 
 
-USAGE_ID_FIELD_ANNOTATION = models.Case(
-    models.When(att_subscription_id__isnull=False, then=models.Value('att_subscription_id')),
-    default=models.Value('sprint_subscription_id'),
-    output_field=models.CharField()
-)
+# typed subscription key: carrier discriminator (`wt.subscriptions.models.SUBSCRIPTION_TYPES`) and subscription id
+USAGE_ID_FIELD_ANNOTATION = models.F('subscription_type')
 
-USAGE_ID_VALUE_ANNOTATION = Coalesce(
-    'att_subscription_id',
-    'sprint_subscription_id',
-    output_field=models.IntegerField()
-)
+USAGE_ID_VALUE_ANNOTATION = models.F('subscription_id')
+
+
+def subscription_key_after(subscription_type, subscription_id) -> models.Q:
+    """Returns condition on typed subscription key (`subscription_type`, `subscription_id`) following given one"""
+    return (
+        models.Q(subscription_type__gt=subscription_type) |
+        models.Q(subscription_type=subscription_type, subscription_id__gt=subscription_id)
+    )
 
 
 class UsageQuerySet(models.QuerySet):
+    def on_day(self, date):
+        """Filters records of given day using indexed day column of model (`DAY_FIELD`)"""
+        return self.filter(**{self.model.DAY_FIELD: date})
+
+    def within_days(self, from_date, to_date):
+        """Filters records of days within given period (including bounds) using indexed day column of model"""
+        return self.filter(**{f'{self.model.DAY_FIELD}__gte': from_date, f'{self.model.DAY_FIELD}__lte': to_date})
+
+    def after_subscription(self, subscription_type, subscription_id):
+        """Filters records of subscriptions following given one in (`subscription_type`, `subscription_id`) order,
+            so keyset pagination uses the typed subscription key index"""
+        return self.filter(subscription_key_after(subscription_type, subscription_id))
+
     def annotate_id(self):
         return self.annotate(
             id_field=USAGE_ID_FIELD_ANNOTATION,
             id_value=USAGE_ID_VALUE_ANNOTATION
         )
 
-    def filter_outer_id(self):
-        return self.filter(
-            id_field=models.OuterRef('id_field'),
-            id_value=models.OuterRef('id_value')
-        )
-
-    def subquery_aggregate(self, need_usage=True, need_price=True):
-        """Annotates queryset over UsageRecord child model with total usage and price by subscription. Returns annotated
-            and filtered with outerref queryset with only fields: `id_field`, `id_value`, `att_subscription_id`,
-            `sprint_subscription_id` and optional fields `agg_usage`, `agg_price`. Entries in returned queryset are
-            unique by subscription.
-
-            Args:
-                need_usage (bool, Optional): need aggregated total usage in returned queryset (`agg_usage`)
-                need_price (bool, Optional): need aggregated total price in returned queryset (`agg_price`)
+    def group_aggregate(self):
+        """Groups queryset over UsageRecord child model by subscription and annotates every group with total usage and
+            price in a single grouped scan, without correlated subqueries. Returns queryset of dicts with fields:
+            `id_field`, `id_value`, `agg_usage`, `agg_price`.
         """
 
         if not hasattr(self.model, 'USAGE_FIELD'):
             raise RuntimeError('No `USAGE_FIELD` field for model of query')
 
-        query = self.values('att_subscription_id', 'sprint_subscription_id').distinct()
-        query = query.annotate_id().filter_outer_id()
-
-        if need_usage:
-            query = query.annotate(
-                agg_usage=Coalesce(models.Sum(self.model.USAGE_FIELD), 0, output_field=models.IntegerField())
-            )
-
-        if need_price:
-            query = query.annotate(
-                agg_price=Coalesce(models.Sum('price'), 0, output_field=models.IntegerField())
-            )
+        query = self.annotate_id().values('id_field', 'id_value')
+        query = query.annotate(
+            agg_usage=Coalesce(models.Sum(self.model.USAGE_FIELD), 0, output_field=models.IntegerField()),
+            agg_price=Coalesce(models.Sum('price'), 0, output_field=models.DecimalField())
+        )
 
         return query
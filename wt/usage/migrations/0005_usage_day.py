@@ -0,0 +1,79 @@
+# Generated by Django 2.2.1 on 2026-10-18 14:45
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def fill_usage_day(apps, schema_editor):
+    for model_name in ['DataUsageRecord', 'VoiceUsageRecord']:
+        model = apps.get_model('usage', model_name)
+        model.objects.update(usage_day=TruncDate('usage_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usage', '0004_auto_20200701_0651'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datausagerecord',
+            name='usage_day',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='voiceusagerecord',
+            name='usage_day',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_usage_day, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='aggregateddatausagerecord',
+            index=models.Index(fields=['att_subscription', 'usage_date'], name='usages_agg_data_att_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregateddatausagerecord',
+            index=models.Index(fields=['sprint_subscription', 'usage_date'], name='usages_agg_data_spr_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregateddatausagerecord',
+            index=models.Index(fields=['usage_date'], name='usages_agg_data_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedvoiceusagerecord',
+            index=models.Index(fields=['att_subscription', 'usage_date'], name='usages_agg_voice_att_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedvoiceusagerecord',
+            index=models.Index(fields=['sprint_subscription', 'usage_date'], name='usages_agg_voice_spr_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedvoiceusagerecord',
+            index=models.Index(fields=['usage_date'], name='usages_agg_voice_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagerecord',
+            index=models.Index(fields=['att_subscription', 'usage_day'], name='usages_data_att_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagerecord',
+            index=models.Index(fields=['sprint_subscription', 'usage_day'], name='usages_data_spr_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagerecord',
+            index=models.Index(fields=['usage_day'], name='usages_data_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceusagerecord',
+            index=models.Index(fields=['att_subscription', 'usage_day'], name='usages_voice_att_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceusagerecord',
+            index=models.Index(fields=['sprint_subscription', 'usage_day'], name='usages_voice_spr_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceusagerecord',
+            index=models.Index(fields=['usage_day'], name='usages_voice_day_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.1 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+USAGE_FIELDS = {
+    'AggregatedDataUsageRecord': 'kilobytes_used',
+    'AggregatedVoiceUsageRecord': 'seconds_used',
+}
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merges aggregated records of the same subscription and date into the one with the least id. Unique key of
+        subscription and date is added by `0008_typed_subscription_key` on typed subscription key"""
+    for model_name, usage_field in USAGE_FIELDS.items():
+        model = apps.get_model('usage', model_name)
+        for subscription_field in ['att_subscription_id', 'sprint_subscription_id']:
+            duplicates = model.objects.filter(**{f'{subscription_field}__isnull': False})
+            duplicates = duplicates.values(subscription_field, 'usage_date').annotate(
+                count=models.Count('id'),
+                keep_id=models.Min('id'),
+                total_usage=models.Sum(usage_field),
+                total_price=models.Sum('price'),
+            ).filter(count__gt=1).order_by()
+
+            for duplicate in duplicates:
+                model.objects.filter(id=duplicate['keep_id']).update(
+                    **{usage_field: duplicate['total_usage']},
+                    price=duplicate['total_price']
+                )
+                model.objects.filter(
+                    **{subscription_field: duplicate[subscription_field]},
+                    usage_date=duplicate['usage_date']
+                ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usage', '0006_rollupwatermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
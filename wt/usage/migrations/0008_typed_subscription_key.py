@@ -0,0 +1,120 @@
+# Generated by Django 2.2.1 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+SUBSCRIPTION_TYPES = {
+    'att_subscription_id': 1,
+    'sprint_subscription_id': 2,
+}
+
+
+def fill_subscription_key(apps, schema_editor):
+    # the same priority as `get_subscription_key`: ATT key of records with both foreign keys
+    for model_name in [
+        'DataUsageRecord', 'VoiceUsageRecord', 'AggregatedDataUsageRecord', 'AggregatedVoiceUsageRecord'
+    ]:
+        model = apps.get_model('usage', model_name)
+        for field_name, subscription_type in SUBSCRIPTION_TYPES.items():
+            model.objects.filter(**{f'{field_name}__isnull': False}, subscription_type__isnull=True).update(
+                subscription_type=subscription_type,
+                subscription_id=models.F(field_name)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usage', '0007_merge_aggregated_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregateddatausagerecord',
+            name='subscription_id',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='aggregateddatausagerecord',
+            name='subscription_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ATT'), (2, 'Sprint')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='aggregatedvoiceusagerecord',
+            name='subscription_id',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='aggregatedvoiceusagerecord',
+            name='subscription_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ATT'), (2, 'Sprint')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='datausagerecord',
+            name='subscription_id',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='datausagerecord',
+            name='subscription_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ATT'), (2, 'Sprint')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='voiceusagerecord',
+            name='subscription_id',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='voiceusagerecord',
+            name='subscription_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ATT'), (2, 'Sprint')], editable=False, null=True),
+        ),
+        migrations.RunPython(fill_subscription_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='datausagerecord',
+            index=models.Index(fields=['subscription_type', 'subscription_id', 'usage_day'], name='usages_data_sub_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceusagerecord',
+            index=models.Index(fields=['subscription_type', 'subscription_id', 'usage_day'], name='usages_voice_sub_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='aggregateddatausagerecord',
+            constraint=models.UniqueConstraint(fields=('subscription_type', 'subscription_id', 'usage_date'), name='usages_agg_data_sub_day_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='aggregatedvoiceusagerecord',
+            constraint=models.UniqueConstraint(fields=('subscription_type', 'subscription_id', 'usage_date'), name='usages_agg_voice_sub_day_uniq'),
+        ),
+        migrations.RemoveIndex(
+            model_name='aggregateddatausagerecord',
+            name='usages_agg_data_att_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='aggregateddatausagerecord',
+            name='usages_agg_data_spr_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='aggregatedvoiceusagerecord',
+            name='usages_agg_voice_att_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='aggregatedvoiceusagerecord',
+            name='usages_agg_voice_spr_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='datausagerecord',
+            name='usages_data_att_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='datausagerecord',
+            name='usages_data_spr_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceusagerecord',
+            name='usages_voice_att_day_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceusagerecord',
+            name='usages_voice_spr_day_idx',
+        ),
+    ]
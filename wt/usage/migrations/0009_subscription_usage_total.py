@@ -0,0 +1,67 @@
+# Generated by Django 2.2.1 on 2026-10-18 15:00
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+USAGE_MODELS = {
+    'DataUsageRecord': ('data', 'kilobytes_used'),
+    'VoiceUsageRecord': ('voice', 'seconds_used'),
+    'AggregatedDataUsageRecord': ('data', 'kilobytes_used'),
+    'AggregatedVoiceUsageRecord': ('voice', 'seconds_used'),
+}
+
+
+def fill_totals(apps, schema_editor):
+    totals = {}
+    for model_name, (usage_type, usage_field) in USAGE_MODELS.items():
+        model = apps.get_model('usage', model_name)
+        rows = model.objects.filter(subscription_type__isnull=False).values('subscription_type', 'subscription_id')
+        rows = rows.annotate(usage=models.Sum(usage_field), price=models.Sum('price'))
+        for row in rows.iterator():
+            key = (row['subscription_type'], row['subscription_id'], usage_type)
+            usage, price = totals.get(key, (0, Decimal(0)))
+            totals[key] = (usage + (row['usage'] or 0), price + (row['price'] or 0))
+
+    total_model = apps.get_model('usage', 'SubscriptionUsageTotal')
+    total_model.objects.bulk_create(
+        [
+            total_model(subscription_type=subscription_type, subscription_id=subscription_id, usage_type=usage_type,
+                        usage=usage, price=price)
+            for (subscription_type, subscription_id, usage_type), (usage, price) in totals.items()
+        ],
+        batch_size=100
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usage', '0008_typed_subscription_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionUsageTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_type', models.PositiveSmallIntegerField(choices=[(1, 'ATT'), (2, 'Sprint')])),
+                ('subscription_id', models.IntegerField()),
+                ('usage_type', models.CharField(choices=[('data', 'data'), ('voice', 'voice')], max_length=10)),
+                ('usage', models.BigIntegerField(default=0)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'db_table': 'usages_totals',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='subscriptionusagetotal',
+            index=models.Index(fields=['subscription_type', 'price'], name='usages_totals_price_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscriptionusagetotal',
+            constraint=models.UniqueConstraint(fields=('subscription_type', 'subscription_id', 'usage_type'), name='usages_totals_sub_type_uniq'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
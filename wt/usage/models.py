@@ -1,9 +1,19 @@
-from django.db import models
+from decimal import Decimal
+from typing import Dict, Iterable, Tuple
+
+from django.db import connection, models, transaction
 
 from wt.att_subscriptions.models import ATTSubscription
 from wt.sprint_subscriptions.models import SprintSubscription
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
+from wt.usage.utils import chunks, supports_on_conflict
+
+from .base_models import USAGE_TYPES, UsageRecord, AggregatedUsageRecord
+
+# (subscription_type, subscription_id, usage_type)
+TotalKey = Tuple[int, int, str]
 
-from .base_models import UsageRecord, AggregatedUsageRecord
+TOTALS_UPSERT_CHUNK_SIZE = 100
 
 
 class DataUsageRecord(UsageRecord):
@@ -11,9 +21,14 @@ class DataUsageRecord(UsageRecord):
     kilobytes_used = models.IntegerField(null=False)
 
     USAGE_FIELD = 'kilobytes_used'
+    USAGE_TYPE = USAGE_TYPES.data
 
     class Meta:
         db_table = 'usages_data'
+        indexes = [
+            models.Index(fields=['subscription_type', 'subscription_id', 'usage_day'], name='usages_data_sub_day_idx'),
+            models.Index(fields=['usage_day'], name='usages_data_day_idx'),
+        ]
 
 
 class VoiceUsageRecord(UsageRecord):
@@ -21,9 +36,14 @@ class VoiceUsageRecord(UsageRecord):
     seconds_used = models.IntegerField(null=False)
 
     USAGE_FIELD = 'seconds_used'
+    USAGE_TYPE = USAGE_TYPES.voice
 
     class Meta:
         db_table = 'usages_voice'
+        indexes = [
+            models.Index(fields=['subscription_type', 'subscription_id', 'usage_day'], name='usages_voice_sub_day_idx'),
+            models.Index(fields=['usage_day'], name='usages_voice_day_idx'),
+        ]
 
 
 class AggregatedDataUsageRecord(AggregatedUsageRecord):
@@ -31,9 +51,19 @@ class AggregatedDataUsageRecord(AggregatedUsageRecord):
     kilobytes_used = models.IntegerField(default=0)
 
     BASE_MODEL = DataUsageRecord
+    USAGE_FIELD = DataUsageRecord.USAGE_FIELD
+    USAGE_TYPE = DataUsageRecord.USAGE_TYPE
 
     class Meta:
         db_table = 'usages_agg_data'
+        indexes = [
+            models.Index(fields=['usage_date'], name='usages_agg_data_day_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription_type', 'subscription_id', 'usage_date'], name='usages_agg_data_sub_day_uniq'
+            ),
+        ]
 
 
 class AggregatedVoiceUsageRecord(AggregatedUsageRecord):
@@ -41,6 +71,153 @@ class AggregatedVoiceUsageRecord(AggregatedUsageRecord):
     seconds_used = models.IntegerField(default=0)
 
     BASE_MODEL = VoiceUsageRecord
+    USAGE_FIELD = VoiceUsageRecord.USAGE_FIELD
+    USAGE_TYPE = VoiceUsageRecord.USAGE_TYPE
 
     class Meta:
         db_table = 'usages_agg_voice'
+        indexes = [
+            models.Index(fields=['usage_date'], name='usages_agg_voice_day_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription_type', 'subscription_id', 'usage_date'], name='usages_agg_voice_sub_day_uniq'
+            ),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """High-water mark of incremental rollup for aggregated usage model"""
+    model = models.CharField(max_length=100, unique=True)  # label of aggregated usage model
+    # every raw record up to this primary key has been scanned (see `AggregatedUsageRecord.populate_incremental`)
+    last_id = models.BigIntegerField(default=0)
+    # the greatest primary key seen by a run and when it was seen: it becomes the mark once the lag passes
+    seen_id = models.BigIntegerField(default=0)
+    seen_at = models.DateTimeField(null=True)
+    rows_folded = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'usages_rollup_watermarks'
+
+
+class SubscriptionUsageTotal(models.Model):
+    """Running total of usage and price of subscription by usage type over the whole history: raw and aggregated
+        usage records"""
+    subscription_type = models.PositiveSmallIntegerField(choices=SUBSCRIPTION_TYPES)
+    subscription_id = models.IntegerField()
+    usage_type = models.CharField(max_length=10, choices=USAGE_TYPES)
+    usage = models.BigIntegerField(default=0)
+    price = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+
+    class Meta:
+        db_table = 'usages_totals'
+        indexes = [
+            # range scan of subscriptions exceeding price limit
+            models.Index(fields=['subscription_type', 'price'], name='usages_totals_price_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription_type', 'subscription_id', 'usage_type'], name='usages_totals_sub_type_uniq'
+            ),
+        ]
+
+    @classmethod
+    def add_records(cls, added: Iterable[models.Model], removed: Iterable[models.Model] = ()) -> None:
+        """Adds usage and price of `added` raw or aggregated usage records to totals and subtracts ones of `removed`"""
+        totals = {}
+        for records, sign in [(added, 1), (removed, -1)]:
+            for record in records:
+                if record.subscription_type is None:
+                    continue
+                key = (record.subscription_type, record.subscription_id, record.USAGE_TYPE)
+                # values assigned to unsaved fields aren't converted to python types yet
+                record_usage = record._meta.get_field(record.USAGE_FIELD).to_python(getattr(record, record.USAGE_FIELD))
+                record_price = record._meta.get_field('price').to_python(record.price)
+                usage, price = totals.get(key, (0, Decimal(0)))
+                totals[key] = (usage + sign * record_usage, price + sign * record_price)
+        cls.add(totals)
+
+    @classmethod
+    def add(cls, totals: Dict[TotalKey, Tuple[int, Decimal]]) -> None:
+        """Adds usage and price to totals by (subscription, usage type) keys creating missing totals"""
+        upsert = cls._add_on_conflict if supports_on_conflict() else cls._add_fallback
+        for keys in chunks(totals, TOTALS_UPSERT_CHUNK_SIZE):
+            upsert({key: totals[key] for key in keys})
+
+    @classmethod
+    def _add_on_conflict(cls, totals: Dict[TotalKey, Tuple[int, Decimal]]) -> None:
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        fields = [
+            cls._meta.get_field(name)
+            for name in ['subscription_type', 'subscription_id', 'usage_type', 'usage', 'price']
+        ]
+        key_columns = ', '.join(qn(field.column) for field in fields[:3])
+        usage_column, price_column = qn(fields[3].column), qn(fields[4].column)
+
+        params = [
+            field.get_db_prep_save(value, connection)
+            for key, values in totals.items() for field, value in zip(fields, (*key, *values))
+        ]
+        placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(totals))
+        sql = (
+            f'INSERT INTO {table} ({", ".join(qn(field.column) for field in fields)}) VALUES {placeholders} '
+            f'ON CONFLICT ({key_columns}) DO UPDATE SET '
+            f'{usage_column} = {table}.{usage_column} + EXCLUDED.{usage_column}, '
+            f'{price_column} = {table}.{price_column} + EXCLUDED.{price_column}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @classmethod
+    @transaction.atomic()
+    def _add_fallback(cls, totals: Dict[TotalKey, Tuple[int, Decimal]]) -> None:
+        condition = models.Q()
+        for subscription_type, usage_type in {(key[0], key[2]) for key in totals}:
+            ids = {key[1] for key in totals if key[0] == subscription_type and key[2] == usage_type}
+            condition |= models.Q(subscription_type=subscription_type, usage_type=usage_type, subscription_id__in=ids)
+
+        existing = cls.objects.select_for_update().filter(condition)
+        existing = {(r.subscription_type, r.subscription_id, r.usage_type): r for r in existing}
+
+        to_update, to_create = [], []
+        for key, (usage, price) in totals.items():
+            record = existing.get(key)
+            if record is None:
+                subscription_type, subscription_id, usage_type = key
+                record = cls(
+                    subscription_type=subscription_type, subscription_id=subscription_id, usage_type=usage_type
+                )
+                to_create.append(record)
+            else:
+                to_update.append(record)
+            record.usage += usage
+            record.price += price
+
+        cls.objects.bulk_update(to_update, ['usage', 'price'])
+        cls.objects.bulk_create(to_create)
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild(cls) -> int:
+        """Replaces all totals with ones counted from raw and aggregated usage records. Returns count of totals"""
+        totals = {}
+        for model in [DataUsageRecord, VoiceUsageRecord, AggregatedDataUsageRecord, AggregatedVoiceUsageRecord]:
+            rows = model.objects.filter(subscription_type__isnull=False).group_aggregate()
+            for row in rows.iterator():
+                key = (row['id_field'], row['id_value'], model.USAGE_TYPE)
+                usage, price = totals.get(key, (0, Decimal(0)))
+                totals[key] = (usage + row['agg_usage'], price + row['agg_price'])
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create(
+            [
+                cls(subscription_type=subscription_type, subscription_id=subscription_id, usage_type=usage_type,
+                    usage=usage, price=price)
+                for (subscription_type, subscription_id, usage_type), (usage, price) in totals.items()
+            ],
+            batch_size=TOTALS_UPSERT_CHUNK_SIZE
+        )
+        return len(totals)
@@ -0,0 +1,163 @@
+"""Optional PostgreSQL declarative range partitioning of raw usage tables by usage day.
+
+Raw usage table is converted once (`manage.py usage_partitions --convert`), then the same command pre-creates daily
+partitions for upcoming days. Rolled up day is retired by detaching and dropping its partition instead of deleting
+rows one by one. Rows without usage day or of days without partition are kept in the default partition.
+"""
+import datetime
+
+from decimal import Decimal
+from typing import Iterator, List, Optional, Tuple, Type
+
+from django.db import connection, models, transaction
+
+PARTITION_KEY = 'usage_day'
+DEFAULT_PARTITION_SUFFIX = '_default'
+RETIRING_PARTITION_SUFFIX = '_retiring'
+
+
+def is_supported() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def table_exists(name: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [connection.ops.quote_name(name)])
+        return cursor.fetchone()[0]
+
+
+def is_partitioned(model: Type[models.Model]) -> bool:
+    """Returns whether table of given model is partitioned"""
+    if not is_supported():
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+            'WHERE c.oid = to_regclass(%s)',
+            [connection.ops.quote_name(model._meta.db_table)]
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partition_name(model: Type[models.Model], date: datetime.date) -> str:
+    return f'{model._meta.db_table}_p{date:%Y%m%d}'
+
+
+def get_date_literal(date: datetime.date) -> str:
+    """Returns quoted SQL literal of given date. Partition bounds are inlined: bound parameters are rendered by
+        psycopg2 as `'...'::date` casts, which PostgreSQL accepts in partition bounds only since version 12"""
+    if not isinstance(date, datetime.date) or isinstance(date, datetime.datetime):
+        raise TypeError(f'Partition bound should be a date, not {date!r}')
+    return f"'{date.isoformat()}'"
+
+
+def create_partitions(model: Type[models.Model], from_date: datetime.date, to_date: datetime.date) -> List[str]:
+    """Creates missing daily partitions for every day within given period. Returns names of created partitions"""
+    qn = connection.ops.quote_name
+    created = []
+    with connection.cursor() as cursor:
+        for idx in range((to_date - from_date).days + 1):
+            date = from_date + datetime.timedelta(days=idx)
+            name = get_partition_name(model, date)
+            if table_exists(name):
+                continue
+            cursor.execute(
+                f'CREATE TABLE {qn(name)} PARTITION OF {qn(model._meta.db_table)} '
+                f'FOR VALUES FROM ({get_date_literal(date)}) TO ({get_date_literal(date + datetime.timedelta(days=1))})'
+            )
+            created.append(name)
+    return created
+
+
+@transaction.atomic()
+def convert_to_partitioned(model: Type[models.Model]) -> None:
+    """Replaces table of given model with the same table partitioned by usage day moving all rows to it"""
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    old_table = f'{table}_unpartitioned'
+    pk_column = model._meta.pk.column
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old_table)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(old_table)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ({qn(PARTITION_KEY)})'
+        )
+        cursor.execute(f'CREATE TABLE {qn(table + DEFAULT_PARTITION_SUFFIX)} PARTITION OF {qn(table)} DEFAULT')
+
+        # primary key sequence is dropped together with the table owning it
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [qn(old_table), pk_column])
+        sequence = cursor.fetchone()[0]
+        if sequence is not None:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.{qn(pk_column)}')
+
+        cursor.execute(f'SELECT MIN({qn(PARTITION_KEY)}), MAX({qn(PARTITION_KEY)}) FROM {qn(old_table)}')
+        min_date, max_date = cursor.fetchone()
+        if min_date is not None:
+            create_partitions(model, min_date, max_date)
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old_table)}')
+        cursor.execute(f'DROP TABLE {qn(old_table)}')
+
+        # unique constraints of partitioned table must include partition key, so primary key is indexed only
+        cursor.execute(f'CREATE INDEX {qn(table + "_pk_idx")} ON {qn(table)} ({qn(pk_column)})')
+        for field in model._meta.concrete_fields:
+            if not field.is_relation:
+                continue
+            related_table = field.related_model._meta.db_table
+            related_column = field.target_field.column
+            cursor.execute(
+                f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(f"{table}_{field.column}_fk")} '
+                f'FOREIGN KEY ({qn(field.column)}) REFERENCES {qn(related_table)} ({qn(related_column)}) '
+                f'DEFERRABLE INITIALLY DEFERRED'
+            )
+            cursor.execute(f'CREATE INDEX {qn(f"{table}_{field.column}_idx")} ON {qn(table)} ({qn(field.column)})')
+
+    with connection.schema_editor() as schema_editor:
+        for index in model._meta.indexes:
+            schema_editor.add_index(model, index)
+
+
+def detach_day_partition(model: Type[models.Model], date: datetime.date) -> Optional[str]:
+    """Detaches partition of given day from partitioned table, so rows of this day inserted later go to the default
+        partition. Returns name of detached table or None if there is no partition for given day. Partition detached
+        by unfinished rollup is returned again"""
+    qn = connection.ops.quote_name
+    name = get_partition_name(model, date)
+    retiring_name = name + RETIRING_PARTITION_SUFFIX
+
+    # short transaction: detaching locks the whole partitioned table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if table_exists(retiring_name):
+            return retiring_name
+        if not table_exists(name):
+            return None
+        cursor.execute(f'ALTER TABLE {qn(model._meta.db_table)} DETACH PARTITION {qn(name)}')
+        cursor.execute(f'ALTER TABLE {qn(name)} RENAME TO {qn(retiring_name)}')
+    return retiring_name
+
+
+def aggregate_table(model: Type[models.Model], table: str) -> Iterator[Tuple[int, int, int, Decimal]]:
+    """Yields total usage and price by subscription (`subscription_type`, `subscription_id`, usage, price) of
+        detached partition of model's table"""
+    qn = connection.ops.quote_name
+    usage_column = qn(model._meta.get_field(model.USAGE_FIELD).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT subscription_type, subscription_id, SUM({usage_column}), SUM(price) FROM {qn(table)} '
+            f'WHERE subscription_type IS NOT NULL GROUP BY subscription_type, subscription_id '
+            f'HAVING SUM({usage_column}) > 0 OR SUM(price) <> 0'
+        )
+        yield from cursor
+
+
+def count_rows(table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+def drop_table(table: str) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
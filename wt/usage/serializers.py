@@ -0,0 +1,21 @@
+from rest_framework.serializers import Serializer, ChoiceField, DateField, ValidationError
+
+from .export import EXPORT_FORMATS, EXPORT_MODELS, get_export_formats
+
+
+class UsageExportRequestSerializer(Serializer):
+    from_date = DateField(required=True)
+    to_date = DateField(required=True)
+    model = ChoiceField(choices=list(EXPORT_MODELS), required=True)
+    format = ChoiceField(choices=EXPORT_FORMATS, required=False)
+
+    def validate_format(self, value):
+        if value not in get_export_formats():
+            raise ValidationError(f'Format `{value}` requires `pyarrow` package')
+        return value
+
+    def validate(self, attrs):
+        if attrs['from_date'] > attrs['to_date']:
+            raise ValidationError('`from_date` should not be after `to_date`')
+        attrs.setdefault('format', get_export_formats()[0])
+        return attrs
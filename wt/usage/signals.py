@@ -0,0 +1,17 @@
+import datetime
+
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.dispatch import Signal
+
+# sent with raw usage model as sender and set of affected usage days (`dates`) whenever usage totals may change:
+# usage records are written (saved, deleted or ingested) or rolled up into aggregated usage model
+usage_changed = Signal(providing_args=['dates'])
+
+
+def send_usage_changed(usage_model, dates: Iterable[Optional[datetime.date]]) -> None:
+    """Sends `usage_changed` when the current transaction is committed (at once outside of transactions), so reports
+        computed by concurrent requests from data before commit are invalidated too"""
+    dates = set(dates)
+    transaction.on_commit(lambda: usage_changed.send(sender=usage_model, dates=dates))
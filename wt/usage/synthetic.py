@@ -0,0 +1,196 @@
+"""Reproducible synthetic data for benchmarks: plans, subscriptions of both carriers, purchases and raw data/voice
+usage records with realistic skew.
+
+Usage is skewed by subscription (Zipf-like: the first subscriptions of a carrier produce most of the rows) and by amount
+(log-normal usage per record). Rows are written with `bulk_create` in chunks, running totals are updated per chunk the
+same way bulk ingest does.
+"""
+import datetime
+import random
+
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import accumulate
+from typing import Dict, List, Type
+
+from django.contrib.auth import get_user_model
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from wt.att_subscriptions.models import ATTSubscription
+from wt.plans.models import Plan
+from wt.purchases.models import Purchase
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.usage.base_models import UsageRecord, get_subscription_fields
+from wt.usage.models import DataUsageRecord, SubscriptionUsageTotal, VoiceUsageRecord
+from wt.usage.signals import send_usage_changed
+from wt.usage.utils import chunks
+
+GENERATE_CHUNK_SIZE = 5000
+
+SYNTHETIC_USERNAME = 'synthetic'
+
+# weight of subscription of rank `r` (starting with 1) is `1 / r ** ZIPF_EXPONENT`
+ZIPF_EXPONENT = 1.1
+
+# (mu, sigma) of log-normal usage per record: ~400 kilobytes and ~1 minute on average
+USAGE_DISTRIBUTIONS = {
+    DataUsageRecord: (6.0, 1.0),
+    VoiceUsageRecord: (4.0, 0.8),
+}
+
+PRICE_QUANTUM = Decimal('0.01')
+PRICE_MAX = Decimal('999.99')  # max_digits=5, decimal_places=2 of UsageRecord.price
+
+SUBSCRIPTION_MODELS = [ATTSubscription, SprintSubscription]
+
+PURCHASE_STATUSES = [status for status, _ in Purchase.STATUS]
+
+
+@contextmanager
+def temporary_test_database():
+    """Replaces configured database with a fresh test database of the same backend within the block, so synthetic
+        data never touches configured data"""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def bulk_create_ids(model: Type[models.Model], objects: List[models.Model]) -> List[int]:
+    """Creates objects and returns their primary keys (not every backend returns them from `bulk_create`)"""
+    last_id = model.objects.aggregate(last_id=models.Max('id'))['last_id'] or 0
+    model.objects.bulk_create(objects, batch_size=GENERATE_CHUNK_SIZE)
+    return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+
+def generate_subscriptions(rnd: random.Random, count: int) -> Dict[Type[models.Model], List[int]]:
+    """Creates plans and `count` subscriptions split between carriers. Returns ids of subscriptions by model"""
+    user, _ = get_user_model().objects.get_or_create(username=SYNTHETIC_USERNAME)
+    plan_ids = bulk_create_ids(Plan, [
+        Plan(name=f'synthetic {idx}', price=Decimal(10 * idx), data_available=1024 * 1024 * idx)
+        for idx in range(1, 6)
+    ])
+
+    now = timezone.now()
+    subscription_ids = {}
+    for model_idx, model in enumerate(SUBSCRIPTION_MODELS):
+        model_count = count // len(SUBSCRIPTION_MODELS) + (model_idx < count % len(SUBSCRIPTION_MODELS))
+        subscription_ids[model] = bulk_create_ids(model, [
+            model(
+                user=user, plan_id=rnd.choice(plan_ids), status=model.STATUS.active, device_id=f'device {idx}',
+                phone_number=f'{idx:010d}', effective_date=now - datetime.timedelta(days=rnd.randint(0, 365))
+            )
+            for idx in range(model_count)
+        ])
+    return subscription_ids
+
+
+def generate_purchases(rnd: random.Random, subscription_ids: Dict[Type[models.Model], List[int]], count: int) -> int:
+    """Creates `count` purchases of random subscriptions. Returns count of created purchases"""
+    user = get_user_model().objects.get(username=SYNTHETIC_USERNAME)
+    fields = {ATTSubscription: 'att_sub_id', SprintSubscription: 'sprint_sub_id'}
+    keys = [(fields[model], subscription_id) for model, ids in subscription_ids.items() for subscription_id in ids]
+    if not keys:
+        return 0
+
+    now = timezone.now()
+    for chunk in chunks(range(count), GENERATE_CHUNK_SIZE):
+        purchases = []
+        for _ in chunk:
+            field_name, subscription_id = rnd.choice(keys)
+            status = rnd.choice(PURCHASE_STATUSES)
+            payment_date = None
+            if status == Purchase.STATUS.complete:
+                payment_date = now - datetime.timedelta(days=rnd.randint(0, 365))
+            purchases.append(Purchase(
+                user=user, status=status, amount=Decimal(rnd.randint(100, 10000)) / 100, payment_date=payment_date,
+                **{field_name: subscription_id}
+            ))
+        Purchase.objects.bulk_create(purchases)
+    return count
+
+
+def get_price(usage: int, unit_price: Decimal) -> Decimal:
+    return min((usage * unit_price).quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP), PRICE_MAX)
+
+
+def generate_usage(
+        rnd: random.Random,
+        model: Type[UsageRecord],
+        subscription_ids: Dict[Type[models.Model], List[int]],
+        count: int,
+        from_date: datetime.date,
+        days: int,
+) -> int:
+    """Creates `count` raw usage records of given model within `days` days starting with `from_date`. Returns count of
+        created records"""
+    keys = [
+        (subscription_model, subscription_id)
+        for subscription_model, ids in subscription_ids.items() for subscription_id in ids
+    ]
+    if not keys:
+        return 0
+    # the same ranks for both carriers, so both of them have heavy users
+    ranks = [rank for ids in subscription_ids.values() for rank in range(1, len(ids) + 1)]
+    cum_weights = list(accumulate(1 / rank ** ZIPF_EXPONENT for rank in ranks))
+    mu, sigma = USAGE_DISTRIBUTIONS[model]
+    unit_price_field = 'ONE_KILOBYTE_PRICE' if model is DataUsageRecord else 'ONE_SECOND_PRICE'
+    start = timezone.make_aware(datetime.datetime.combine(from_date, datetime.time()))
+
+    dates = set()
+    for chunk in chunks(range(count), GENERATE_CHUNK_SIZE):
+        records = []
+        for subscription_model, subscription_id in rnd.choices(keys, cum_weights=cum_weights, k=len(chunk)):
+            usage = int(rnd.lognormvariate(mu, sigma))
+            record = model(
+                **get_subscription_fields(subscription_model.SUBSCRIPTION_TYPE, subscription_id),
+                **{model.USAGE_FIELD: usage},
+                price=get_price(usage, getattr(subscription_model, unit_price_field)),
+                usage_date=start + datetime.timedelta(seconds=rnd.randrange(days * 24 * 60 * 60)),
+            )
+            record.fill_computed_fields()
+            dates.add(record.usage_day)
+            records.append(record)
+
+        with transaction.atomic():
+            model.objects.bulk_create(records)
+            SubscriptionUsageTotal.add_records(records)
+
+    send_usage_changed(model, dates)
+    return count
+
+
+def generate(
+        subscriptions: int,
+        usage_records: int,
+        days: int = 30,
+        to_date: datetime.date = None,
+        purchases: int = None,
+        seed: int = 0,
+) -> Dict[str, int]:
+    """Generates synthetic data: the same arguments produce the same data. Returns counts of created objects by kind
+
+    Args:
+        subscriptions (int): count of subscriptions (split between carriers)
+        usage_records (int): count of raw usage records (split between data and voice usage)
+        days (int, Optional): count of days with usage
+        to_date (date, Optional): the last day with usage (today by default)
+        purchases (int, Optional): count of purchases (one per subscription by default)
+        seed (int, Optional): seed of random generator
+    """
+    rnd = random.Random(seed)
+    to_date = to_date or timezone.localdate()
+    from_date = to_date - datetime.timedelta(days=days - 1)
+
+    subscription_ids = generate_subscriptions(rnd, subscriptions)
+    counts = {
+        'subscriptions': subscriptions,
+        'purchases': generate_purchases(rnd, subscription_ids, subscriptions if purchases is None else purchases),
+    }
+    for idx, model in enumerate([DataUsageRecord, VoiceUsageRecord]):
+        model_count = usage_records // 2 + (idx < usage_records % 2)
+        counts[model._meta.db_table] = generate_usage(rnd, model, subscription_ids, model_count, from_date, days)
+    return counts
@@ -1,5 +1,26 @@
+import gzip
+import json
+import os
+import tempfile
+
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, models, transaction
+from rest_framework.reverse import reverse
+
+from wt.att_subscriptions.models import ATTSubscription
+from wt.purchases.models import Purchase
+from wt.sprint_subscriptions.models import SprintSubscription
+from wt.subscriptions.models import SUBSCRIPTION_TYPES
 from wt.tests import BaseAPITestCase
-from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord, DataUsageRecord, VoiceUsageRecord
+from wt.usage import export, partitioning, synthetic
+from wt.usage.ingest import ingest
+from wt.usage.models import AggregatedDataUsageRecord, AggregatedVoiceUsageRecord, DataUsageRecord, VoiceUsageRecord, \
+    RollupWatermark, SubscriptionUsageTotal
 
 
 class PopulateTestCase(BaseAPITestCase):
@@ -55,3 +76,444 @@ class PopulateTestCase(BaseAPITestCase):
         # and test that other records stay ok
         att_record.refresh_from_db()
         self.assertEqual(str(att_record.price), '1.00')
+
+    def test_grouped_upsert(self):
+        subs = [self.create_att() for _ in range(5)] + [self.create_sprint() for _ in range(5)]
+        for sub in subs:
+            for _ in range(3):
+                self.create_data_usage(sub, '0.10', 10, self.today)
+        # usage without kilobytes is still billed
+        self.create_data_usage(subs[0], '1.00', 0, self.today)
+
+        # savepoint, max id, grouped select, upsert, delete, release
+        with self.assertNumQueries(6):
+            self.assertEqual(AggregatedDataUsageRecord.populate(self.today_date), 31)
+
+        self.assertEqual(AggregatedDataUsageRecord.objects.count(), 10)
+        record = AggregatedDataUsageRecord.objects.get(att_subscription=subs[0])
+        self.assertEqual(record.kilobytes_used, 30)
+        self.assertEqual(str(record.price), '1.30')
+        record = AggregatedDataUsageRecord.objects.get(sprint_subscription=subs[-1])
+        self.assertEqual(record.kilobytes_used, 30)
+        self.assertEqual(str(record.price), '0.30')
+
+
+class UpsertTestCase(BaseAPITestCase):
+    def check_upsert(self, upsert):
+        sub_att, sub_sprint = self.create_att(), self.create_sprint()
+        totals = {
+            (SUBSCRIPTION_TYPES.att, sub_att.id, self.today_date): (10, Decimal('1.00')),
+            (SUBSCRIPTION_TYPES.sprint, sub_sprint.id, self.today_date): (20, Decimal('2.00')),
+            (SUBSCRIPTION_TYPES.att, sub_att.id, self.tomorrow_date): (30, Decimal('3.00')),
+        }
+        upsert(totals)
+        upsert(totals)
+
+        self.assertEqual(AggregatedVoiceUsageRecord.objects.count(), 3)
+        for (subscription_type, subscription_id, date), (usage, price) in totals.items():
+            record = AggregatedVoiceUsageRecord.objects.get(
+                subscription_type=subscription_type, subscription_id=subscription_id, usage_date=date
+            )
+            subscription_field = 'att_subscription_id' if subscription_type == SUBSCRIPTION_TYPES.att \
+                else 'sprint_subscription_id'
+            self.assertEqual(getattr(record, subscription_field), subscription_id)
+            self.assertEqual(record.seconds_used, usage * 2)
+            self.assertEqual(record.price, price * 2)
+
+    def test_upsert(self):
+        self.check_upsert(AggregatedVoiceUsageRecord.upsert_usage)
+
+    def test_fallback(self):
+        self.check_upsert(AggregatedVoiceUsageRecord._upsert_usage_fallback)
+
+    def test_unique(self):
+        sub = self.create_att()
+        AggregatedDataUsageRecord.objects.create(att_subscription=sub, usage_date=self.today_date)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AggregatedDataUsageRecord.objects.create(att_subscription=sub, usage_date=self.today_date)
+        # the same id of subscription of another carrier is fine
+        sub = self.create_sprint()
+        record = AggregatedDataUsageRecord.objects.create(sprint_subscription=sub, usage_date=self.today_date)
+        self.assertEqual((record.subscription_type, record.subscription_id), (SUBSCRIPTION_TYPES.sprint, sub.id))
+
+
+class IncrementalPopulateTestCase(BaseAPITestCase):
+    def test_correct(self):
+        sub_att, sub_sprint = self.create_basic_test_set()
+
+        # small batches: 4 data records are folded by 3 batches
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(batch_size=2, max_batches=1), 2)
+        self.assertEqual(DataUsageRecord.objects.count(), 2)
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(batch_size=2), 2)
+        self.assertFalse(DataUsageRecord.objects.exists())
+
+        watermark = RollupWatermark.objects.get(model='usage.AggregatedDataUsageRecord')
+        self.assertEqual(watermark.rows_folded, 4)
+
+        att_today = AggregatedDataUsageRecord.objects.get(att_subscription=sub_att, usage_date=self.today_date)
+        self.assertEqual(att_today.kilobytes_used, 101)
+        self.assertEqual(att_today.price, 2)
+        att_tomorrow = AggregatedDataUsageRecord.objects.get(att_subscription=sub_att, usage_date=self.tomorrow_date)
+        self.assertEqual(att_tomorrow.kilobytes_used, 10)
+        sprint_tomorrow = AggregatedDataUsageRecord.objects.get(sprint_subscription=sub_sprint)
+        self.assertEqual(sprint_tomorrow.kilobytes_used, 5)
+
+        # late records are folded into existing aggregated records
+        self.create_data_usage(sub_att, '0.50', 9, self.today)
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(), 1)
+        att_today.refresh_from_db()
+        self.assertEqual(att_today.kilobytes_used, 110)
+        self.assertEqual(str(att_today.price), '2.50')
+        self.assertEqual(AggregatedDataUsageRecord.objects.count(), 3)
+
+        # nothing new
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(), 0)
+
+        # and whole-day rollup sees the same aggregated records
+        self.create_data_usage(sub_att, 1, 1, self.today)
+        AggregatedDataUsageRecord.populate(self.today_date)
+        att_today.refresh_from_db()
+        self.assertEqual(att_today.kilobytes_used, 111)
+        self.assertEqual(AggregatedDataUsageRecord.objects.count(), 3)
+
+    def test_late_commit(self):
+        sub = self.create_att()
+        self.create_data_usage(sub, 1, 1, self.today)
+        record = self.create_data_usage(sub, 1, 10, self.today)
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(), 2)
+
+        # a record with lower primary key is committed after a greater one has been folded
+        DataUsageRecord.objects.create(
+            id=record.id - 1, att_subscription=sub, kilobytes_used=100, price=1, usage_date=self.today
+        )
+        self.assertEqual(AggregatedDataUsageRecord.populate_incremental(), 1)
+        self.assertEqual(AggregatedDataUsageRecord.objects.get().kilobytes_used, 111)
+
+        # the mark reaches seen primary key once the lag has passed
+        watermark = RollupWatermark.objects.get(model='usage.AggregatedDataUsageRecord')
+        self.assertEqual((watermark.last_id, watermark.seen_id), (0, record.id))
+        AggregatedDataUsageRecord.populate_incremental(lag=timedelta(0))
+        watermark.refresh_from_db()
+        self.assertEqual(watermark.last_id, record.id)
+
+
+class UsageDayTestCase(BaseAPITestCase):
+    def test_filled_on_save(self):
+        sub = self.create_att()
+        record = self.create_data_usage(sub, 1, 1, self.tomorrow)
+        self.assertEqual(record.usage_day, self.tomorrow_date)
+        self.assertEqual((record.subscription_type, record.subscription_id), (SUBSCRIPTION_TYPES.att, sub.id))
+
+        record.usage_date = self.today
+        record.save()
+        record.refresh_from_db()
+        self.assertEqual(record.usage_day, self.today_date)
+
+        self.assertEqual(list(DataUsageRecord.objects.on_day(self.today_date)), [record])
+        self.assertFalse(DataUsageRecord.objects.within_days(self.tomorrow_date, self.tomorrow_date).exists())
+
+
+class BulkIngestTestCase(BaseAPITestCase):
+    url = reverse('usage-bulk')
+
+    def test_ndjson(self):
+        sub_att, sub_sprint = self.create_att(), self.create_sprint()
+        events = [
+            {'usage_type': 'data', 'subscription_type': 'att', 'subscription_id': sub_att.id, 'usage': 10,
+             'price': '0.10', 'usage_date': self.today.isoformat()},
+            {'usage_type': 'voice', 'subscription_type': 'sprint', 'subscription_id': sub_sprint.id, 'usage': 20,
+             'price': '1.50', 'usage_date': self.tomorrow.isoformat()},
+            # rejected: unknown subscription, wrong price, missing fields
+            {'usage_type': 'data', 'subscription_type': 'att', 'subscription_id': sub_att.id + 100, 'usage': 1,
+             'price': '1', 'usage_date': self.today.isoformat()},
+            {'usage_type': 'data', 'subscription_type': 'att', 'subscription_id': sub_att.id, 'usage': 1,
+             'price': '0.001', 'usage_date': self.today.isoformat()},
+            {'usage_type': 'voice'},
+        ]
+        body = '\n'.join(json.dumps(event) for event in events) + '\nnot json\n'
+
+        response = self.client.post(self.url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(result['rejected'], 4)
+        self.assertEqual(sorted(error['line'] for error in result['errors']), [3, 4, 5, 6])
+
+        data_record = DataUsageRecord.objects.get()
+        self.assertEqual(data_record.att_subscription_id, sub_att.id)
+        self.assertEqual(data_record.kilobytes_used, 10)
+        self.assertEqual(str(data_record.price), '0.10')
+        self.assertEqual(data_record.usage_day, self.today_date)
+
+        voice_record = VoiceUsageRecord.objects.get()
+        self.assertEqual(voice_record.sprint_subscription_id, sub_sprint.id)
+        self.assertEqual(voice_record.usage_day, self.tomorrow_date)
+
+    def test_csv(self):
+        sub = self.create_att()
+        lines = ['usage_type,subscription_type,subscription_id,usage,price,usage_date']
+        lines += [f'data,att,{sub.id},{idx},0.01,{self.today.isoformat()}' for idx in range(10)]
+        lines.append(f'voice,att,{sub.id},1,0.01,not-a-date')
+
+        response = self.client.post(self.url, data='\n'.join(lines), content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'accepted': 10,
+            'rejected': 1,
+            'errors': [{'line': 12, 'error': '`usage_date` should be an ISO 8601 datetime'}]
+        })
+        self.assertEqual(DataUsageRecord.objects.filter(att_subscription=sub).count(), 10)
+
+    def test_invalid_utf8(self):
+        sub = self.create_att()
+        lines = [b'usage_type,subscription_type,subscription_id,usage,price,usage_date']
+        lines += [f'data,att,{sub.id},{idx},0.01,{self.today.isoformat()}'.encode() for idx in range(3)]
+        lines.insert(2, b'data,att,\xff\xfe,1,0.01,' + self.today.isoformat().encode())
+
+        result = ingest(lines, 'csv')
+        self.assertEqual(result, {'accepted': 3, 'rejected': 1, 'errors': [{'line': 3, 'error': 'Invalid UTF-8'}]})
+
+        # invalid line of JSON is rejected like any other invalid JSON
+        result = ingest([b'{"usage_type": "\xff"}'])
+        self.assertEqual(result['errors'], [{'line': 1, 'error': 'Invalid JSON'}])
+
+    def test_incorrect_types(self):
+        sub = self.create_att()
+        event = {'usage_type': 'data', 'subscription_type': 'att', 'subscription_id': sub.id, 'usage': 10,
+                 'price': '0.10', 'usage_date': self.today.isoformat()}
+        events = [
+            {**event, 'usage_type': ['data']},
+            {**event, 'subscription_type': {'att': 1}},
+            {**event, 'usage': 1.7},
+            {**event, 'usage': True},
+            {**event, 'usage': '1.0'},
+            {**event, 'usage': 10 ** 12},
+            {**event, 'subscription_id': sub.id + 0.9},
+            {**event, 'subscription_id': 10 ** 12},
+            {**event, 'usage': str(10)},
+        ]
+        body = '\n'.join(json.dumps(event) for event in events)
+
+        # bad events are rejected without failing the batch
+        response = self.client.post(self.url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['accepted'], result['rejected']), (1, 8))
+        self.assertEqual(DataUsageRecord.objects.get().kilobytes_used, 10)
+
+
+class SubscriptionUsageTotalTestCase(BaseAPITestCase):
+    def get_totals(self):
+        return {
+            (total.subscription_type, total.subscription_id, total.usage_type): (total.usage, str(total.price))
+            for total in SubscriptionUsageTotal.objects.all()
+        }
+
+    def test_correct(self):
+        sub_att, sub_sprint = self.create_basic_test_set()
+        totals = self.get_totals()
+        self.assertEqual(
+            {key: price for key, (_, price) in totals.items()},
+            {
+                (SUBSCRIPTION_TYPES.att, sub_att.id, 'data'): '3.00',
+                (SUBSCRIPTION_TYPES.att, sub_att.id, 'voice'): '1.00',
+                (SUBSCRIPTION_TYPES.sprint, sub_sprint.id, 'data'): '1.00',
+                (SUBSCRIPTION_TYPES.sprint, sub_sprint.id, 'voice'): '3.00',
+            }
+        )
+
+        # updated and deleted records
+        usage, _ = totals[(SUBSCRIPTION_TYPES.att, sub_att.id, 'data')]
+        record = self.create_data_usage(sub_att, '0.50', 5)
+        record.price = '1.50'
+        record.save()
+        self.assertEqual(self.get_totals()[(SUBSCRIPTION_TYPES.att, sub_att.id, 'data')], (usage + 5, '4.50'))
+        record.delete()
+        self.assertEqual(self.get_totals(), totals)
+
+        # rollup moves usage between raw and aggregated records without changing totals
+        AggregatedDataUsageRecord.populate(self.today_date)
+        AggregatedVoiceUsageRecord.populate(self.today_date)
+        self.assertEqual(self.get_totals(), totals)
+
+        # ingested records
+        response = self.client.post(reverse('usage-bulk'), content_type='application/x-ndjson', data=json.dumps({
+            'usage_type': 'voice', 'subscription_type': 'sprint', 'subscription_id': sub_sprint.id, 'usage': 10,
+            'price': '2.25', 'usage_date': self.today.isoformat()
+        }))
+        self.assertEqual(response.json()['accepted'], 1)
+        usage, _ = totals[(SUBSCRIPTION_TYPES.sprint, sub_sprint.id, 'voice')]
+        totals[(SUBSCRIPTION_TYPES.sprint, sub_sprint.id, 'voice')] = (usage + 10, '5.25')
+        self.assertEqual(self.get_totals(), totals)
+
+        # rebuilt from scratch
+        SubscriptionUsageTotal.objects.update(usage=0, price=0)
+        out = StringIO()
+        call_command('rebuild_usage_totals', stdout=out)
+        self.assertIn('Rebuilt 4 totals', out.getvalue())
+        self.assertEqual(self.get_totals(), totals)
+
+    def test_fallback(self):
+        sub = self.create_att()
+        key = (SUBSCRIPTION_TYPES.att, sub.id, 'data')
+        SubscriptionUsageTotal._add_fallback({key: (1, Decimal('1.10'))})
+        SubscriptionUsageTotal._add_fallback({key: (2, Decimal('0.20'))})
+        self.assertEqual(self.get_totals(), {key: (3, '1.30')})
+
+
+class RollupCommandTestCase(BaseAPITestCase):
+    def test_rollup(self):
+        self.create_basic_test_set()
+
+        out = StringIO()
+        call_command('rollup_usage', '--from', str(self.today_date), '--to', str(self.tomorrow_date), stdout=out)
+        self.assertFalse(DataUsageRecord.objects.exists())
+        self.assertFalse(VoiceUsageRecord.objects.exists())
+        self.assertEqual(AggregatedDataUsageRecord.objects.count(), 3)
+        self.assertEqual(AggregatedVoiceUsageRecord.objects.count(), 3)
+
+        lines = out.getvalue().splitlines()
+        self.assertIn(f'{self.today_date} data: 2 rows in', lines[0])
+        self.assertIn(f'{self.today_date} voice: 2 rows in', lines[1])
+        self.assertIn(f'{self.tomorrow_date} data: 2 rows in', lines[2])
+        self.assertIn(f'{self.tomorrow_date} voice: 2 rows in', lines[3])
+        self.assertIn('Rolled up 8 rows for 2 dates', lines[4])
+
+    def test_incremental(self):
+        self.create_basic_test_set()
+
+        out = StringIO()
+        call_command('rollup_usage', '--incremental', '--usage-type', 'voice', stdout=out)
+        self.assertIn('incremental voice: 4 rows in', out.getvalue())
+        self.assertFalse(VoiceUsageRecord.objects.exists())
+        self.assertEqual(DataUsageRecord.objects.count(), 4)
+
+    def test_partitions_not_supported(self):
+        # partitioning is PostgreSQL only: populate keeps deleting rows of not partitioned table
+        self.assertFalse(partitioning.is_partitioned(DataUsageRecord))
+        with self.assertRaises(CommandError):
+            call_command('usage_partitions')
+
+    def test_partition_bounds(self):
+        # bounds are inlined as plain literals: PostgreSQL before 12 rejects casts of bound parameters
+        self.assertEqual(partitioning.get_date_literal(self.today_date), f"'{self.today_date:%Y-%m-%d}'")
+        for value in [self.today, '2020-04-06', "2020-04-06'); DROP TABLE x; --"]:
+            with self.assertRaises(TypeError):
+                partitioning.get_date_literal(value)
+
+    def test_incorrect(self):
+        with self.assertRaises(CommandError):
+            call_command('rollup_usage', '--from', str(self.tomorrow_date), '--to', str(self.today_date))
+        with self.assertRaises(CommandError):
+            call_command('rollup_usage')
+
+
+class ExportTestCase(BaseAPITestCase):
+    url = reverse('usage-export')
+
+    @staticmethod
+    def read_json(data: bytes) -> dict:
+        # column batches are concatenated into whole columns
+        columns = {}
+        for line in gzip.decompress(data).decode().splitlines():
+            for name, values in json.loads(line).items():
+                columns.setdefault(name, []).extend(values)
+        return columns
+
+    def test_json(self):
+        sub_att, _ = self.create_basic_test_set()
+
+        response = self.client.get(self.url, {
+            'model': 'data', 'from_date': self.today_date, 'to_date': self.today_date, 'format': 'json'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        columns = self.read_json(b''.join(response.streaming_content))
+
+        records = DataUsageRecord.objects.on_day(self.today_date).order_by('id')
+        self.assertEqual(columns['id'], [record.id for record in records])
+        self.assertEqual(columns['subscription_id'], [sub_att.id] * 2)
+        self.assertEqual(columns['kilobytes_used'], [1, 100])
+        self.assertEqual(columns['price'], ['1.00', '1.00'])
+
+    def test_batches(self):
+        self.create_basic_test_set()
+        AggregatedVoiceUsageRecord.populate(self.today_date)
+
+        data = b''.join(export.iterate_json(AggregatedVoiceUsageRecord, self.today_date, self.tomorrow_date, 1))
+        self.assertEqual(len(gzip.decompress(data).splitlines()), 2)
+        self.assertEqual(sorted(self.read_json(data)['seconds_used']), [5, 20])
+
+    @skipUnless(export.pyarrow is not None, 'requires `pyarrow`')
+    def test_parquet(self):
+        self.create_basic_test_set()
+
+        file = BytesIO()
+        count = export.write_parquet(DataUsageRecord, self.today_date, self.tomorrow_date, file, chunk_size=3)
+        self.assertEqual(count, 4)
+        table = export.pyarrow.parquet.read_table(BytesIO(file.getvalue()))
+        self.assertEqual(sorted(table.column('kilobytes_used').to_pylist()), [1, 5, 10, 100])
+
+        # types are mapped by internal type of field
+        fields = {field.name: field for field in SubscriptionUsageTotal._meta.get_fields()}
+        self.assertEqual(export.get_arrow_type(fields['usage']), export.pyarrow.int64())
+        self.assertEqual(export.get_arrow_type(fields['price']), export.pyarrow.decimal128(12, 2))
+        self.assertEqual(export.get_arrow_type(fields['usage_type']), export.pyarrow.string())
+        with self.assertRaises(export.ExportError):
+            export.get_arrow_type(models.BinaryField())
+
+    def test_command(self):
+        self.create_basic_test_set()
+
+        with tempfile.TemporaryDirectory() as output:
+            out = StringIO()
+            call_command(
+                'export_usage', '--from', str(self.today_date), '--to', str(self.tomorrow_date), '--model', 'voice',
+                '--format', 'json', '--output', output, stdout=out
+            )
+            path = os.path.join(output, f'voice_{self.today_date}_{self.tomorrow_date}.json.gz')
+            self.assertIn(f'voice: {path}', out.getvalue())
+            with open(path, 'rb') as file:
+                self.assertEqual(sorted(self.read_json(file.read())['seconds_used']), [2, 5, 20, 200])
+
+    def test_incorrect(self):
+        response = self.client.get(self.url, {
+            'model': 'unknown', 'from_date': self.tomorrow_date, 'to_date': self.today_date
+        })
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(CommandError):
+            call_command('export_usage', '--from', str(self.tomorrow_date), '--to', str(self.today_date))
+
+
+class SyntheticTestCase(BaseAPITestCase):
+    @staticmethod
+    def get_totals():
+        return set(SubscriptionUsageTotal.objects.values_list('subscription_type', 'subscription_id', 'usage', 'price'))
+
+    def get_usage(self):
+        return [
+            list(model.objects.order_by('id').values_list('subscription_type', model.USAGE_FIELD, 'price', 'usage_day'))
+            for model in [DataUsageRecord, VoiceUsageRecord]
+        ]
+
+    def test_correct(self):
+        counts = synthetic.generate(10, 301, days=3, to_date=self.today_date, purchases=5)
+        self.assertEqual(counts, {'subscriptions': 10, 'purchases': 5, 'usages_data': 151, 'usages_voice': 150})
+        self.assertEqual(ATTSubscription.objects.count(), 5)
+        self.assertEqual(SprintSubscription.objects.count(), 5)
+        self.assertEqual(Purchase.objects.count(), 5)
+
+        usage = self.get_usage()
+        days = {row[3] for rows in usage for row in rows}
+        self.assertTrue(days <= {self.today_date - timedelta(days=idx) for idx in range(3)})
+
+        # bulk created records are counted in running totals
+        totals = self.get_totals()
+        SubscriptionUsageTotal.rebuild()
+        self.assertEqual(self.get_totals(), totals)
+
+        # the same seed produces the same data
+        DataUsageRecord.objects.all().delete()
+        VoiceUsageRecord.objects.all().delete()
+        synthetic.generate(10, 301, days=3, to_date=self.today_date, purchases=5)
+        self.assertEqual(self.get_usage(), usage)
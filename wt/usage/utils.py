@@ -1,3 +1,32 @@
-def chunks(lst, chunk_size):
-    for idx in range(0, len(lst), chunk_size):
-        yield lst[idx:idx + chunk_size]
+import datetime
+import itertools
+
+from typing import Optional
+
+from django.db import connection
+from django.utils import timezone
+
+
+def chunks(iterable, chunk_size):
+    """Splits iterable into lists of `chunk_size` items (the last one may be shorter) without consuming it at once"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_usage_day(usage_date: Optional[datetime.datetime]) -> Optional[datetime.date]:
+    """Returns date of given usage datetime in current timezone (the same way as `__date` lookup does)"""
+    if usage_date is None:
+        return None
+    if timezone.is_aware(usage_date):
+        usage_date = timezone.localtime(usage_date)
+    return usage_date.date()
+
+
+def supports_on_conflict() -> bool:
+    """Returns whether database supports native upsert (`INSERT ... ON CONFLICT DO UPDATE`)"""
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 24, 0))
@@ -1,3 +1,54 @@
-from django.shortcuts import render
+import tempfile
 
-# Create your views here.
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .export import EXPORT_CONTENT_TYPES, EXPORT_EXTENSIONS, EXPORT_MODELS, iterate_json, write_parquet
+from .ingest import ingest
+from .serializers import UsageExportRequestSerializer
+
+# parquet file is spooled to disk when larger than this (bytes)
+EXPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+class UsageBulkIngestView(APIView):
+    """Accepts batch of data and voice usage events as newline-delimited JSON (default) or CSV with header line
+        (`text/csv` content type)"""
+
+    def post(self, request):
+        fmt = 'csv' if request.content_type.startswith('text/csv') else 'ndjson'
+        # read raw body line by line instead of parsing it as a whole
+        lines = request.stream if request.stream is not None else []
+
+        result = ingest(lines, fmt)
+        return Response(result)
+
+
+class UsageExportView(APIView):
+    """Exports usage records of given model within given days as compressed columnar file (see `wt.usage.export`)"""
+
+    def get(self, request):
+        request_serializer = UsageExportRequestSerializer(data=request.query_params)
+        request_serializer.is_valid(True)
+        params = request_serializer.validated_data
+
+        model = EXPORT_MODELS[params['model']]
+        fmt = params['format']
+        filename = (
+            f'{params["model"]}_{params["from_date"].isoformat()}_{params["to_date"].isoformat()}.'
+            f'{EXPORT_EXTENSIONS[fmt]}'
+        )
+
+        if fmt == 'parquet':
+            # parquet footer is written last, so the file is built before response
+            file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+            write_parquet(model, params['from_date'], params['to_date'], file)
+            file.seek(0)
+            response = FileResponse(file, content_type=EXPORT_CONTENT_TYPES[fmt])
+        else:
+            response = StreamingHttpResponse(
+                iterate_json(model, params['from_date'], params['to_date']), content_type=EXPORT_CONTENT_TYPES[fmt]
+            )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response